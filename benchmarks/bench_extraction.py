@@ -0,0 +1,77 @@
+"""
+Benchmark page-parallel PyMuPDF extraction.
+
+Generates a synthetic paper (text-heavy pages with figures) and times
+PyMuPDFEngine with an increasing number of workers:
+
+    pip install -e . && python benchmarks/bench_extraction.py --pages 60 --workers 1 2 4 8
+"""
+
+import io
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+import fitz
+from PIL import Image
+
+from paper2blog.executors import configure_executors, shutdown_executors
+from paper2blog.extractors import PyMuPDFEngine
+
+PARAGRAPH = (
+    "We propose a method that improves the efficiency of attention by "
+    "restricting each query to a learned subset of keys. "
+) * 6
+
+
+def build_pdf(path: str, pages: int) -> None:
+    doc = fitz.open()
+    for page_no in range(pages):
+        page = doc.new_page()
+        page.insert_text((50, 50), f"{page_no + 1} Section {page_no + 1}", fontsize=14)
+        rect = fitz.Rect(50, 70, 550, 420)
+        page.insert_textbox(rect, PARAGRAPH * 3, fontsize=9)
+        buffer = io.BytesIO()
+        Image.effect_noise((400, 300), 64).convert("RGB").save(buffer, format="PNG")
+        page.insert_image(fitz.Rect(100, 440, 500, 740), stream=buffer.getvalue())
+        page.insert_text((100, 760), f"Figure {page_no + 1}: Results.", fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+async def time_extraction(path: str, workers: int, repeat: int) -> float:
+    configure_executors(cpu=workers)
+    engine = PyMuPDFEngine(workers=workers)
+    # Warm up the process pool so worker start-up is not measured
+    await engine.extract(path)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await engine.extract(path)
+    elapsed = (time.perf_counter() - start) / repeat
+    shutdown_executors()
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "paper.pdf")
+        build_pdf(path, args.pages)
+        print(f"{args.pages} pages, {os.cpu_count()} CPUs")
+        print(f"{'workers':>8} {'seconds':>9} {'speedup':>8}")
+        baseline = None
+        for workers in args.workers:
+            elapsed = asyncio.run(time_extraction(path, workers, args.repeat))
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>9.3f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
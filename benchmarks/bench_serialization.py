@@ -0,0 +1,115 @@
+"""
+Benchmark JSON serialization: stdlib ``json`` against ``paper2blog.serialization``
+(orjson when installed).
+
+Payloads mirror what the service handles:
+
+* a ConversionResponse with ~100 KB of markdown and a handful of figures
+  (the /convert response body and metadata.json)
+* a marker response carrying ~10 MB of base64-encoded figures
+
+    PYTHONPATH=. python benchmarks/bench_serialization.py --repeat 20
+"""
+
+import os
+import json
+import time
+import base64
+import argparse
+
+from paper2blog import serialization
+from paper2blog.model_types import BlogSection, ConversionResponse, ImageInfo
+
+PARAGRAPH = (
+    "We propose a method that improves the efficiency of attention by "
+    "restricting each query to a learned subset of keys — 注意力机制. "
+) * 4
+
+
+def build_response(markdown_bytes: int) -> dict:
+    paragraphs = [PARAGRAPH] * (markdown_bytes // len(PARAGRAPH.encode("utf-8")))
+    sections = [
+        BlogSection(heading=f"Section {i}", content="\n\n".join(paragraphs[i::8]))
+        for i in range(8)
+    ]
+    images = [
+        ImageInfo(
+            caption=f"Figure {i}: overview of the method",
+            url=f"figures/ab/{i:064d}.png",
+            markdown=f"![Figure {i}](figures/ab/{i:064d}.png)",
+        )
+        for i in range(6)
+    ]
+    response = ConversionResponse(
+        title="A Fast Method",
+        content="\n\n".join(paragraphs),
+        summary=PARAGRAPH,
+        language="english",
+        images=images,
+        tags=["attention", "efficiency"],
+        sections=sections,
+    )
+    # FastAPI hands the response class a plain dict
+    return response.model_dump()
+
+
+def build_marker_payload(image_bytes: int, figures: int = 8) -> dict:
+    size = image_bytes // figures
+    return {
+        "success": True,
+        "output": PARAGRAPH * 200,
+        "images": {
+            f"_page_{i}_Figure_0.png": base64.b64encode(os.urandom(size)).decode()
+            for i in range(figures)
+        },
+    }
+
+
+def timed(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def report(name: str, stdlib_ms: float, fast_ms: float) -> None:
+    print(
+        f"{name:<28} json {stdlib_ms:8.2f} ms   fast {fast_ms:8.2f} ms   "
+        f"x{stdlib_ms / fast_ms:5.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--markdown-kb", type=int, default=100)
+    parser.add_argument("--images-mb", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"orjson available: {serialization.HAS_ORJSON}")
+    response = build_response(args.markdown_kb * 1024)
+    marker = build_marker_payload(args.images_mb * 1024 * 1024)
+    marker_raw = json.dumps(marker).encode("utf-8")
+
+    report(
+        "response dumps",
+        timed(lambda: json.dumps(response, ensure_ascii=False).encode(), args.repeat),
+        timed(lambda: serialization.dumps(response), args.repeat),
+    )
+    report(
+        "metadata dumps (indent)",
+        timed(
+            lambda: json.dumps(response, indent=2, ensure_ascii=False).encode(),
+            args.repeat,
+        ),
+        timed(lambda: serialization.dumps(response, indent=True), args.repeat),
+    )
+    report(
+        "marker payload loads",
+        timed(lambda: json.loads(marker_raw), args.repeat),
+        timed(lambda: serialization.loads(marker_raw), args.repeat),
+    )
+
+
+if __name__ == "__main__":
+    main()
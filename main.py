@@ -1,50 +1,121 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from dotenv import load_dotenv
+from fastapi import (
+    Depends,
+    FastAPI,
+    UploadFile,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+)
 from fastapi.staticfiles import StaticFiles
-from paper2blog.converter import PaperConverter
-from paper2blog.types import ConversionResponse
-import uvicorn
+from paper2blog import serialization
+from paper2blog.admission import (
+    AdmissionController,
+    ConversionCost,
+    Overloaded,
+    estimate_cost,
+)
+from paper2blog.cancellation import ClientDisconnected, run_until_disconnected
+from paper2blog.converter import PaperConverter, parse_languages
+from paper2blog.deadline import deadline_scope
+from paper2blog.executors import run_io, shutdown_executors
+from paper2blog.extractors import ENGINES, page_count_from_bytes
+from paper2blog.figures import MEDIA_TYPES, FigureVariants
+from paper2blog.jobs import JobStore, job_status
+from paper2blog.model_types import (
+    ConversionResponse,
+    JobStatus,
+    MultiConversionResponse,
+)
+from paper2blog.pipeline import ConversionPipeline
+from paper2blog.profiling import ProfilingMiddleware, profiles
+from paper2blog.ratelimit import limiter_metrics
+from paper2blog.scheduling import parse_priority, priority_scope
+from paper2blog.singleflight import SingleFlight, conversion_key
+from paper2blog.storage import PaperStore
+import asyncio
+import hmac
 import traceback
 import logging
 import sys
 from datetime import datetime
+from typing import List, Optional, Union
 import os
-import uuid
-from pathlib import Path
-import json
 
+load_dotenv()
 
-# Configure logging
 log_directory = "logs"
-if not os.path.exists(log_directory):
-    os.makedirs(log_directory)
-
 log_filename = os.path.join(
     log_directory, f"paper2blog_{datetime.now().strftime('%Y%m%d')}.log"
 )
 
-# Configure logging settings
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler(log_filename), logging.StreamHandler(sys.stdout)],
+logger = logging.getLogger(__name__)
+
+
+def configure_logging():
+    """Log to stdout and a daily file; called on startup, not at import"""
+    os.makedirs(log_directory, exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler(log_filename), logging.StreamHandler(sys.stdout)],
+    )
+
+
+# Content-addressed store for uploaded papers, generated posts and figures
+# (its directory is created on startup)
+store = PaperStore()
+
+# Resized/WebP figure variants, rendered on first request
+figure_variants = FigureVariants(store)
+
+# Figure URLs name the content hash, so responses never change
+FIGURE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Storage garbage collection settings (TTL in seconds, quota in bytes)
+GC_INTERVAL = float(os.getenv("PAPER2BLOG_GC_INTERVAL", "600"))
+GC_TTL = float(os.getenv("PAPER2BLOG_GC_TTL", str(7 * 24 * 3600)))
+GC_MAX_BYTES = (
+    int(os.getenv("PAPER2BLOG_GC_MAX_BYTES"))
+    if os.getenv("PAPER2BLOG_GC_MAX_BYTES")
+    else None
 )
 
-logger = logging.getLogger(__name__)
+# Distributed job mode: set PAPER2BLOG_REDIS_URL to submit conversions to
+# workers through Redis (see paper2blog/jobs.py) via the /jobs endpoints
+REDIS_URL = os.getenv("PAPER2BLOG_REDIS_URL")
 
-# Create base directory for all papers
-PAPERS_BASE_DIR = Path("/home/dongpeijie/workspace/Paper2Blog/tmp")
-PAPERS_BASE_DIR.mkdir(parents=True, exist_ok=True)
+# Token for the /admin endpoints and for profiling single requests with the
+# X-Paper2Blog-Profile header; admin endpoints are disabled without it
+ADMIN_TOKEN = os.getenv("PAPER2BLOG_ADMIN_TOKEN")
+
+# Large markdown bodies serialize several times faster with orjson
+app = FastAPI(
+    title="Paper2Blog API",
+    default_response_class=(
+        ORJSONResponse if serialization.HAS_ORJSON else JSONResponse
+    ),
+)
 
-# Create temporary upload directory
-UPLOAD_DIR = Path("/home/dongpeijie/workspace/Paper2Blog/tmp/uploaded_files")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# Concurrent uploads of the same paper share one in-flight conversion
+conversions = SingleFlight()
 
-# Create directory for saving markdown files
-SAVED_MD_DIR = Path("/home/dongpeijie/workspace/Paper2Blog/tmp/saved_md")
-SAVED_MD_DIR.mkdir(parents=True, exist_ok=True)
+# Bounds in-flight conversions and their estimated cost; queues or sheds the
+# rest with 429/503 (see paper2blog/admission.py)
+admission = AdmissionController()
 
-app = FastAPI(title="Paper2Blog API")
+# Profiles requests that ask for it (see paper2blog/profiling.py)
+app.add_middleware(ProfilingMiddleware, admin_token=ADMIN_TOKEN)
 
 # Configure CORS
 app.add_middleware(
@@ -55,28 +126,135 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files directory for serving images
+# Mount the data directory (figures are better served by /figures)
 app.mount(
     "/tmp",
-    StaticFiles(directory="/home/dongpeijie/workspace/Paper2Blog/tmp"),
+    StaticFiles(directory=str(store.root), check_dir=False),
     name="static",
 )
 
 
 @app.on_event("startup")
 async def startup_event():
+    configure_logging()
+    await run_io(store.root.mkdir, parents=True, exist_ok=True)
     logger.info("Starting Paper2Blog API server")
     logger.info(f"Logging to file: {log_filename}")
+    app.state.gc_task = asyncio.create_task(
+        store.run_gc(GC_INTERVAL, ttl_seconds=GC_TTL, max_bytes=GC_MAX_BYTES)
+    )
+    # Uploaded papers go through the staged pipeline shared by all requests
+    app.state.pipeline = ConversionPipeline(PaperConverter(store))
+    app.state.pipeline.start()
+    app.state.jobs = None
+    if REDIS_URL:
+        app.state.jobs = JobStore.from_url(REDIS_URL)
+        logger.info("Distributed job mode enabled")
+
+
+def get_job_store():
+    jobs = getattr(app.state, "jobs", None)
+    if jobs is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Job queue is not configured, set PAPER2BLOG_REDIS_URL",
+        )
+    return jobs
 
 
-@app.post("/convert", response_model=ConversionResponse)
+@app.post(
+    "/convert", response_model=Union[ConversionResponse, MultiConversionResponse]
+)
 async def convert_paper(
+    request: Request,
     file: UploadFile = File(None),
     url: str = Form(None),
     language: str = Form("english"),
+    languages: List[str] = Form(None),
+    engine: str = Form(None),
+    include_appendix_figures: bool = Form(False),
+    deadline: float = Form(None),
+    priority: str = Form(None),
 ):
+    if deadline is not None and deadline <= 0:
+        raise HTTPException(status_code=400, detail="Deadline must be positive")
+    try:
+        priority = parse_priority(priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # A client that goes away (closed browser) cancels its conversion: marker,
+    # VLM and LLM calls are aborted instead of producing a post nobody reads.
+    # Stages degrade rather than overrun the deadline (seconds, server default
+    # PAPER2BLOG_DEADLINE_SECONDS) and report it in ``degradations``.
+    # Bursts beyond the admission limits wait in a bounded queue or are shed.
+    # Uploads are interactive by default; bulk clients can ask for "batch" or
+    # "background" to give way to them in the pipeline and provider slots.
+    try:
+        with deadline_scope(deadline), priority_scope(priority):
+            cost = await estimate_request_cost(file, languages or [language])
+            return await run_until_disconnected(
+                _convert_paper(
+                    file,
+                    url,
+                    language,
+                    languages,
+                    engine,
+                    include_appendix_figures,
+                    cost,
+                ),
+                request.is_disconnected,
+            )
+    except ClientDisconnected:
+        logger.info("Client disconnected, conversion cancelled")
+        return Response(status_code=499)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+async def estimate_request_cost(file: Optional[UploadFile], languages: List[str]):
+    """Estimated cost of a conversion request, from the uploaded PDF's pages"""
+    pages = None
+    if file:
+        content = await file.read()
+        await file.seek(0)
+        pages = await run_io(page_count_from_bytes, content)
+        if pages is None:
+            raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
+    return estimate_cost(pages, len(parse_languages(languages)) or 1)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Admission queue depth, in-flight load, pipeline stage queues and the
+    queue waits, retries and concurrency of each model provider"""
+    pipeline = getattr(app.state, "pipeline", None)
+    return {
+        "admission": admission.snapshot(),
+        "pipeline": pipeline.stats() if pipeline is not None else None,
+        "providers": limiter_metrics(),
+    }
+
+
+async def _convert_paper(
+    file: Optional[UploadFile],
+    url: Optional[str],
+    language: str,
+    languages: Optional[List[str]],
+    engine: Optional[str],
+    include_appendix_figures: bool,
+    cost: ConversionCost,
+):
+    # Several target languages (repeated or comma separated) share one
+    # extraction and captioning pass and return a language -> post map
+    target_languages = parse_languages(languages) if languages else [language]
+    if not target_languages:
+        raise HTTPException(status_code=400, detail="No target language given")
     logger.info(
-        f"Received conversion request - File: {file.filename if file else None}, URL: {url}, Language: {language}"
+        f"Received conversion request - File: {file.filename if file else None}, URL: {url}, Languages: {target_languages}"
     )
 
     try:
@@ -86,54 +264,51 @@ async def convert_paper(
                 status_code=400, detail="Either file or URL must be provided"
             )
 
-        converter = PaperConverter()
+        if engine and engine not in ENGINES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown extraction engine '{engine}', expected one of {sorted(ENGINES)}",
+            )
+
+        converter = PaperConverter(store)
         logger.info("Initialized PaperConverter")
 
         if file:
             try:
-                # Generate paper_id from filename without extension
-                paper_id = Path(file.filename).stem
-                # Create paper-specific directory structure
-                paper_dir = PAPERS_BASE_DIR / paper_id
-                figures_dir = paper_dir / "figures"
-                paper_dir.mkdir(parents=True, exist_ok=True)
-                figures_dir.mkdir(parents=True, exist_ok=True)
-
-                # Save the uploaded file
-                original_extension = Path(file.filename).suffix
-                paper_filepath = paper_dir / f"{paper_id}{original_extension}"
-                
-                logger.info(f"Saving uploaded file to: {paper_filepath}")
+                # Papers are stored under the hash of their content, so uploads
+                # with the same filename never overwrite each other
                 content = await file.read()
-                with open(paper_filepath, "wb") as paper_file:
-                    paper_file.write(content)
+                paper_id, paper_filepath = await run_io(store.save_paper, content)
+                logger.info(f"Saved uploaded file to: {paper_filepath}")
 
                 logger.info(f"Processing PDF file: {paper_filepath}")
-                result: ConversionResponse = await converter.convert_from_pdf(
-                    str(paper_filepath), language
+                # Only the request that starts a conversion is admitted (and
+                # charged); duplicates joining it take no admission slot
+                results = await conversions.do(
+                    conversion_key(
+                        content,
+                        ",".join(target_languages),
+                        engine,
+                        str(include_appendix_figures),
+                    ),
+                    lambda: admission.run(
+                        cost,
+                        app.state.pipeline.convert_from_pdf_languages(
+                            str(paper_filepath),
+                            target_languages,
+                            engine=engine,
+                            include_appendix_figures=include_appendix_figures,
+                            paper_id=paper_id,
+                            filename=file.filename,
+                        ),
+                    ),
+                )
+                logger.info(
+                    f"Converted PDF file, saved in: {store.paper_dir(paper_id)}"
                 )
-                logger.info("Successfully converted PDF file")
-
-                # Save the markdown content and metadata
-                md_filepath = paper_dir / f"{paper_id}.md"
-                with open(md_filepath, "w") as md_file:
-                    md_file.write(result.content)
-                
-                # Save metadata
-                metadata = {
-                    "paper_id": paper_id,
-                    "original_filename": file.filename,
-                    "language": language,
-                    "conversion_date": datetime.now().isoformat(),
-                    "figures": result.figures if hasattr(result, 'figures') else []
-                }
-                
-                metadata_filepath = paper_dir / "metadata.json"
-                with open(metadata_filepath, "w") as metadata_file:
-                    json.dump(metadata, metadata_file, indent=2)
-                
-                logger.info(f"Paper content and metadata saved in: {paper_dir}")
 
+            except Overloaded:
+                raise
             except Exception as e:
                 logger.error(f"Error processing PDF file: {str(e)}")
                 logger.debug(f"Detailed error: {traceback.format_exc()}")
@@ -143,17 +318,22 @@ async def convert_paper(
         else:
             try:
                 logger.info(f"Processing URL: {url}")
-                result = await converter.convert_from_url(url, language)
+                results = await admission.run(
+                    cost, converter.convert_from_url_languages(url, target_languages)
+                )
                 logger.info("Successfully converted URL content")
+            except Overloaded:
+                raise
             except Exception as e:
                 logger.error(f"Error processing URL: {str(e)}")
                 logger.debug(f"Detailed error: {traceback.format_exc()}")
                 raise HTTPException(
                     status_code=400, detail=f"Error processing URL: {str(e)}"
                 )
-        logger.error(result)
-        return result
-    except HTTPException:
+        if languages:
+            return MultiConversionResponse(results=results)
+        return results[language]
+    except (HTTPException, Overloaded):
         raise
     except Exception as e:
         logger.error(f"Unexpected error in /convert endpoint: {str(e)}")
@@ -161,11 +341,146 @@ async def convert_paper(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    language: str = Form("english"),
+    engine: str = Form(None),
+    include_appendix_figures: bool = Form(False),
+):
+    """Queue a PDF conversion for the workers and return its job id"""
+    jobs = get_job_store()
+    if engine and engine not in ENGINES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown extraction engine '{engine}', expected one of {sorted(ENGINES)}",
+        )
+
+    content = await file.read()
+    paper_id, paper_filepath = await run_io(store.save_paper, content)
+    job_id, created = await jobs.submit(
+        {
+            "paper_id": paper_id,
+            "pdf_path": store.relative(paper_filepath),
+            "filename": file.filename,
+            "language": language,
+            "engine": engine,
+            "include_appendix_figures": include_appendix_figures,
+        },
+        dedup_key=conversion_key(
+            content, language, engine, str(include_appendix_figures)
+        ),
+    )
+    logger.info(f"{'Queued' if created else 'Joined'} job {job_id} for paper {paper_id}")
+    return job_status(await jobs.get(job_id))
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    job = await get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job_status(job)
+
+
+@app.post(
+    "/conversions/{conversion_id}/sections/{section}",
+    response_model=ConversionResponse,
+)
+async def regenerate_section(
+    conversion_id: str, section: str, instructions: str = Form("")
+):
+    """Rewrite one section of a stored post (by index or heading) and return
+    the patched post"""
+    logger.info(f"Regenerating section '{section}' of conversion {conversion_id}")
+    try:
+        with deadline_scope():
+            return await PaperConverter(store).regenerate_section(
+                conversion_id, section, instructions
+            )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except Exception as e:
+        logger.error(f"Error regenerating section: {str(e)}")
+        logger.debug(f"Detailed error: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=502, detail=f"Error in LLM processing: {str(e)}"
+        )
+
+
+@app.get("/figures/{name}")
+async def get_figure(name: str, request: Request, w: int = 0):
+    """A stored figure by content hash, as ``<hash>.<format>``, optionally
+    resized to width ``w``; cacheable forever"""
+    digest, dot, suffix = name.partition(".")
+    if not dot or not 0 <= w <= 4096:
+        raise HTTPException(status_code=400, detail="Invalid figure request")
+    path = await figure_variants.get(digest, f".{suffix}", w)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Figure {name} not found")
+    headers = {"Cache-Control": FIGURE_CACHE_CONTROL, "ETag": f'"{path.stem}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=MEDIA_TYPES.get(path.suffix), headers=headers)
+
+
+def require_admin(x_admin_token: str = Header("")):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def get_profile(profile_id: str):
+    profile = profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return profile
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Recently finished profiles, newest first"""
+    return {
+        "enabled": profiles.enabled,
+        "profiles": [profile.summary() for profile in profiles.recent()],
+    }
+
+
+@app.put("/admin/profiles", dependencies=[Depends(require_admin)])
+async def set_profiling(enabled: bool = Form(...)):
+    """Turn profiling of every request on or off"""
+    profiles.enabled = enabled
+    logger.info(f"Profiling of all requests {'enabled' if enabled else 'disabled'}")
+    return {"enabled": profiles.enabled}
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile_report(profile_id: str):
+    """Sections with their time and allocations, and the hottest stacks"""
+    return get_profile(profile_id).to_dict()
+
+
+@app.get(
+    "/admin/profiles/{profile_id}/folded",
+    dependencies=[Depends(require_admin)],
+    response_class=PlainTextResponse,
+)
+async def get_profile_folded(profile_id: str):
+    """CPU samples in collapsed-stack format, for flamegraph.pl or speedscope"""
+    return get_profile(profile_id).folded()
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down Paper2Blog API server")
+    app.state.gc_task.cancel()
+    await app.state.pipeline.stop()
+    shutdown_executors(wait=False)
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     logger.info("Starting development server")
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
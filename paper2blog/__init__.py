@@ -10,14 +10,39 @@ This package provides tools to:
 
 __version__ = "0.1.0"
 
-from paper2blog.converter import PaperConverter
-from paper2blog.model_types import ConversionResponse, ImageInfo, BlogPost
-from paper2blog.utils import extract_content_from_pdf
+# Public names are imported on first access, so ``import paper2blog`` stays
+# cheap and side-effect free (no pydantic, openai, PyMuPDF, ... until needed)
+_EXPORTS = {
+    "PaperConverter": "paper2blog.converter",
+    "ConversionResponse": "paper2blog.model_types",
+    "ImageInfo": "paper2blog.model_types",
+    "BlogPost": "paper2blog.model_types",
+    "BlogSection": "paper2blog.model_types",
+    "GeneratedBlog": "paper2blog.model_types",
+    "extract_content_from_pdf": "paper2blog.utils",
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'paper2blog' has no attribute '{name}'")
+    import importlib
+
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
+
 
 __all__ = [
     "PaperConverter",
     "ConversionResponse",
     "ImageInfo",
     "BlogPost",
+    "BlogSection",
+    "GeneratedBlog",
     "extract_content_from_pdf",
 ]
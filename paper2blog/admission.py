@@ -0,0 +1,252 @@
+"""
+Admission control for conversions.
+
+Each conversion holds the PDF, its decoded figures and LLM/VLM connections
+for tens of seconds, so a burst of uploads can exhaust memory or provider
+quotas long before it shows up in latency. ``AdmissionController`` sits in
+front of ``/convert`` and tracks the in-flight conversions together with
+their estimated cost (pages, figures, tokens). A conversion that fits under
+the limits starts right away, otherwise it waits in a bounded FIFO queue:
+
+* queue full: rejected at once with 429 (back off and retry later);
+* still queued after ``PAPER2BLOG_ADMISSION_QUEUE_TIMEOUT`` seconds (or
+  once the request's deadline would be spent waiting): rejected with 503.
+
+Both carry a ``Retry-After`` estimate from recent conversion durations.
+A single conversion larger than the limits is admitted when nothing else is
+running, so big papers are slow rather than impossible.
+
+Limits (0 disables one)::
+
+    PAPER2BLOG_ADMISSION_MAX_INFLIGHT=8
+    PAPER2BLOG_ADMISSION_MAX_PAGES=400
+    PAPER2BLOG_ADMISSION_MAX_TOKENS=300000
+    PAPER2BLOG_ADMISSION_MAX_QUEUE=32
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+from paper2blog.deadline import budget
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Rough cost model: the blog prompt is cut to about 4k tokens of paper text,
+# each language adds a prompt and a post, each figure a VLM image
+TOKENS_PER_PAGE = int(os.getenv("PAPER2BLOG_ADMISSION_TOKENS_PER_PAGE", "800"))
+PROMPT_TOKENS = 4000
+POST_TOKENS = 6000
+TOKENS_PER_FIGURE = 1200
+# Pages assumed when they cannot be counted before converting (URLs)
+DEFAULT_PAGES = int(os.getenv("PAPER2BLOG_ADMISSION_DEFAULT_PAGES", "12"))
+
+# Retry-After when no conversion has finished yet to estimate from
+DEFAULT_CONVERSION_SECONDS = 60.0
+
+
+def _limit(value: Optional[int], name: str, default: str) -> Optional[int]:
+    """``value``, else the environment setting; 0 disables the limit."""
+    if value is None:
+        value = int(os.getenv(f"PAPER2BLOG_ADMISSION_{name}", default))
+    return value or None
+
+
+class ConversionCost:
+    __slots__ = ("pages", "figures", "tokens")
+
+    def __init__(self, pages: int, figures: int, tokens: int):
+        self.pages = pages
+        self.figures = figures
+        self.tokens = tokens
+
+    def __repr__(self) -> str:
+        return (
+            f"ConversionCost(pages={self.pages}, figures={self.figures}, "
+            f"tokens={self.tokens})"
+        )
+
+
+def estimate_cost(
+    pages: Optional[int], languages: int = 1, max_images: int = 6
+) -> ConversionCost:
+    """Estimated cost of converting a paper of ``pages`` pages into
+    ``languages`` posts."""
+    pages = pages or DEFAULT_PAGES
+    figures = min(pages, max_images)
+    prompt = min(pages * TOKENS_PER_PAGE, PROMPT_TOKENS)
+    tokens = figures * TOKENS_PER_FIGURE + languages * (prompt + POST_TOKENS)
+    return ConversionCost(pages, figures, tokens)
+
+
+class Overloaded(Exception):
+    """A conversion was not admitted; retry after ``retry_after`` seconds."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_inflight: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_inflight = _limit(max_inflight, "MAX_INFLIGHT", "8")
+        self.max_pages = _limit(max_pages, "MAX_PAGES", "400")
+        self.max_tokens = _limit(max_tokens, "MAX_TOKENS", "300000")
+        self.max_queue = _limit(max_queue, "MAX_QUEUE", "32")
+        if queue_timeout is None:
+            queue_timeout = float(os.getenv("PAPER2BLOG_ADMISSION_QUEUE_TIMEOUT", "60"))
+        self.queue_timeout = queue_timeout
+        self._clock = clock
+
+        # In-flight conversions and the sum of their estimated costs
+        self.inflight = 0
+        self.pages = 0
+        self.figures = 0
+        self.tokens = 0
+        self._queue: Deque[Tuple[ConversionCost, asyncio.Future]] = deque()
+
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "queue_timeout": 0}
+        # Moving average of conversion durations, for Retry-After
+        self._avg_seconds: Optional[float] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def _fits(self, cost: ConversionCost) -> bool:
+        if not self.inflight:
+            return True
+        return (
+            (not self.max_inflight or self.inflight < self.max_inflight)
+            and (not self.max_pages or self.pages + cost.pages <= self.max_pages)
+            and (not self.max_tokens or self.tokens + cost.tokens <= self.max_tokens)
+        )
+
+    def _take(self, cost: ConversionCost) -> None:
+        self.inflight += 1
+        self.pages += cost.pages
+        self.figures += cost.figures
+        self.tokens += cost.tokens
+        self.admitted += 1
+
+    def _wake(self) -> None:
+        # FIFO: a large conversion at the head is not overtaken by small ones
+        while self._queue and self._fits(self._queue[0][0]):
+            cost, future = self._queue.popleft()
+            self._take(cost)
+            future.set_result(None)
+
+    def retry_after(self) -> int:
+        """Seconds until a new conversion is likely to be admitted."""
+        seconds = self._avg_seconds or DEFAULT_CONVERSION_SECONDS
+        waves = (self.queued + 1) / (self.max_inflight or max(1, self.inflight))
+        return max(1, math.ceil(seconds * waves))
+
+    def _reject(self, reason: str, status_code: int, message: str) -> Overloaded:
+        self.rejected[reason] += 1
+        retry_after = self.retry_after()
+        logger.warning(
+            f"{message} ({self.inflight} in flight, {self.queued} queued), "
+            f"retry after {retry_after}s"
+        )
+        return Overloaded(message, status_code, retry_after)
+
+    async def acquire(self, cost: ConversionCost) -> None:
+        """Wait for room for a conversion of ``cost``; raises ``Overloaded``."""
+        if not self._queue and self._fits(cost):
+            self._take(cost)
+            return
+        if self.max_queue is not None and self.queued >= self.max_queue:
+            raise self._reject("queue_full", 429, "Too many conversions queued")
+
+        entry = (cost, asyncio.get_running_loop().create_future())
+        self._queue.append(entry)
+        timeout = self.queue_timeout
+        remaining = budget()
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        try:
+            await asyncio.wait_for(asyncio.shield(entry[1]), timeout)
+        except asyncio.TimeoutError:
+            if entry[1].done():
+                # Admitted just as the wait timed out
+                return
+            self._dequeue(entry)
+            raise self._reject(
+                "queue_timeout", 503, "Timed out waiting for a conversion slot"
+            ) from None
+        except BaseException:
+            # Cancelled (e.g. the client disconnected) while queued
+            if entry[1].done():
+                self.release(cost)
+            else:
+                self._dequeue(entry)
+            raise
+
+    def _dequeue(self, entry: Tuple[ConversionCost, asyncio.Future]) -> None:
+        self._queue.remove(entry)
+        # The conversions behind it may fit now
+        self._wake()
+
+    def release(self, cost: ConversionCost, seconds: Optional[float] = None) -> None:
+        self.inflight -= 1
+        self.pages -= cost.pages
+        self.figures -= cost.figures
+        self.tokens -= cost.tokens
+        if seconds is not None:
+            self._avg_seconds = (
+                seconds
+                if self._avg_seconds is None
+                else 0.8 * self._avg_seconds + 0.2 * seconds
+            )
+        self._wake()
+
+    async def run(self, cost: ConversionCost, work: Awaitable[T]) -> T:
+        """Await ``work`` once admitted, holding its slot until it is done."""
+        try:
+            await self.acquire(cost)
+        except BaseException:
+            if asyncio.iscoroutine(work):
+                work.close()
+            raise
+        started = self._clock()
+        try:
+            return await work
+        finally:
+            self.release(cost, self._clock() - started)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue depth and in-flight load, for the metrics endpoint."""
+        return {
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "inflight_pages": self.pages,
+            "inflight_figures": self.figures,
+            "inflight_tokens": self.tokens,
+            "queued_tokens": sum(cost.tokens for cost, _ in self._queue),
+            "admitted_total": self.admitted,
+            "rejected_total": dict(self.rejected),
+            "avg_conversion_seconds": self._avg_seconds,
+            "limits": {
+                "max_inflight": self.max_inflight,
+                "max_pages": self.max_pages,
+                "max_tokens": self.max_tokens,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+            },
+        }
@@ -3,21 +3,30 @@ import re
 import asyncio
 from typing import List, Dict, Optional
 from pathlib import Path
-from openai import AsyncOpenAI
+from paper2blog.backends import ModelRouter, OpenAIBackend
+from paper2blog.extractors import BACK_MATTER_HEADINGS
 from paper2blog.model_types import ImageInfo, BlogPost
+from paper2blog.ratelimit import count_tokens
 from paper2blog.utils import extract_content_from_pdf
 from paper2blog.llm_handler import LLMHandler
 
 
 class BlogGenerationAgent:
-    def __init__(self, api_key: Optional[str] = None, temperature: float = 0.7):
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("需要提供OpenAI API密钥")
-
-        self.client = AsyncOpenAI(api_key=self.api_key, base_url=os.getenv("OPENAI_API_BASE"))
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        temperature: float = 0.7,
+        router: Optional[ModelRouter] = None,
+    ):
+        backends = {}
+        if api_key:
+            # An explicit key overrides the environment for the "openai" backend
+            backends["openai"] = OpenAIBackend(
+                api_key=api_key, base_url=os.getenv("OPENAI_API_BASE")
+            )
+        self.router = router or ModelRouter.from_env(backends)
         self.temperature = temperature
-        self.llm_handler = LLMHandler()
+        self.llm_handler = LLMHandler(self.router)
 
     async def generate_outline(self, text: str) -> str:
         outline_prompt = '''你是一位专业的技术博主，请基于以下论文内容生成一个详细的博客大纲。使用中文回复。
@@ -56,14 +65,12 @@ class BlogGenerationAgent:
 
 请生成一个清晰的大纲，并在每个部分后添加简短说明，说明该部分将要讨论的主要内容。'''
 
-        response = await self.client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview"),
-            messages=[{"role": "user", "content": outline_prompt}],
+        return await self.router.complete(
+            "outline",
+            [{"role": "user", "content": outline_prompt}],
             temperature=self.temperature,
             max_tokens=2000
         )
-        
-        return response.choices[0].message.content
 
     async def generate_blog_section(self, text: str, section_title: str, context: str, style_guide: str) -> str:
         prompt = f"""你是一位专业的技术博主，擅长将学术论文转化为通俗易懂的技术博客。请用中文进行回复。
@@ -98,15 +105,32 @@ class BlogGenerationAgent:
 
 请生成连贯、专业且易于理解的博客章节："""
 
-        response = await self.client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview"),
-            messages=[{"role": "user", "content": prompt}],
+        return await self.router.complete(
+            "section",
+            [{"role": "user", "content": prompt}],
             temperature=self.temperature,
             max_tokens=3000
         )
-        return response.choices[0].message.content
 
-    async def generate_blog_with_agent(self, text_chunks: List[str], image_info: List[ImageInfo]) -> str:
+    async def generate_blog_with_agent(
+        self,
+        text_chunks: List[str],
+        image_info: List[ImageInfo],
+        share_outline: bool = False,
+        post_process: str = "auto",
+    ) -> str:
+        """Generate the blog chunk by chunk following a generated outline.
+
+        Args:
+            text_chunks: Paper text split into chunks
+            image_info: Figures available for the blog
+            share_outline: Pass the full outline to every section call so that
+                sections are written against the same plan
+            post_process: "full" re-writes the whole blog in one call,
+                "boundaries" only smooths transitions between sections,
+                "none" skips post-processing and "auto" skips it when the
+                outline was shared and smooths boundaries otherwise
+        """
         # 首先生成大纲
         full_text = " ".join(text_chunks)
         outline = await self.generate_outline(full_text)
@@ -133,35 +157,102 @@ class BlogGenerationAgent:
 
 请返回最适合的章节标题："""
             
-            response = await self.client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview"),
-                messages=[{"role": "user", "content": section_prompt}],
+            response = await self.router.complete(
+                "classify",
+                [{"role": "user", "content": section_prompt}],
                 temperature=0.3,
                 max_tokens=100
             )
             
-            section_title = response.choices[0].message.content.strip()
+            section_title = response.strip()
             
+            heading = None
             if section_title != current_section:
                 current_section = section_title
-                blog_sections.append(f"\n## {current_section}\n")
-            
+                heading = f"## {current_section}"
+
+            section_context = context
+            if share_outline:
+                section_context = f"博客大纲：\n{outline}\n\n{context}"
             content = await self.generate_blog_section(
                 chunk,
                 current_section,
-                context,
+                section_context,
                 "专业但平易近人"
             )
-            blog_sections.append(content)
+            blog_sections.append((heading, content))
             context = f"前文讨论了{current_section}的内容。"
-        
+
+        if post_process == "auto":
+            post_process = "none" if share_outline else "boundaries"
+
+        if post_process == "boundaries":
+            contents = await self.smooth_transitions([c for _, c in blog_sections])
+            blog_sections = [(h, c) for (h, _), c in zip(blog_sections, contents)]
+
         # 合并所有章节
-        blog_content = "\n\n".join(blog_sections)
-        
-        # 后处理优化
-        final_blog = await self.post_process_blog(blog_content)
-        
-        return final_blog
+        blog_content = "\n\n".join(
+            f"\n{heading}\n\n{content}" if heading else content
+            for heading, content in blog_sections
+        )
+
+        if post_process == "full":
+            # 后处理优化
+            blog_content = await self.post_process_blog(blog_content)
+
+        return blog_content
+
+    async def smooth_transitions(
+        self, sections: List[str], tail_chars: int = 600
+    ) -> List[str]:
+        """Smooth the transitions between adjacent sections.
+
+        Only the opening paragraph of each section is rewritten, using the tail
+        of the previous section as context. Every boundary is handled by its own
+        small request and all boundaries run concurrently, so the cost no longer
+        grows with the full length of the blog.
+        """
+        if len(sections) < 2:
+            return list(sections)
+
+        async def rewrite_head(previous: str, current: str) -> str:
+            paragraphs = current.strip().split("\n\n")
+            head = paragraphs[0]
+            tail = previous.strip()[-tail_chars:]
+            prompt = f"""以下是技术博客中相邻两部分的衔接处。请只改写“下一部分的开头段落”，使其与上一部分的结尾自然衔接：
+
+1. 必要时补充简短的过渡语句
+2. 保持原有信息、专业术语和语气不变
+3. 不要重复上一部分的内容，不要添加标题
+
+上一部分结尾：
+{tail}
+
+下一部分的开头段落：
+{head}
+
+只返回改写后的开头段落，不要添加任何解释。"""
+
+            response = await self.router.complete(
+                "smooth",
+                [{"role": "user", "content": prompt}],
+                temperature=self.temperature,
+                # Room for the paragraph plus a transition; the router clamps
+                # it to the model's context window
+                max_tokens=max(256, 2 * count_tokens(head)),
+            )
+            new_head = response.strip()
+            if not new_head:
+                return current
+            return "\n\n".join([new_head] + paragraphs[1:])
+
+        heads = await asyncio.gather(
+            *(
+                rewrite_head(previous, current)
+                for previous, current in zip(sections, sections[1:])
+            )
+        )
+        return [sections[0]] + list(heads)
 
     async def post_process_blog(self, blog_content: str) -> str:
         post_process_prompt = f"""请对以下技术博客内容进行优化，重点关注：
@@ -179,13 +270,12 @@ class BlogGenerationAgent:
 
 请返回优化后的博客内容。"""
 
-        response = await self.client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview"),
-            messages=[{"role": "user", "content": post_process_prompt}],
+        return await self.router.complete(
+            "smooth",
+            [{"role": "user", "content": post_process_prompt}],
             temperature=self.temperature,
             max_tokens=4000
         )
-        return response.choices[0].message.content
 
     async def generate_blog(self, pdf_path: str, target_language: str = "zh") -> BlogPost:
         print(f"从PDF提取内容: {pdf_path}")
@@ -205,7 +295,7 @@ class BlogGenerationAgent:
         return BlogPost(title=title, content=full_blog_text)
 
     def _split_text(self, text: str, n_splits: int = 4) -> List[str]:
-        stop_sections = {'references', 'appendix', 'acknowledgements', 'acknowledgments', 'bibliography'}
+        stop_sections = set(BACK_MATTER_HEADINGS)
         
         lines = text.split("\n")
         main_content_lines = []
@@ -221,17 +311,19 @@ class BlogGenerationAgent:
         
         sections = []
         total_length = len(main_content)
-        chunk_size = total_length // n_splits
+        chunk_size = max(1, total_length // n_splits)
         
         current_pos = 0
         while current_pos < total_length:
             next_pos = min(current_pos + chunk_size, total_length)
             if next_pos < total_length:
-                paragraph_end = main_content.find('\n\n', next_pos - 100, next_pos + 100)
+                # Search only past the current chunk start so every step advances
+                start = current_pos + 1
+                paragraph_end = main_content.find('\n\n', max(start, next_pos - 100), next_pos + 100)
                 if paragraph_end != -1:
                     next_pos = paragraph_end
                 else:
-                    sentence_end = main_content.find('.', next_pos - 50, next_pos + 50)
+                    sentence_end = main_content.find('.', max(start, next_pos - 50), next_pos + 50)
                     if sentence_end != -1:
                         next_pos = sentence_end + 1
             
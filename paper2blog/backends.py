@@ -0,0 +1,344 @@
+"""
+Provider-agnostic chat-completion backends with per-stage model routing.
+
+Backends are registered by name (``openai``, ``local``, ``siliconflow``,
+``stub``) and created lazily, so one client and its connection pool is shared
+by every handler in the process. A ``ModelRouter`` maps pipeline stages to an
+ordered list of ``backend:model`` routes and falls back to the next route when
+the provider fails (rate limits, server errors, unreachable local servers,
+...). Other errors, e.g. a bug in building the request, are raised at once.
+
+Routes are configured with environment variables, e.g.::
+
+    PAPER2BLOG_ROUTE_CLASSIFY=local:qwen2.5-7b-instruct,openai:gpt-4o-mini
+    PAPER2BLOG_ROUTE_BLOG=openai:gpt-4o
+"""
+
+import os
+import json
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from paper2blog.ratelimit import (
+    estimate_tokens,
+    get_limiter,
+    is_provider_error,
+    prompt_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages that can be routed independently
+STAGES = (
+    "default",
+    "blog",  # final one-shot blog prose (LLMHandler)
+    "blog_fast",  # blog prose when the request deadline runs low
+    "title",  # title translation
+    "outline",  # agent outline
+    "classify",  # agent chunk -> section classification
+    "section",  # agent section prose
+    "smooth",  # agent boundary smoothing
+    "caption",  # VLM figure captions
+)
+
+# Context window (prompt plus completion) of routed models, by model name, e.g.
+# "gpt-4o-mini=128000,qwen2.5-7b-instruct=32768"; completions of other models
+# are not clamped
+
+
+def _parse_context_tokens(value: str) -> Dict[str, int]:
+    sizes = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        model, _, size = item.rpartition("=")
+        if not model or not size.isdigit():
+            raise ValueError(f"Invalid model context size '{item}'")
+        sizes[model.strip()] = int(size)
+    return sizes
+
+
+MODEL_CONTEXT_TOKENS = _parse_context_tokens(
+    os.getenv("PAPER2BLOG_MODEL_CONTEXT_TOKENS", "")
+)
+
+# Completion budget never clamped below this, even for an overlong prompt
+MIN_COMPLETION_TOKENS = 64
+
+
+def fit_max_tokens(
+    messages: List[Dict[str, Any]], max_tokens: Optional[int], model: str
+) -> Optional[int]:
+    """``max_tokens`` clamped to what fits in ``model``'s context window next
+    to the prompt; unchanged when the window is not configured."""
+    context = MODEL_CONTEXT_TOKENS.get(model)
+    if max_tokens is None or context is None:
+        return max_tokens
+    room = context - prompt_tokens(messages)
+    return max(MIN_COMPLETION_TOKENS, min(max_tokens, room))
+
+
+class BackendUnavailable(ValueError):
+    """A backend cannot be used: unknown, not configured or not installed."""
+
+
+class LLMBackend(ABC):
+    """Base class for chat-completion backends."""
+
+    name = "base"
+
+    @abstractmethod
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Return the assistant reply to ``messages``."""
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI or any OpenAI-compatible server (vLLM, llama.cpp, SiliconFlow, ...).
+
+    Calls go through the provider's shared ``ProviderLimiter``, which owns
+    rate limiting and retries, so the client's own retries are disabled.
+    Raises ``BackendUnavailable`` without an API key unless ``key_optional``
+    is set, for local and self-hosted servers that accept any key.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        name: str = "openai",
+        key_optional: bool = False,
+    ):
+        from openai import AsyncOpenAI
+
+        if not api_key:
+            if not key_optional:
+                raise BackendUnavailable(
+                    f"No API key configured for the '{name}' backend"
+                )
+            api_key = "EMPTY"
+        self.name = name
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.limiter = get_limiter(name)
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        kwargs = {}
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        if response_format is not None:
+            kwargs["response_format"] = response_format
+
+        async def create():
+            return await self.client.chat.completions.create(
+                model=model, messages=messages, temperature=temperature, **kwargs
+            )
+
+        completion = await self.limiter.call(
+            create, estimate_tokens(messages, max_tokens)
+        )
+        return completion.choices[0].message.content or ""
+
+
+class StubBackend(LLMBackend):
+    """Deterministic offline backend for tests and dry runs.
+
+    Plain requests get a short echo keyed by a digest of the messages; JSON
+    schema requests get a minimal object that satisfies the schema.
+    """
+
+    name = "stub"
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        if response_format and response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            return json.dumps(_skeleton(schema))
+
+        digest = hashlib.sha1(
+            json.dumps(messages, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:8]
+        last = messages[-1]["content"] if messages else ""
+        if not isinstance(last, str):
+            last = " ".join(p.get("text", "") for p in last if isinstance(p, dict))
+        return f"[stub:{model}:{digest}] {last[:200]}"
+
+
+def _skeleton(schema: Dict[str, Any]) -> Any:
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            key: _skeleton(sub)
+            for key, sub in schema.get("properties", {}).items()
+            if key in schema.get("required", schema.get("properties", {}))
+        }
+    if kind == "array":
+        return []
+    if kind == "integer" or kind == "number":
+        return 0
+    if kind == "boolean":
+        return False
+    return "stub"
+
+
+BACKEND_FACTORIES: Dict[str, Callable[[], LLMBackend]] = {}
+_backends: Dict[str, LLMBackend] = {}
+
+
+def register_backend(name: str, factory: Callable[[], LLMBackend]) -> None:
+    """Register a backend factory under ``name`` (replaces any cached instance)."""
+    BACKEND_FACTORIES[name] = factory
+    _backends.pop(name, None)
+
+
+def get_backend(name: str) -> LLMBackend:
+    """Return the process-wide backend instance registered under ``name``."""
+    if name not in _backends:
+        if name not in BACKEND_FACTORIES:
+            raise BackendUnavailable(f"Unknown LLM backend: {name}")
+        try:
+            _backends[name] = BACKEND_FACTORIES[name]()
+        except ImportError as e:
+            raise BackendUnavailable(f"LLM backend '{name}' unavailable: {e}") from e
+    return _backends[name]
+
+
+register_backend(
+    "openai",
+    lambda: OpenAIBackend(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_API_BASE"),
+        name="openai",
+    ),
+)
+register_backend(
+    "local",
+    lambda: OpenAIBackend(
+        api_key=os.getenv("LOCAL_LLM_API_KEY"),
+        base_url=os.getenv("LOCAL_LLM_API_BASE", "http://localhost:8080/v1"),
+        name="local",
+        key_optional=True,
+    ),
+)
+register_backend(
+    "siliconflow",
+    lambda: OpenAIBackend(
+        api_key=os.getenv("VLM_API_KEY"),
+        base_url=os.getenv("VLM_API_BASE", "https://api.siliconflow.cn/v1"),
+        name="siliconflow",
+    ),
+)
+register_backend("stub", StubBackend)
+
+
+# A route is a (backend, model) pair; the backend may be a registered name or
+# an already constructed instance.
+Route = Tuple[Union[str, LLMBackend], str]
+
+
+def parse_routes(spec: str) -> List[Route]:
+    """Parse ``"local:qwen2.5,openai:gpt-4o-mini"`` into a list of routes."""
+    routes = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        backend, sep, model = item.partition(":")
+        if not sep or not model:
+            raise ValueError(f"Invalid route '{item}', expected 'backend:model'")
+        routes.append((backend, model))
+    return routes
+
+
+def default_routes() -> Dict[str, List[Route]]:
+    routes = {
+        "default": [("openai", os.getenv("OPENAI_MODEL", "gpt-4o-mini"))],
+        "caption": [("siliconflow", os.getenv("VLM_MODEL", "deepseek-ai/deepseek-vl2"))],
+    }
+    for stage in STAGES:
+        spec = os.getenv(f"PAPER2BLOG_ROUTE_{stage.upper()}")
+        if spec:
+            routes[stage] = parse_routes(spec)
+    return routes
+
+
+class ModelRouter:
+    """Route completion requests per stage with ordered fallback."""
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, List[Route]]] = None,
+        backends: Optional[Dict[str, LLMBackend]] = None,
+    ):
+        self.routes = routes if routes is not None else default_routes()
+        # Per-router overrides take precedence over the global registry
+        self.backends = backends or {}
+
+    @classmethod
+    def from_env(cls, backends: Optional[Dict[str, LLMBackend]] = None):
+        return cls(default_routes(), backends)
+
+    def routes_for(self, stage: str) -> List[Route]:
+        routes = self.routes.get(stage) or self.routes.get("default")
+        if not routes:
+            raise ValueError(f"No route configured for stage '{stage}'")
+        return routes
+
+    def _resolve(self, backend: Union[str, LLMBackend]) -> LLMBackend:
+        if isinstance(backend, LLMBackend):
+            return backend
+        return self.backends.get(backend) or get_backend(backend)
+
+    async def complete(
+        self,
+        stage: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Run a completion for ``stage``, falling back along its routes."""
+        routes = self.routes_for(stage)
+        last_error: Optional[Exception] = None
+        for idx, (backend_ref, model) in enumerate(routes):
+            name = getattr(backend_ref, "name", backend_ref)
+            try:
+                # A backend that cannot be built (unknown name, no API key,
+                # client not installed) is skipped like a failing provider
+                backend = self._resolve(backend_ref)
+                return await backend.complete(
+                    messages,
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=fit_max_tokens(messages, max_tokens, model),
+                    response_format=response_format,
+                )
+            except BackendUnavailable as e:
+                last_error = e
+            except Exception as e:
+                if not is_provider_error(e):
+                    raise
+                last_error = e
+            if idx + 1 < len(routes):
+                logger.warning(
+                    f"Stage '{stage}' failed on {name}:{model} ({last_error}), "
+                    "falling back to next route"
+                )
+        raise last_error
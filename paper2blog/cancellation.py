@@ -0,0 +1,79 @@
+"""
+Cancel request work when the client that asked for it goes away.
+
+``run_until_disconnected`` runs a coroutine next to a watcher polling the
+client connection, as a small task group: whichever finishes first cancels
+the other, and neither outlives the call. When the client disconnects, the
+cancellation propagates through the conversion to its pending marker, VLM and
+LLM requests, releasing their capacity instead of finishing a post nobody
+will read.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Seconds between checks of the client connection
+DISCONNECT_POLL_INTERVAL = float(
+    os.getenv("PAPER2BLOG_DISCONNECT_POLL_INTERVAL", "1")
+)
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the work finished; the work was cancelled."""
+
+
+async def _wait_for_disconnect(
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_interval: float,
+    stopped: asyncio.Event,
+) -> None:
+    # ``stopped`` as well as cancellation: Starlette's ``is_disconnected``
+    # runs in an already cancelled anyio scope, which swallows a cancellation
+    # that arrives while it is being awaited
+    while not await is_disconnected() and not stopped.is_set():
+        await asyncio.sleep(poll_interval)
+
+
+async def run_until_disconnected(
+    work: Awaitable[T],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_interval: float = DISCONNECT_POLL_INTERVAL,
+) -> T:
+    """Await ``work``, cancelling it if ``is_disconnected()`` turns true first.
+
+    Raises ``ClientDisconnected`` once the work has been cancelled and has
+    finished unwinding. Cancelling the caller cancels both tasks.
+    """
+    task = asyncio.ensure_future(work)
+    stopped = asyncio.Event()
+    watcher = asyncio.ensure_future(
+        _wait_for_disconnect(is_disconnected, poll_interval, stopped)
+    )
+    try:
+        done, _ = await asyncio.wait(
+            [task, watcher], return_when=asyncio.FIRST_COMPLETED
+        )
+        if watcher in done and not task.done():
+            if watcher.exception() is not None:
+                logger.warning(
+                    f"Cannot watch the client connection ({watcher.exception()})"
+                )
+                await asyncio.wait([task])
+            else:
+                task.cancel()
+                # Let the work unwind (and save what it finished) first
+                await asyncio.wait([task])
+                if task.cancelled():
+                    raise ClientDisconnected("Client disconnected")
+        return task.result()
+    finally:
+        stopped.set()
+        for child in (task, watcher):
+            child.cancel()
+        await asyncio.gather(task, watcher, return_exceptions=True)
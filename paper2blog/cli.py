@@ -0,0 +1,110 @@
+"""
+Command line batch conversion.
+
+    paper2blog paper1.pdf paper2.pdf --language chinese --output posts/
+
+Papers are converted concurrently through the staged pipeline and each post is
+written to ``<output>/<pdf name>.md``. Heavy modules are only imported once the
+arguments have been parsed, so ``--help`` and argument errors return instantly.
+"""
+
+import sys
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="paper2blog", description="Convert PDF papers into blog posts"
+    )
+    parser.add_argument("pdfs", nargs="+", type=Path, help="PDF files to convert")
+    parser.add_argument("-l", "--language", default="english")
+    parser.add_argument("-o", "--output", type=Path, default=Path("."))
+    parser.add_argument(
+        "--engine", default=None, help="marker, pymupdf, auto (default) or fast"
+    )
+    parser.add_argument(
+        "--include-appendix-figures", action="store_true", default=False
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="seconds per paper before stages degrade "
+        "(default PAPER2BLOG_DEADLINE_SECONDS, 0 for none)",
+    )
+    parser.add_argument(
+        "--priority",
+        default="batch",
+        choices=("interactive", "batch", "background"),
+        help="priority class against other conversions sharing the pipeline "
+        "and model providers (default batch)",
+    )
+    return parser
+
+
+async def convert_batch(args: argparse.Namespace) -> int:
+    from paper2blog.converter import PaperConverter
+    from paper2blog.deadline import deadline_scope
+    from paper2blog.executors import run_io, shutdown_executors
+    from paper2blog.pipeline import ConversionPipeline
+    from paper2blog.scheduling import priority_scope
+    from paper2blog.storage import PaperStore
+
+    store = PaperStore()
+    pipeline = ConversionPipeline(PaperConverter(store))
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    async def convert(pdf: Path) -> bool:
+        paper_id, pdf_path = await run_io(store.save_paper, pdf.read_bytes())
+        with deadline_scope(args.deadline), priority_scope(args.priority):
+            result = await pipeline.convert_from_pdf(
+                str(pdf_path),
+                args.language,
+                engine=args.engine,
+                include_appendix_figures=args.include_appendix_figures,
+                paper_id=paper_id,
+                filename=pdf.name,
+            )
+        for degradation in result.degradations:
+            logger.warning(f"{pdf}: {degradation}")
+        if result.error:
+            logger.error(f"{pdf}: {result.error}")
+            return False
+        target = args.output / f"{pdf.stem}.md"
+        await run_io(target.write_text, result.content or "", encoding="utf-8")
+        logger.info(f"{pdf} -> {target}")
+        return True
+
+    try:
+        results = await asyncio.gather(*(convert(pdf) for pdf in args.pdfs))
+    finally:
+        await pipeline.stop()
+        shutdown_executors(wait=False)
+    return 0 if all(results) else 1
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    missing = [str(pdf) for pdf in args.pdfs if not pdf.is_file()]
+    if missing:
+        print(f"No such file: {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    return asyncio.run(convert_batch(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,116 +1,343 @@
 import io
 import os
-from bs4 import BeautifulSoup
-import requests
-from paper2blog.model_types import ConversionResponse, ImageInfo, BlogPost
-from paper2blog.utils import extract_content_from_pdf, download_image
+import asyncio
+import weakref
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from paper2blog.deadline import degradations, degrade, running_low
+from paper2blog.executors import run_cpu, run_io
+from paper2blog.llm_handler import LLMHandler
+from paper2blog.model_types import ConversionResponse, GeneratedBlog
+from paper2blog.records import FigureRecord
+from paper2blog.storage import PaperStore, conversion_id, parse_conversion_id
+from paper2blog.utils import (
+    caption_figures,
+    download_image,
+    extract_uncaptioned_content,
+    parse_html,
+    select_figures,
+)
+
+# Extraction keeps this many candidates per figure slot for the select stage
+FIGURE_CANDIDATE_FACTOR = 2
+
+# Section edits of the same conversion run one at a time, so concurrent
+# edits of different sections do not overwrite each other
+_edit_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+    weakref.WeakValueDictionary()
+)
 
 
 class PaperConverter:
-    def __init__(self):
+    def __init__(self, store: Optional[PaperStore] = None, max_images: int = 6):
         self.llm_handler = LLMHandler()
+        self.store = store or PaperStore()
+        self.max_images = max_images
 
-    async def convert_from_pdf(
-        self, pdf_path: str, target_language: str = "en"
+    def _build_response(
+        self, blog: GeneratedBlog, language: str, images: List[FigureRecord]
     ) -> ConversionResponse:
-        """Convert PDF to blog post"""
-        try:
-            # Extract content from PDF using the file path directly
-            text_content, images = await extract_content_from_pdf(pdf_path)
+        # Internal figure records become API models only here
+        return ConversionResponse(
+            title=blog.title,
+            content=self.llm_handler.render_blog(
+                blog, images, language, url_for=self.store.public_url
+            ),
+            summary=blog.summary,
+            language=language,
+            images=[
+                image.to_image_info(url_for=self.store.public_url) for image in images
+            ],
+            tags=blog.tags,
+            sections=blog.sections,
+            figures=blog.figures,
+            degradations=degradations(),
+        )
 
-            try:
-                # Generate blog post using LLM in one shot
-                blog_post = await self.llm_handler.generate_blog_post(
-                    text_content, target_language=target_language, image_info=images
-                )
+    async def save_result(
+        self,
+        paper_id: str,
+        original_filename: Optional[str],
+        language: str,
+        result: ConversionResponse,
+    ) -> Path:
+        """Persist the generated post and its metadata next to the paper"""
+        result.conversion_id = conversion_id(paper_id, language)
+        figures = await run_io(
+            self.store.figure_refs, [image.url for image in result.images]
+        )
+        metadata = {
+            "paper_id": paper_id,
+            "conversion_id": result.conversion_id,
+            "original_filename": original_filename,
+            "language": language,
+            "conversion_date": datetime.now().isoformat(),
+            # Stored figures the post links to, so GC keeps them
+            "figures": figures,
+            # Structured post (the markdown is in blog.md) for section edits
+            "post": result.model_dump(exclude={"content", "images"}),
+        }
+        return await run_io(
+            self.store.save_conversion,
+            paper_id,
+            language,
+            result.content or "",
+            metadata,
+        )
 
-                if isinstance(blog_post, dict):
-                    # Handle dictionary response
-                    return ConversionResponse(
-                        title=blog_post.get("title", ""),
-                        content=blog_post.get("content", ""),
-                        summary="",  # Summary is now part of the content
-                        language=target_language,
-                        images=images,
-                    )
-                elif isinstance(blog_post, BlogPost):
-                    # Handle BlogPost response
-                    return ConversionResponse(
-                        title=blog_post.title,
-                        content=blog_post.content,
-                        summary="",  # Summary is now part of the content
-                        language=target_language,
-                        images=images,
-                    )
-                else:
-                    raise ValueError(
-                        f"Unexpected response type from LLM handler: {type(blog_post)}"
-                    )
-
-            except Exception as e:
-                return ConversionResponse(
-                    language=target_language,
-                    images=images,
-                    error=f"Error in LLM processing: {str(e)}",
-                )
+    async def save_extraction(
+        self, paper_id: str, text_content: str, images: List[FigureRecord]
+    ) -> Path:
+        """Persist the extracted text and captioned figures of a paper"""
+        return await run_io(
+            self.store.save_extraction,
+            paper_id,
+            text_content,
+            self._figure_dicts(images),
+        )
 
-        except Exception as e:
-            return ConversionResponse(
-                language=target_language, error=f"Error in PDF processing: {str(e)}"
+    def _figure_dicts(self, figures: List[FigureRecord]) -> List[Dict[str, Any]]:
+        # Stored figure paths are relative to the data directory
+        return [
+            dict(figure.to_dict(), path=self.store.relative(figure.path))
+            for figure in figures
+        ]
+
+    def _figure_records(self, figures: List[Dict[str, Any]]) -> List[FigureRecord]:
+        return [
+            FigureRecord.from_dict(
+                dict(figure, path=str(self.store.root / figure["path"]))
             )
+            for figure in figures
+        ]
 
-    async def convert_from_url(self, url: str, language: str) -> ConversionResponse:
-        # Download and parse webpage
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, "html.parser")
+    async def regenerate_section(
+        self, conversion_id: str, section: str, instructions: str = ""
+    ) -> ConversionResponse:
+        """Rewrite one section of a stored post and return the patched post.
 
-        # Extract text content
-        text_content = soup.get_text()
+        Reuses the stored extraction, captions and the other sections, so it
+        costs a single short LLM call. Raises ``KeyError`` for an unknown
+        conversion or section.
+        """
+        paper_id, language = parse_conversion_id(conversion_id)
+        lock = _edit_locks.setdefault(conversion_id, asyncio.Lock())
+        async with lock:
+            metadata, extraction = await asyncio.gather(
+                run_io(self.store.load_conversion, paper_id, language),
+                run_io(self.store.load_extraction, paper_id),
+            )
+            if not metadata or "post" not in metadata or extraction is None:
+                raise KeyError(f"Unknown conversion '{conversion_id}'")
 
-        # Extract and process images
-        image_infos = []
-        for img in soup.find_all("img"):
-            img_url = img.get("src")
-            if img_url:
-                img_data = download_image(img_url)
-                markdown = f"![{img.get('alt', '')}]({img_url})"
-                image_infos.append(
-                    ImageInfo(
-                        caption=img.get("alt", ""), url=img_url, markdown=markdown
-                    )
-                )
+            post = ConversionResponse(**metadata["post"])
+            blog = post.to_blog()
+            index = blog.section_index(section)
+            images = self._figure_records(extraction["figures"])
+            blog.sections = list(blog.sections)
+            blog.sections[index] = await self.llm_handler.regenerate_section(
+                extraction["text"],
+                blog,
+                index,
+                images,
+                target_language=post.language,
+                instructions=instructions,
+            )
+            result = self._build_response(blog, post.language, images)
+            await self.save_result(
+                paper_id, metadata.get("original_filename"), post.language, result
+            )
+            return result
 
+    async def generate_from_content(
+        self, text_content: str, target_language: str, images: List[FigureRecord]
+    ) -> ConversionResponse:
+        """Generate the blog post from already extracted and captioned content"""
         try:
             # Generate blog post using LLM in one shot
-            blog_post = await self.llm_handler.generate_blog_post(
-                text_content, target_language=language, image_info=image_infos
+            blog = await self.llm_handler.generate_blog_post(
+                text_content, target_language=target_language, image_info=images
             )
-
-            if isinstance(blog_post, dict):
-                return ConversionResponse(
-                    title=blog_post.get("title", ""),
-                    content=blog_post.get("content", ""),
-                    summary="",  # Summary is now part of the content
-                    language=language,
-                    images=image_infos,
-                    tags=blog_post.get("tags", []),
-                )
-            elif isinstance(blog_post, BlogPost):
-                return ConversionResponse(
-                    title=blog_post.title,
-                    content=blog_post.content,
-                    summary="",  # Summary is now part of the content
-                    language=language,
-                    images=image_infos,
-                )
-            else:
-                raise ValueError(
-                    f"Unexpected response type from LLM handler: {type(blog_post)}"
-                )
+            return self._build_response(blog, target_language, images)
 
         except Exception as e:
             return ConversionResponse(
-                language=language,
-                images=image_infos,
+                language=target_language,
+                images=[
+                    image.to_image_info(url_for=self.store.public_url)
+                    for image in images
+                ],
                 error=f"Error in LLM processing: {str(e)}",
+                degradations=degradations(),
+            )
+
+    async def extract(
+        self,
+        pdf_path: str,
+        engine: Optional[str] = None,
+        include_appendix_figures: bool = False,
+        paper_id: Optional[str] = None,
+    ) -> Tuple[str, List[FigureRecord]]:
+        """Extract stage: markdown text plus candidate figures, uncaptioned.
+
+        With a ``paper_id`` the result is cached next to the paper, so a
+        conversion that was cancelled later on does not extract it again.
+        """
+        stage = "-".join(
+            [
+                "extract",
+                engine or os.getenv("PAPER2BLOG_EXTRACTION_ENGINE", "auto"),
+                "appendix" if include_appendix_figures else "body",
+                os.getenv("PAPER2BLOG_STOP_AT_REFERENCES", "1"),
+            ]
+        )
+        if paper_id:
+            cached = await run_io(self.store.load_stage, paper_id, stage)
+            if cached is not None:
+                figures = self._figure_records(cached["figures"])
+                # Figures no longer referenced may have been garbage collected
+                if all(os.path.exists(figure.path) for figure in figures):
+                    return cached["text"], figures
+
+        text_content, figures = await extract_uncaptioned_content(
+            pdf_path,
+            max_images=self.max_images * FIGURE_CANDIDATE_FACTOR,
+            store=self.store,
+            engine=engine,
+            include_appendix_figures=include_appendix_figures,
+        )
+        if paper_id:
+            await run_io(
+                self.store.save_stage,
+                paper_id,
+                stage,
+                {"text": text_content, "figures": self._figure_dicts(figures)},
             )
+        return text_content, figures
+
+    async def select(self, figures: List[FigureRecord]) -> List[FigureRecord]:
+        """Select stage: the figures worth captioning, fewer when the request
+        deadline runs low"""
+        max_images = self.max_images
+        if running_low() and len(figures) > max(1, max_images // 2):
+            max_images = max(1, max_images // 2)
+            degrade(f"captioned at most {max_images} figures")
+        return select_figures(figures, max_images)
+
+    async def caption(
+        self,
+        text_content: str,
+        figures: List[FigureRecord],
+        paper_id: Optional[str] = None,
+    ) -> List[FigureRecord]:
+        """Caption stage: describe each selected figure with the VLM.
+
+        With a ``paper_id`` captions are cached per figure, including those
+        finished before the stage was cancelled, and only figures without a
+        cached caption are sent to the VLM.
+        """
+        if not paper_id:
+            return await caption_figures(text_content, figures)
+
+        cached = await run_io(self.store.load_stage, paper_id, "captions") or {}
+        captions = dict(cached)
+        pending = [figure for figure in figures if figure.id not in captions]
+        try:
+            if pending:
+                await caption_figures(text_content, pending, captions=captions)
+        finally:
+            if captions != cached:
+                # Shielded so captions survive the cancellation that got us here
+                await asyncio.shield(
+                    run_io(self.store.save_stage, paper_id, "captions", captions)
+                )
+        return [
+            figure.with_caption(captions[figure.id])
+            for figure in figures
+            if figure.id in captions
+        ]
+
+    async def generate_languages(
+        self, text_content: str, languages: Sequence[str], images: List[FigureRecord]
+    ) -> Dict[str, ConversionResponse]:
+        """Generate one post per language from the same content, concurrently"""
+        results = await asyncio.gather(
+            *(
+                self.generate_from_content(text_content, language, images)
+                for language in languages
+            )
+        )
+        return dict(zip(languages, results))
+
+    async def convert_from_pdf(
+        self,
+        pdf_path: str,
+        target_language: str = "en",
+        engine: Optional[str] = None,
+        include_appendix_figures: bool = False,
+    ) -> ConversionResponse:
+        """Convert PDF to blog post, running the stages one after another"""
+        results = await self.convert_from_pdf_languages(
+            pdf_path, [target_language], engine, include_appendix_figures
+        )
+        return results[target_language]
+
+    async def convert_from_pdf_languages(
+        self,
+        pdf_path: str,
+        languages: Sequence[str],
+        engine: Optional[str] = None,
+        include_appendix_figures: bool = False,
+    ) -> Dict[str, ConversionResponse]:
+        """Extract and caption once, then generate a post for each language"""
+        try:
+            text_content, figures = await self.extract(
+                pdf_path, engine, include_appendix_figures
+            )
+            images = await self.caption(text_content, await self.select(figures))
+        except Exception as e:
+            return {
+                language: ConversionResponse(
+                    language=language,
+                    error=f"Error in PDF processing: {str(e)}",
+                    degradations=degradations(),
+                )
+                for language in languages
+            }
+
+        return await self.generate_languages(text_content, languages, images)
+
+    async def convert_from_url(self, url: str, language: str) -> ConversionResponse:
+        results = await self.convert_from_url_languages(url, [language])
+        return results[language]
+
+    async def convert_from_url_languages(
+        self, url: str, languages: Sequence[str]
+    ) -> Dict[str, ConversionResponse]:
+        # Download and parse webpage
+        import requests
+
+        response = await run_io(requests.get, url)
+        text_content, page_images = await run_cpu(parse_html, response.text)
+
+        # Extract and process images
+        await asyncio.gather(
+            *(run_io(download_image, img_url) for img_url, _ in page_images)
+        )
+        image_infos = [
+            FigureRecord.from_url(img_url, caption=alt) for img_url, alt in page_images
+        ]
+        return await self.generate_languages(text_content, languages, image_infos)
+
+
+def parse_languages(values: Iterable[str]) -> List[str]:
+    """Target languages from form values, each possibly comma separated,
+    without duplicates and in the order given."""
+    languages: List[str] = []
+    for value in values:
+        for language in value.split(","):
+            language = language.strip()
+            if language and language not in languages:
+                languages.append(language)
+    return languages
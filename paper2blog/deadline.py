@@ -0,0 +1,116 @@
+"""
+Per-request deadline budgets.
+
+A conversion runs inside ``deadline_scope(seconds)``. The deadline lives in a
+context variable, so it follows the request into every task it starts (the
+pipeline hands it to its stage workers explicitly) without being threaded
+through each call. Stages ask for their share of the remaining time with
+``budget()`` and, when it runs low, degrade instead of failing: marker falls
+back to PyMuPDF, fewer figures are captioned, the paper's own captions replace
+VLM captions and the blog is written by the faster ``blog_fast`` route. Each
+degradation is recorded with ``degrade()`` and reported in the response.
+
+Without a scope there is no deadline: ``budget()`` returns None and nothing
+degrades.
+"""
+
+import os
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Server default for requests that do not set their own deadline (seconds,
+# 0 disables)
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("PAPER2BLOG_DEADLINE_SECONDS", "600"))
+
+# Below this many seconds, stages switch to their cheaper variant
+LOW_BUDGET_SECONDS = float(os.getenv("PAPER2BLOG_DEADLINE_LOW_SECONDS", "60"))
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out in a stage that cannot degrade."""
+
+
+class Deadline:
+    __slots__ = ("expires_at", "degradations")
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        # Degradations applied to meet the deadline, in order
+        self.degradations: List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.1f}s)"
+
+
+_current: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar(
+    "paper2blog_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(
+    deadline: Union[Deadline, float, None] = None,
+) -> Iterator[Optional[Deadline]]:
+    """Run the block under ``deadline`` (a Deadline or seconds from now).
+
+    ``None`` uses the server default; a non-positive number of seconds runs
+    without a deadline.
+    """
+    if deadline is None:
+        deadline = DEFAULT_DEADLINE_SECONDS
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline) if deadline > 0 else None
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def budget(share: float = 1.0, cap: Optional[float] = None) -> Optional[float]:
+    """Seconds a stage may spend: ``share`` of the time left, at most ``cap``.
+
+    Returns ``cap`` when there is no deadline.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return cap
+    seconds = deadline.remaining() * share
+    return min(seconds, cap) if cap is not None else seconds
+
+
+def running_low(threshold: float = LOW_BUDGET_SECONDS) -> bool:
+    """Whether less than ``threshold`` seconds are left."""
+    deadline = _current.get()
+    return deadline is not None and deadline.remaining() < threshold
+
+
+def degrade(reason: str) -> None:
+    """Record a degradation applied to stay within the deadline."""
+    deadline = _current.get()
+    if deadline is None:
+        return
+    logger.warning(f"Degrading to meet the deadline ({deadline!r}): {reason}")
+    if reason not in deadline.degradations:
+        deadline.degradations.append(reason)
+
+
+def degradations() -> List[str]:
+    deadline = _current.get()
+    return list(deadline.degradations) if deadline is not None else []
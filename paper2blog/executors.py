@@ -0,0 +1,91 @@
+"""
+Shared executors for blocking work in the async pipeline.
+
+``run_io`` runs blocking file and network calls on a thread pool and
+``run_cpu`` runs CPU-heavy work (HTML parsing, Pillow decode/encode, ...) on a
+process pool, so the event loop stays responsive under concurrent conversions.
+Functions passed to ``run_cpu`` and their arguments must be picklable.
+
+Pool sizes are configured with ``PAPER2BLOG_IO_WORKERS`` and
+``PAPER2BLOG_CPU_WORKERS`` (or ``configure_executors``). Setting the CPU pool
+size to 0 runs CPU work on the thread pool instead of separate processes.
+"""
+
+import os
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+_cpu_executor: Optional[ProcessPoolExecutor] = None
+_io_workers: Optional[int] = None
+_cpu_workers: Optional[int] = None
+
+
+def io_workers() -> int:
+    if _io_workers is not None:
+        return _io_workers
+    default = min(32, (os.cpu_count() or 1) + 4)
+    return int(os.getenv("PAPER2BLOG_IO_WORKERS", default))
+
+
+def cpu_workers() -> int:
+    if _cpu_workers is not None:
+        return _cpu_workers
+    return int(os.getenv("PAPER2BLOG_CPU_WORKERS", os.cpu_count() or 1))
+
+
+def configure_executors(
+    io: Optional[int] = None, cpu: Optional[int] = None
+) -> None:
+    """Override pool sizes; existing pools are shut down and recreated lazily."""
+    global _io_workers, _cpu_workers
+    shutdown_executors(wait=False)
+    _io_workers, _cpu_workers = io, cpu
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(
+            max_workers=io_workers(), thread_name_prefix="paper2blog-io"
+        )
+    return _io_executor
+
+
+def get_cpu_executor() -> Executor:
+    global _cpu_executor
+    if cpu_workers() <= 0:
+        return get_io_executor()
+    if _cpu_executor is None:
+        _cpu_executor = ProcessPoolExecutor(max_workers=cpu_workers())
+    return _cpu_executor
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking I/O call on the shared thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_io_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+async def run_cpu(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a CPU-heavy call on the shared process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_cpu_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    global _io_executor, _cpu_executor
+    if _io_executor is not None:
+        _io_executor.shutdown(wait=wait)
+        _io_executor = None
+    if _cpu_executor is not None:
+        _cpu_executor.shutdown(wait=wait)
+        _cpu_executor = None
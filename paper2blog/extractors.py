@@ -0,0 +1,535 @@
+"""
+Pluggable PDF extraction engines.
+
+- ``marker``: the external marker server (best quality, slow, may be down)
+- ``pymupdf``: in-process PyMuPDF extraction, fast on born-digital PDFs
+- ``auto``: marker, falling back to PyMuPDF when it fails or times out
+- ``fast``: PyMuPDF for born-digital PDFs, ``auto`` for scanned ones
+
+Engines return raw markdown plus the figure bytes; captioning and storage are
+done by ``extract_content_from_pdf``. The default engine is set with
+``PAPER2BLOG_EXTRACTION_ENGINE`` and can be overridden per request.
+"""
+
+import os
+import re
+import asyncio
+import base64
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
+
+from paper2blog import serialization
+from paper2blog.deadline import budget, degrade, running_low
+from paper2blog.executors import cpu_workers, run_cpu, run_io
+from paper2blog.profiling import section
+
+logger = logging.getLogger(__name__)
+
+MARKER_URL = "http://localhost:8024/marker"
+
+# Share of the remaining request deadline a marker request may take
+MARKER_DEADLINE_SHARE = 0.5
+
+# Figure captions in born-digital papers, e.g. "Figure 3:" or "Fig. 2."
+CAPTION_PATTERN = re.compile(r"^(fig\.?|figure)\s*\d+", re.IGNORECASE)
+
+# Headings that start the back matter; nothing after them is used for the blog
+BACK_MATTER_HEADINGS = (
+    "references",
+    "bibliography",
+    "appendix",
+    "appendices",
+    "acknowledgements",
+    "acknowledgments",
+)
+
+# Section numbering in front of a heading: "7", "7.1", "A", "IV", "A.", "7:"
+SECTION_NUMBER = re.compile(r"^(\d+(\.\d+)*|[ivx]+|[a-z])[.:)]?\s+")
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class ExtractionResult:
+    """Markdown text plus ``(name, bytes)`` figures, in document order."""
+
+    __slots__ = ("markdown", "images", "engine")
+
+    def __init__(
+        self, markdown: str, images: List[Tuple[str, bytes]], engine: str
+    ):
+        self.markdown = markdown
+        self.images = images
+        self.engine = engine
+
+
+class ExtractionEngine(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def extract(
+        self,
+        pdf_path: str,
+        extract_images: bool = True,
+        max_images: Optional[int] = None,
+        page_limit: Optional[int] = None,
+    ) -> ExtractionResult:
+        """Extract markdown and figures, optionally from the first ``page_limit`` pages only."""
+
+
+class MarkerEngine(ExtractionEngine):
+    name = "marker"
+
+    def __init__(self, url: Optional[str] = None, timeout: Optional[float] = None):
+        self.url = url or os.getenv("MARKER_URL", MARKER_URL)
+        self.timeout = timeout
+
+    async def extract(
+        self,
+        pdf_path: str,
+        extract_images: bool = True,
+        max_images: Optional[int] = None,
+        page_limit: Optional[int] = None,
+    ) -> ExtractionResult:
+        import httpx
+
+        post_data = {"filepath": pdf_path}
+        if page_limit:
+            post_data["page_range"] = f"0-{page_limit - 1}"
+        # An async request (instead of requests in a thread) is aborted when
+        # the conversion is cancelled, releasing the connection right away.
+        # It may use part of the request's deadline, leaving time for the
+        # PyMuPDF fallback and the later stages.
+        timeout = budget(MARKER_DEADLINE_SHARE, self.timeout)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.post(
+                self.url, content=serialization.dumps(post_data)
+            )
+        # Marker responses carry every figure base64-encoded, often megabytes
+        result = await run_io(serialization.loads, response.content)
+        if not result.get("success"):
+            raise ExtractionError("Marker API failed to process PDF")
+
+        images = []
+        if extract_images:
+            items = list(result.get("images", {}).items())[:max_images]
+            with section("marker_base64_decode"):
+                images = [(name, base64.b64decode(data)) for name, data in items]
+        return ExtractionResult(result.get("output", ""), images, self.name)
+
+
+def _fitz():
+    try:
+        import pymupdf as fitz
+    except ImportError:  # PyMuPDF < 1.24 only ships the "fitz" name
+        import fitz
+    return fitz
+
+
+def _open_pdf(pdf_path: str):
+    return _fitz().open(pdf_path)
+
+
+def _heading_level(size: float, body_size: float, text: str, bold: bool) -> int:
+    """Markdown heading level for a text block, 0 for body text."""
+    if len(text) > 120 or text.endswith((".", ",", ";")) or CAPTION_PATTERN.match(text):
+        return 0
+    ratio = size / body_size if body_size else 1.0
+    if ratio >= 1.6:
+        return 1
+    if ratio >= 1.3:
+        return 2
+    if ratio >= 1.1 or (bold and re.match(r"^(\d+(\.\d+)*\.?|[A-Z]\.)\s+\S", text)):
+        return 3
+    return 0
+
+
+def _block_text(block: Dict) -> Tuple[str, float, bool]:
+    lines, sizes, bold = [], Counter(), True
+    for line in block.get("lines", []):
+        spans = [s for s in line.get("spans", []) if s["text"].strip()]
+        if not spans:
+            continue
+        for span in spans:
+            sizes[round(span["size"], 1)] += len(span["text"])
+            bold = bold and bool(span["flags"] & 16)
+        lines.append("".join(s["text"] for s in spans).strip())
+
+    text = ""
+    for line in lines:
+        if text.endswith("-"):
+            # Re-join words hyphenated across line breaks
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}" if text else line
+    size = sizes.most_common(1)[0][0] if sizes else 0.0
+    return text, size, bold and bool(lines)
+
+
+# A raw block is ("text", text, font size, bold) or ("image", name, 0.0, False).
+# Headings can only be decided once the body font size of the whole document
+# is known, so workers return raw blocks plus a font-size histogram.
+RawBlock = Tuple[str, str, float, bool]
+
+
+def extract_page_range(
+    pdf_path: str,
+    start: int,
+    stop: int,
+    extract_images: bool = True,
+    min_image_size: int = 100,
+    extract_text: bool = True,
+) -> Tuple[List[RawBlock], List[Tuple[str, bytes]], Dict[float, int]]:
+    """Extract raw blocks, figures and font sizes from pages ``[start, stop)``.
+
+    Runs in a worker process. Each worker opens the document from ``pdf_path``
+    (PyMuPDF reads it through the OS page cache), so only the path and page
+    range cross the process boundary, never the PDF bytes.
+    """
+    doc = _open_pdf(pdf_path)
+    try:
+        blocks: List[RawBlock] = []
+        images: List[Tuple[str, bytes]] = []
+        font_sizes: Counter = Counter()
+        seen = set()
+        for page_no in range(start, min(stop, doc.page_count)):
+            figure_no = 0
+            if extract_text:
+                page_blocks = doc[page_no].get_text("dict", sort=True)["blocks"]
+            else:
+                # Figures only: skip text layout analysis entirely
+                page_blocks = doc[page_no].get_text(
+                    "dict", flags=_fitz().TEXT_PRESERVE_IMAGES
+                )["blocks"]
+            for block in page_blocks:
+                if block["type"] == 1:
+                    if not extract_images:
+                        continue
+                    if min(block["width"], block["height"]) < min_image_size:
+                        continue
+                    # Number every figure on the page, duplicates included, so
+                    # names do not depend on how pages were sharded
+                    name = f"_page_{page_no}_Figure_{figure_no}.{block['ext']}"
+                    figure_no += 1
+                    data = block["image"]
+                    digest = hashlib.sha1(data).hexdigest()
+                    if digest in seen:
+                        continue
+                    seen.add(digest)
+                    images.append((name, data))
+                    blocks.append(("image", name, 0.0, False))
+                    continue
+
+                if not extract_text:
+                    continue
+                text, size, bold = _block_text(block)
+                if text:
+                    font_sizes[size] += len(text)
+                    blocks.append(("text", text, size, bold))
+        return blocks, images, dict(font_sizes)
+    finally:
+        doc.close()
+
+
+def blocks_to_markdown(blocks: List[RawBlock], body_size: float) -> List[str]:
+    """Turn raw blocks into markdown blocks, merging figure captions."""
+    markdown: List[str] = []
+    for kind, text, size, bold in blocks:
+        if kind == "image":
+            markdown.append(f"![]({text})")
+            continue
+        if markdown and markdown[-1].startswith("![](") and CAPTION_PATTERN.match(text):
+            # Merge the caption into the preceding figure, as marker does
+            markdown[-1] = f"![{text}]({markdown[-1][4:-1]})"
+            continue
+        level = _heading_level(size, body_size, text, bold)
+        markdown.append(f"{'#' * level} {text}" if level else text)
+    return markdown
+
+
+def page_count(pdf_path: str) -> int:
+    doc = _open_pdf(pdf_path)
+    try:
+        return doc.page_count
+    finally:
+        doc.close()
+
+
+def page_count_from_bytes(data: bytes) -> Optional[int]:
+    """Number of pages of a PDF given as bytes, None if it is not a readable
+    PDF. Raises ``ImportError`` without PyMuPDF."""
+    fitz = _fitz()
+    try:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            return doc.page_count
+    except RuntimeError:
+        # fitz.FileDataError (a RuntimeError) for damaged or non-PDF data;
+        # older PyMuPDF releases raise plain RuntimeError
+        return None
+
+
+def split_pages(total: int, workers: int, min_pages: int = 4) -> List[Tuple[int, int]]:
+    """Split ``total`` pages into at most ``workers`` contiguous ranges."""
+    shards = max(1, min(workers, total // min_pages))
+    size, extra = divmod(total, shards)
+    ranges, start = [], 0
+    for idx in range(shards):
+        stop = start + size + (1 if idx < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def merge_page_ranges(
+    results: List[Tuple[List[RawBlock], List[Tuple[str, bytes]], Dict[float, int]]]
+) -> Tuple[List[str], List[Tuple[str, bytes]]]:
+    """Merge per-range results (in page order) into markdown blocks and figures."""
+    font_sizes: Counter = Counter()
+    blocks: List[RawBlock] = []
+    images: List[Tuple[str, bytes]] = []
+    seen = set()
+    for range_blocks, range_images, range_sizes in results:
+        font_sizes.update(range_sizes)
+        dropped = set()
+        for name, data in range_images:
+            digest = hashlib.sha1(data).hexdigest()
+            if digest in seen:
+                # Same image repeated on pages handled by another worker
+                dropped.add(name)
+                continue
+            seen.add(digest)
+            images.append((name, data))
+        blocks.extend(
+            b for b in range_blocks if not (b[0] == "image" and b[1] in dropped)
+        )
+    body_size = font_sizes.most_common(1)[0][0] if font_sizes else 0.0
+    return blocks_to_markdown(blocks, body_size), images
+
+
+def extract_pdf_with_pymupdf(
+    pdf_path: str, extract_images: bool = True, min_image_size: int = 100
+) -> Tuple[List[str], List[Tuple[str, bytes]]]:
+    """Extract markdown blocks and figures from the whole PDF in one process."""
+    total = page_count(pdf_path)
+    return merge_page_ranges(
+        [extract_page_range(pdf_path, 0, total, extract_images, min_image_size)]
+    )
+
+
+def is_born_digital(pdf_path: str, sample_pages: int = 3, min_chars: int = 200) -> bool:
+    """Whether the PDF has a usable text layer (i.e. is not a scan)."""
+    doc = _open_pdf(pdf_path)
+    try:
+        pages = range(min(sample_pages, doc.page_count))
+        chars = sum(len(doc[i].get_text("text").strip()) for i in pages)
+        return chars >= min_chars * max(1, len(pages))
+    finally:
+        doc.close()
+
+
+def is_back_matter_heading(text: str) -> bool:
+    """Whether a text block starts with a references/appendix style heading."""
+    stripped = text.strip()
+    if not stripped:
+        return False
+    line = stripped.splitlines()[0].strip().lower()
+    if len(line) > 60:
+        return False
+    line = SECTION_NUMBER.sub("", line).strip(" .:")
+    return any(
+        line == heading or line.startswith(heading + " ")
+        for heading in BACK_MATTER_HEADINGS
+    )
+
+
+def _is_back_matter_line(line: Dict, body_size: float) -> bool:
+    """Whether a text line is a back-matter heading: set in a larger or bold
+    font, not just a mention of "References" in running text or a table."""
+    spans = [span for span in line.get("spans", []) if span["text"].strip()]
+    if not spans:
+        return False
+    size = max(span["size"] for span in spans)
+    bold = all(
+        span["flags"] & 16 or "bold" in span.get("font", "").lower()
+        for span in spans
+    )
+    if not bold and size < body_size * 1.1:
+        return False
+    return is_back_matter_heading("".join(span["text"] for span in spans))
+
+
+def find_back_matter_page(pdf_path: str) -> Optional[int]:
+    """Index of the page where the back matter (references, appendix) starts.
+
+    Uses the PDF outline when there is one. Otherwise looks for a heading-sized
+    back-matter line from the middle of the document on, so a "References"
+    mention in the body cannot cut it short. Returns None if there is none.
+    """
+    doc = _open_pdf(pdf_path)
+    try:
+        for _, title, page in doc.get_toc(simple=True):
+            if page > 1 and is_back_matter_heading(title):
+                return page - 1
+        sizes: Counter = Counter()
+        for page_no in range(max(1, doc.page_count // 2), doc.page_count):
+            lines = [
+                line
+                for block in doc[page_no].get_text("dict")["blocks"]
+                if block.get("type") == 0
+                for line in block.get("lines", [])
+            ]
+            for line in lines:
+                for span in line.get("spans", []):
+                    sizes[round(span["size"], 1)] += len(span["text"].strip())
+            # Body font size: the most common one on the pages scanned so far
+            body_size = sizes.most_common(1)[0][0] if sizes else 0.0
+            if any(_is_back_matter_line(line, body_size) for line in lines):
+                return page_no
+        return None
+    finally:
+        doc.close()
+
+
+class PyMuPDFEngine(ExtractionEngine):
+    """In-process extraction, sharded by page range across the CPU pool."""
+
+    name = "pymupdf"
+
+    def __init__(self, min_image_size: int = 100, workers: Optional[int] = None):
+        self.min_image_size = min_image_size
+        self.workers = workers or int(
+            os.getenv("PAPER2BLOG_EXTRACTION_WORKERS", cpu_workers() or 1)
+        )
+
+    async def extract(
+        self,
+        pdf_path: str,
+        extract_images: bool = True,
+        max_images: Optional[int] = None,
+        page_limit: Optional[int] = None,
+    ) -> ExtractionResult:
+        total = await run_io(page_count, pdf_path)
+        if page_limit:
+            total = min(total, page_limit)
+        results = await asyncio.gather(
+            *(
+                run_cpu(
+                    extract_page_range,
+                    pdf_path,
+                    start,
+                    stop,
+                    extract_images,
+                    self.min_image_size,
+                )
+                for start, stop in split_pages(total, self.workers)
+            )
+        )
+        blocks, images = merge_page_ranges(list(results))
+        return ExtractionResult("\n\n".join(blocks), images[:max_images], self.name)
+
+    async def extract_figures(
+        self, pdf_path: str, start: int, stop: Optional[int] = None
+    ) -> List[Tuple[str, bytes]]:
+        """Extract only the figures of pages ``[start, stop)``, without text."""
+        stop = stop if stop is not None else await run_io(page_count, pdf_path)
+        _, images, _ = await run_cpu(
+            extract_page_range,
+            pdf_path,
+            start,
+            stop,
+            True,
+            self.min_image_size,
+            False,
+        )
+        return images
+
+
+class AutoEngine(ExtractionEngine):
+    """Marker first, PyMuPDF when marker fails, is unreachable or too slow."""
+
+    name = "auto"
+
+    def __init__(
+        self,
+        primary: Optional[ExtractionEngine] = None,
+        fallback: Optional[ExtractionEngine] = None,
+    ):
+        timeout = float(os.getenv("MARKER_TIMEOUT", "300"))
+        self.primary = primary or MarkerEngine(timeout=timeout)
+        self.fallback = fallback or PyMuPDFEngine()
+
+    async def extract(
+        self,
+        pdf_path: str,
+        extract_images: bool = True,
+        max_images: Optional[int] = None,
+        page_limit: Optional[int] = None,
+    ) -> ExtractionResult:
+        if running_low():
+            degrade(
+                f"skipped {self.primary.name} extraction, used {self.fallback.name}"
+            )
+            return await self.fallback.extract(
+                pdf_path, extract_images, max_images, page_limit
+            )
+        try:
+            return await self.primary.extract(
+                pdf_path, extract_images, max_images, page_limit
+            )
+        except Exception as e:
+            logger.warning(
+                f"{self.primary.name} extraction failed ({e}), "
+                f"falling back to {self.fallback.name}"
+            )
+            degrade(
+                f"{self.primary.name} extraction failed, used {self.fallback.name}"
+            )
+            return await self.fallback.extract(
+                pdf_path, extract_images, max_images, page_limit
+            )
+
+
+class FastEngine(ExtractionEngine):
+    """PyMuPDF for born-digital PDFs, marker (with fallback) for scans."""
+
+    name = "fast"
+
+    def __init__(self):
+        self.local = PyMuPDFEngine()
+        self.auto = AutoEngine(fallback=self.local)
+
+    async def extract(
+        self,
+        pdf_path: str,
+        extract_images: bool = True,
+        max_images: Optional[int] = None,
+        page_limit: Optional[int] = None,
+    ) -> ExtractionResult:
+        engine = self.local if await run_io(is_born_digital, pdf_path) else self.auto
+        return await engine.extract(pdf_path, extract_images, max_images, page_limit)
+
+
+ENGINES = {
+    "marker": MarkerEngine,
+    "pymupdf": PyMuPDFEngine,
+    "auto": AutoEngine,
+    "fast": FastEngine,
+}
+
+
+def get_engine(
+    engine: Union[str, ExtractionEngine, None] = None
+) -> ExtractionEngine:
+    """Resolve an engine name (or instance) to an extraction engine."""
+    if isinstance(engine, ExtractionEngine):
+        return engine
+    name = engine or os.getenv("PAPER2BLOG_EXTRACTION_ENGINE", "auto")
+    if name not in ENGINES:
+        raise ValueError(
+            f"Unknown extraction engine '{name}', expected one of {sorted(ENGINES)}"
+        )
+    return ENGINES[name]()
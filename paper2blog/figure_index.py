@@ -0,0 +1,141 @@
+"""
+Index of where each figure is captioned and discussed in the extracted paper.
+
+One pass over the markdown produced by the extraction engines maps every
+image (by file name, as in ``![caption](./_page_1_Figure_0.png)``) to its
+``Figure N`` label, its original caption, the section it appears in and the
+paragraphs that refer to it ("as shown in Figure 3 ...").
+
+The index gives each VLM caption request a small context window around its
+own figure instead of the paper's first 2000 characters, and gives the LLM
+placement hints (where the paper discusses each figure).
+"""
+
+import re
+from typing import Dict, List, Optional
+
+# Captions may contain "]" (citations), so the alt text ends at the first "]("
+IMAGE_PATTERN = re.compile(
+    r"!\[(?P<alt>(?:[^\]]|\](?!\())*)\]\((?P<path>[^)\s]+)\)", re.DOTALL
+)
+LABEL_PATTERN = re.compile(r"^(?:fig\.?|figure)\s*(?P<number>\d+)", re.IGNORECASE)
+# A caption paragraph ("Figure 3: ...") as opposed to a sentence starting
+# with a reference ("Figure 3 shows ...")
+CAPTION_PATTERN = re.compile(r"^(?:fig\.?|figure)\s*\d+\s*[:.|]", re.IGNORECASE)
+REFERENCE_PATTERN = re.compile(r"\b(?:figs?\.?|figures?)\s*~?(\d+)", re.IGNORECASE)
+
+
+def _basename(path: str) -> str:
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class FigureIndexEntry:
+    __slots__ = ("name", "number", "caption", "section", "references")
+
+    def __init__(self, name: str, number: Optional[int], caption: str, section: str):
+        # Image file name as referenced in the markdown
+        self.name = name
+        # N of the "Figure N" label in the caption, when there is one
+        self.number = number
+        self.caption = caption
+        # Heading of the section the figure appears in
+        self.section = section
+        # (section heading, paragraph) pairs that mention "Figure N"
+        self.references: List[tuple] = []
+
+    @property
+    def label(self) -> str:
+        return f"Figure {self.number}" if self.number is not None else ""
+
+    def context(self, max_chars: int = 1200) -> str:
+        """Caption plus the paragraphs discussing the figure, within ``max_chars``."""
+        parts = [self.caption] if self.caption else []
+        parts.extend(paragraph for _, paragraph in self.references)
+        text = "\n\n".join(parts)
+        return text[:max_chars] + "..." if len(text) > max_chars else text
+
+    def placement_hint(self) -> str:
+        """Where the paper places and discusses the figure, for the LLM prompt."""
+        hints = []
+        if self.label:
+            hints.append(f"{self.label} in the paper")
+        sections = []
+        for section, _ in self.references:
+            if section and section not in sections:
+                sections.append(section)
+        if sections:
+            hints.append("discussed in " + ", ".join(f'"{s}"' for s in sections))
+        elif self.section:
+            hints.append(f'appears in "{self.section}"')
+        return "; ".join(hints)
+
+
+class FigureIndex:
+    def __init__(self, entries: Dict[str, FigureIndexEntry]):
+        self.entries = entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, name: str) -> Optional[FigureIndexEntry]:
+        return self.entries.get(_basename(name)) if name else None
+
+    def context_for(self, name: str, max_chars: int = 1200) -> str:
+        """Figure-local caption context, empty if the figure is not indexed."""
+        entry = self.get(name)
+        return entry.context(max_chars) if entry else ""
+
+    def hint_for(self, name: str) -> str:
+        entry = self.get(name)
+        return entry.placement_hint() if entry else ""
+
+    @classmethod
+    def build(cls, markdown: str) -> "FigureIndex":
+        entries: Dict[str, FigureIndexEntry] = {}
+        by_number: Dict[int, FigureIndexEntry] = {}
+        # References may precede the figure itself, so keep them until the end
+        mentions: List[tuple] = []
+        section = ""
+        last: Optional[FigureIndexEntry] = None
+        for block in markdown.split("\n\n"):
+            block = block.strip()
+            if not block:
+                continue
+            if block.startswith("#"):
+                section = block.lstrip("#").strip()
+                continue
+            images = list(IMAGE_PATTERN.finditer(block))
+            for image in images:
+                entry = FigureIndexEntry(
+                    _basename(image.group("path")),
+                    None,
+                    " ".join(image.group("alt").split()),
+                    section,
+                )
+                entries[entry.name] = entry
+                last = entry
+            text = IMAGE_PATTERN.sub("", block).strip()
+            if not text:
+                continue
+            if CAPTION_PATTERN.match(text):
+                # Caption paragraph: label the figure it belongs to, unless
+                # the caption was already merged into the image alt text
+                if last is not None and not last.caption:
+                    last.caption = " ".join(text.split())
+                continue
+            numbers = {int(n) for n in REFERENCE_PATTERN.findall(text)}
+            if numbers:
+                mentions.append((numbers, section, text))
+
+        for entry in entries.values():
+            label = LABEL_PATTERN.match(entry.caption)
+            if label:
+                entry.number = int(label.group("number"))
+                by_number.setdefault(entry.number, entry)
+
+        for numbers, mention_section, paragraph in mentions:
+            for number in numbers:
+                if number in by_number:
+                    entry = by_number[number]
+                    entry.references.append((mention_section, paragraph))
+        return cls(entries)
@@ -0,0 +1,108 @@
+"""
+Derived figure variants for the ``/figures`` endpoint.
+
+Extracted figures are stored at full resolution as PNG. Posts link them as
+``/figures/<content hash>.webp?w=<width>`` instead; the first request for a
+variant resizes and re-encodes the figure in the process pool and caches the
+result under ``variants/`` in the data directory, later requests are served
+from disk. Since a URL names the figure by its content hash, its bytes never
+change and it can be cached forever by browsers and CDNs.
+
+Requested widths are rounded up to a few fixed sizes so arbitrary ``w``
+values cannot fill the disk, and figures are never scaled up.
+"""
+
+import io
+import os
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from paper2blog.executors import run_cpu, run_io
+from paper2blog.singleflight import SingleFlight
+from paper2blog.storage import PaperStore, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Widths variants are rendered at; requests are rounded up to the next one
+VARIANT_WIDTHS: Tuple[int, ...] = tuple(
+    sorted(
+        int(width)
+        for width in os.getenv(
+            "PAPER2BLOG_FIGURE_WIDTHS", "320,640,960,1280,1920"
+        ).split(",")
+    )
+)
+
+# Encoder quality for lossy variant formats
+VARIANT_QUALITY = int(os.getenv("PAPER2BLOG_FIGURE_QUALITY", "80"))
+
+# Formats a figure can be re-encoded to, by suffix (PIL format name)
+VARIANT_FORMATS: Dict[str, str] = {".webp": "WEBP", ".png": "PNG", ".jpg": "JPEG"}
+
+MEDIA_TYPES = {
+    ".webp": "image/webp",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+}
+
+
+def snap_width(width: int) -> int:
+    """The variant width serving a request for ``width`` pixels (0: full)."""
+    if width <= 0:
+        return 0
+    return next((w for w in VARIANT_WIDTHS if w >= width), VARIANT_WIDTHS[-1])
+
+
+def render_variant(data: bytes, width: int, fmt: str) -> bytes:
+    """Resize image bytes to at most ``width`` pixels wide (0 keeps the size)
+    and encode them as ``fmt``. Runs in the process pool."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        if width and image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        out = io.BytesIO()
+        image.save(out, fmt, quality=VARIANT_QUALITY)
+        return out.getvalue()
+
+
+class FigureVariants:
+    """Serve stored figures and their resized/re-encoded variants."""
+
+    def __init__(self, store: PaperStore):
+        self.store = store
+        # Concurrent first requests for a variant render it once
+        self._renders = SingleFlight()
+
+    async def get(self, digest: str, suffix: str, width: int = 0) -> Optional[Path]:
+        """Path of figure ``digest`` as ``suffix`` at ``width`` pixels, rendered
+        on first use. None if there is no such figure or format."""
+        source = await run_io(self.store.find_figure, digest)
+        if source is None:
+            return None
+        suffix = suffix.lower()
+        width = snap_width(width)
+        if suffix == source.suffix and not width:
+            return source
+        if suffix not in VARIANT_FORMATS:
+            return None
+        path = self.store.variant_path(digest, width, suffix)
+        if await run_io(path.exists):
+            return path
+        await self._renders.do(path, lambda: self._render(source, path, width))
+        return path
+
+    async def _render(self, source: Path, path: Path, width: int) -> None:
+        data = await run_io(source.read_bytes)
+        variant = await run_cpu(
+            render_variant, data, width, VARIANT_FORMATS[path.suffix]
+        )
+        await run_io(atomic_write, path, variant)
+        logger.info(f"Rendered {path.name} ({len(data)} -> {len(variant)} bytes)")
@@ -0,0 +1,349 @@
+"""
+Distributed conversion jobs backed by a Redis-compatible store.
+
+Conversions are split into stages that need different resources:
+
+* ``extract``  - PDF parsing (marker / PyMuPDF), capability ``marker``
+* ``caption``  - figure captioning with the VLM, capability ``vlm``
+* ``generate`` - blog generation with the LLM and persisting the result,
+  capability ``llm``
+
+Each stage has its own queue. A ``JobWorker`` only pulls from the queues of the
+capabilities it was started with, so marker workers can run on GPU nodes while
+VLM/LLM workers run elsewhere, and the API replicas only submit jobs and read
+their state. Job state (status, stage, intermediate text/figures, result) lives
+in one hash per job. Papers and figures are referenced by their path relative
+to ``PAPER2BLOG_DATA_DIR``, which must be shared storage across nodes.
+
+Run a worker with ``python -m paper2blog.jobs --capabilities marker,vlm,llm``.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from paper2blog import serialization
+from paper2blog.converter import PaperConverter
+from paper2blog.model_types import JobStatus
+from paper2blog.records import FigureRecord
+from paper2blog.storage import PaperStore
+from paper2blog.utils import caption_figures, extract_uncaptioned_content
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("extract", "caption", "generate")
+STAGE_CAPABILITY = {"extract": "marker", "caption": "vlm", "generate": "llm"}
+CAPABILITIES = tuple(STAGE_CAPABILITY.values())
+
+DEFAULT_REDIS_URL = "redis://localhost:6379/0"
+# Finished jobs (and their dedup keys) expire after this many seconds
+RESULT_TTL = 7 * 24 * 3600
+
+
+class JobStore:
+    """Job records and per-stage queues in a Redis-compatible server."""
+
+    def __init__(
+        self, redis, prefix: str = "paper2blog", result_ttl: int = RESULT_TTL
+    ):
+        # ``redis`` is a redis.asyncio client created with decode_responses=True
+        self.redis = redis
+        self.prefix = prefix
+        self.result_ttl = result_ttl
+
+    @classmethod
+    def from_url(cls, url: Optional[str] = None, **kwargs) -> "JobStore":
+        import redis.asyncio
+
+        url = url or os.getenv("PAPER2BLOG_REDIS_URL", DEFAULT_REDIS_URL)
+        return cls(redis.asyncio.from_url(url, decode_responses=True), **kwargs)
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def _queue_key(self, stage: str) -> str:
+        return f"{self.prefix}:queue:{stage}"
+
+    def _dedup_key(self, key: str) -> str:
+        return f"{self.prefix}:dedup:{key}"
+
+    @property
+    def _running_key(self) -> str:
+        return f"{self.prefix}:running"
+
+    async def submit(
+        self, params: Dict[str, Any], dedup_key: Optional[str] = None
+    ) -> Tuple[str, bool]:
+        """Queue a new job at the first stage, returning ``(job_id, created)``.
+
+        With ``dedup_key`` (e.g. ``conversion_key(...)``), identical submissions
+        on any API replica attach to the existing job instead of creating one.
+        """
+        job_id = uuid.uuid4().hex
+        if dedup_key is not None:
+            claimed = await self.redis.set(
+                self._dedup_key(dedup_key), job_id, nx=True, ex=self.result_ttl
+            )
+            if not claimed:
+                existing = await self.redis.get(self._dedup_key(dedup_key))
+                job = await self.get(existing) if existing else None
+                if job is not None and job["status"] != "failed":
+                    logger.info(f"Joining existing job {existing}")
+                    return existing, False
+                await self.redis.set(
+                    self._dedup_key(dedup_key), job_id, ex=self.result_ttl
+                )
+
+        now = time.time()
+        await self.redis.hset(
+            self._job_key(job_id),
+            mapping={
+                "id": job_id,
+                "status": "queued",
+                "stage": STAGES[0],
+                "params": serialization.dumps(params),
+                "created_at": now,
+                "updated_at": now,
+            },
+        )
+        await self.redis.lpush(self._queue_key(STAGES[0]), job_id)
+        return job_id, True
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the decoded job record, or None if it does not exist."""
+        raw = await self.redis.hgetall(self._job_key(job_id))
+        if not raw:
+            return None
+        job: Dict[str, Any] = dict(raw)
+        for field in ("params", "text", "images", "result"):
+            if field in job:
+                job[field] = serialization.loads(job[field])
+        return job
+
+    async def claim(
+        self, capabilities: Iterable[str], timeout: float = 5
+    ) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Block until a job is queued at a stage this worker can run.
+
+        Returns ``(stage, job)`` or None on timeout.
+        """
+        queues = [
+            self._queue_key(stage)
+            for stage in STAGES
+            if STAGE_CAPABILITY[stage] in capabilities
+        ]
+        if not queues:
+            raise ValueError(f"No stage matches capabilities {list(capabilities)}")
+        popped = await self.redis.brpop(queues, timeout=timeout)
+        if popped is None:
+            return None
+        queue, job_id = popped
+        stage = queue.rsplit(":", 1)[-1]
+        now = time.time()
+        await self.redis.hset(
+            self._job_key(job_id),
+            mapping={"status": "running", "stage": stage, "updated_at": now},
+        )
+        await self.redis.zadd(self._running_key, {job_id: now})
+        job = await self.get(job_id)
+        return (stage, job) if job is not None else None
+
+    async def advance(self, job_id: str, next_stage: str, **state: Any) -> None:
+        """Store the output of the current stage and queue the next one."""
+        mapping = {k: serialization.dumps(v) for k, v in state.items()}
+        mapping.update(status="queued", stage=next_stage, updated_at=time.time())
+        await self.redis.hset(self._job_key(job_id), mapping=mapping)
+        await self.redis.zrem(self._running_key, job_id)
+        await self.redis.lpush(self._queue_key(next_stage), job_id)
+
+    async def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        await self._finish(job_id, status="done", result=serialization.dumps(result))
+
+    async def fail(self, job_id: str, error: str) -> None:
+        await self._finish(job_id, status="failed", error=error)
+
+    async def _finish(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        # Intermediate state is only needed while the job is in flight
+        await self.redis.hdel(self._job_key(job_id), "text", "images")
+        await self.redis.hset(self._job_key(job_id), mapping=fields)
+        await self.redis.expire(self._job_key(job_id), self.result_ttl)
+        await self.redis.zrem(self._running_key, job_id)
+
+    async def requeue_stale(self, max_age: float) -> List[str]:
+        """Put jobs whose worker went away (running longer than ``max_age``
+        seconds) back on the queue of the stage they were in."""
+        stale = await self.redis.zrangebyscore(
+            self._running_key, 0, time.time() - max_age
+        )
+        requeued = []
+        for job_id in stale:
+            # Only the replica that removes the entry requeues the job
+            if not await self.redis.zrem(self._running_key, job_id):
+                continue
+            stage = await self.redis.hget(self._job_key(job_id), "stage")
+            if stage is None:
+                continue
+            await self.redis.hset(self._job_key(job_id), "status", "queued")
+            await self.redis.lpush(self._queue_key(stage), job_id)
+            requeued.append(job_id)
+        if requeued:
+            logger.warning(f"Requeued stale jobs: {requeued}")
+        return requeued
+
+    async def queue_lengths(self) -> Dict[str, int]:
+        return {stage: await self.redis.llen(self._queue_key(stage)) for stage in STAGES}
+
+
+def worker_capabilities() -> List[str]:
+    value = os.getenv("PAPER2BLOG_WORKER_CAPABILITIES", ",".join(CAPABILITIES))
+    return [c.strip() for c in value.split(",") if c.strip()]
+
+
+class JobWorker:
+    """Pulls jobs for the stages matching its capabilities and runs them."""
+
+    def __init__(
+        self,
+        jobs: JobStore,
+        capabilities: Optional[Iterable[str]] = None,
+        store: Optional[PaperStore] = None,
+        converter: Optional[PaperConverter] = None,
+    ):
+        self.jobs = jobs
+        self.capabilities = set(capabilities or worker_capabilities())
+        unknown = self.capabilities - set(CAPABILITIES)
+        if unknown:
+            raise ValueError(f"Unknown capabilities {sorted(unknown)}")
+        self.store = store or PaperStore()
+        self._converter = converter
+
+    @property
+    def converter(self) -> PaperConverter:
+        # Created on first use so marker-only workers never need LLM credentials
+        if self._converter is None:
+            self._converter = PaperConverter(self.store)
+        return self._converter
+
+    async def run_once(self, timeout: float = 5) -> bool:
+        """Claim and run one stage of one job; False if nothing was queued."""
+        claimed = await self.jobs.claim(self.capabilities, timeout=timeout)
+        if claimed is None:
+            return False
+        stage, job = claimed
+        logger.info(f"Running stage {stage} of job {job['id']}")
+        try:
+            await getattr(self, f"_{stage}")(job)
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed in stage {stage}: {e}")
+            await self.jobs.fail(job["id"], f"Error in {stage} stage: {e}")
+        return True
+
+    async def run(self, concurrency: int = 1, stale_after: float = 3600) -> None:
+        """Process jobs forever with ``concurrency`` stages in flight."""
+
+        async def loop():
+            while True:
+                await self.run_once()
+
+        async def reaper():
+            while True:
+                await self.jobs.requeue_stale(stale_after)
+                await asyncio.sleep(stale_after / 4)
+
+        await asyncio.gather(reaper(), *(loop() for _ in range(concurrency)))
+
+    async def _extract(self, job: Dict[str, Any]) -> None:
+        params = job["params"]
+        text, figures = await extract_uncaptioned_content(
+            str(self.store.root / params["pdf_path"]),
+            store=self.store,
+            engine=params.get("engine"),
+            include_appendix_figures=params.get("include_appendix_figures", False),
+        )
+        await self.jobs.advance(
+            job["id"], "caption", text=text, images=self._relative(figures)
+        )
+
+    async def _caption(self, job: Dict[str, Any]) -> None:
+        images = await caption_figures(job["text"], self._absolute(job["images"]))
+        await self.jobs.advance(
+            job["id"], "generate", text=job["text"], images=self._relative(images)
+        )
+
+    async def _generate(self, job: Dict[str, Any]) -> None:
+        params = job["params"]
+        images = self._absolute(job["images"])
+        result = await self.converter.generate_from_content(
+            job["text"], params["language"], images
+        )
+        if result.error:
+            await self.jobs.fail(job["id"], result.error)
+            return
+        await asyncio.gather(
+            self.converter.save_extraction(params["paper_id"], job["text"], images),
+            self.converter.save_result(
+                params["paper_id"], params.get("filename"), params["language"], result
+            ),
+        )
+        await self.jobs.complete(job["id"], result.model_dump())
+
+    def _relative(self, figures: List[FigureRecord]) -> List[Dict[str, Any]]:
+        # Figures are passed between nodes relative to the shared data dir
+        return [
+            dict(figure.to_dict(), path=self.store.relative(figure.path))
+            for figure in figures
+        ]
+
+    def _absolute(self, figures: List[Dict[str, Any]]) -> List[FigureRecord]:
+        return [
+            FigureRecord.from_dict(
+                dict(figure, path=str(self.store.root / figure["path"]))
+            )
+            for figure in figures
+        ]
+
+
+def job_status(job: Dict[str, Any]) -> JobStatus:
+    """Public view of a job record for the API."""
+    return JobStatus(
+        job_id=job["id"],
+        status=job["status"],
+        stage=job.get("stage"),
+        error=job.get("error"),
+        result=job.get("result"),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a Paper2Blog job worker")
+    parser.add_argument(
+        "--capabilities",
+        default=",".join(worker_capabilities()),
+        help="Comma separated subset of marker,vlm,llm",
+    )
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    worker = JobWorker(
+        JobStore.from_url(args.redis_url),
+        capabilities=[c.strip() for c in args.capabilities.split(",") if c.strip()],
+    )
+    logger.info(f"Worker started with capabilities {sorted(worker.capabilities)}")
+    asyncio.run(worker.run(concurrency=args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,156 @@
 import os
+import re
+import asyncio
 import logging
-from typing import List, Dict
-from openai import AsyncOpenAI
-from paper2blog.model_types import ImageInfo
+from typing import Any, Callable, List, Dict, Optional
+from paper2blog import serialization
+from paper2blog.backends import ModelRouter
+from paper2blog.deadline import DeadlineExceeded, budget, degrade, running_low
+from paper2blog.figure_index import FigureIndex
+from paper2blog.model_types import BlogSection, Figure, GeneratedBlog
+from paper2blog.profiling import section
 
-from dotenv import load_dotenv
+logger = logging.getLogger(__name__)
 
-load_dotenv()
+# JSON schema used for structured-output generation of blog posts
+BLOG_RESPONSE_SCHEMA = {
+    "name": "blog_post",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string"},
+            "sections": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "heading": {"type": "string"},
+                        "content": {"type": "string"},
+                    },
+                    "required": ["heading", "content"],
+                    "additionalProperties": False,
+                },
+            },
+            "summary": {"type": "string"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+            "figures": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "figure": {"type": "integer"},
+                        "section": {"type": "integer"},
+                        "paragraph": {"type": "integer"},
+                        "caption": {"type": "string"},
+                    },
+                    "required": ["figure", "section", "paragraph", "caption"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["title", "sections", "summary", "tags", "figures"],
+        "additionalProperties": False,
+    },
+}
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = """
+Return the blog post as a JSON object with these fields:
+- "title": the blog title (plain text, no leading "#")
+- "sections": list of {"heading", "content"}; "content" is Markdown without the heading line
+- "summary": the closing summary (plain Markdown, no heading)
+- "tags": 3-6 short topic tags
+- "figures": list of {"figure", "section", "paragraph", "caption"} placing each available figure,
+  where "figure" is the figure number, "section" is the 0-based section index, "paragraph" is the
+  0-based paragraph index within that section the figure follows (-1 for the end of the section)
+  and "caption" is the alt text (empty string to keep the original caption).
+Do not put image markdown inside section content; figures are inserted from the "figures" field."""
+
+
+SECTION_RESPONSE_SCHEMA = {
+    "name": "blog_section",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "heading": {"type": "string"},
+            "content": {"type": "string"},
+        },
+        "required": ["heading", "content"],
+        "additionalProperties": False,
+    },
+}
+
+# Share of the remaining request deadline one completion may take
+COMPLETION_DEADLINE_SHARE = 0.9
+
+# Characters of the paper sent when regenerating a single section
+SECTION_CONTEXT_CHARS = int(os.getenv("PAPER2BLOG_SECTION_CONTEXT_CHARS", "6000"))
 
-# Configure logging
-logging.basicConfig(
-    filename='llm_dialog.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(message)s'
-)
+WORD_PATTERN = re.compile(r"\w{3,}")
+
+
+def relevant_excerpt(text: str, query: str, max_chars: int) -> str:
+    """Paragraphs of ``text`` sharing the most words with ``query``, in
+    document order and within ``max_chars``; the opening of the text when
+    nothing matches, the start of the best paragraph when none fits."""
+    if len(text) <= max_chars:
+        return text
+    words = set(WORD_PATTERN.findall(query.lower()))
+    paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
+    scores = [len(words & set(WORD_PATTERN.findall(p.lower()))) for p in paragraphs]
+    if not any(scores):
+        return text[:max_chars]
+    ranked = sorted(range(len(paragraphs)), key=lambda idx: -scores[idx])
+    keep, size = set(), 0
+    for idx in ranked:
+        if not scores[idx] or size + len(paragraphs[idx]) > max_chars:
+            continue
+        keep.add(idx)
+        size += len(paragraphs[idx])
+    if not keep:
+        return paragraphs[ranked[0]][:max_chars]
+    return "\n\n".join(paragraphs[idx] for idx in sorted(keep))
 
 
 class LLMHandler:
-    def __init__(self):
-        self.client = AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_API_BASE")
-        )
+    def __init__(self, router: Optional[ModelRouter] = None):
+        self.router = router or ModelRouter.from_env()
 
     async def _generate_completion(
-        self, messages: List[Dict[str, str]], temperature: float = 0.7
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        response_format: Optional[Dict[str, Any]] = None,
+        stage: str = "blog",
     ) -> str:
         # Log the input messages
-        logging.info("Input messages to LLM:")
+        logger.info("Input messages to LLM:")
         for msg in messages:
-            logging.info(f"Role: {msg['role']}")
-            logging.info(f"Content: {msg['content']}\n")
+            logger.info(f"Role: {msg['role']}")
+            logger.info(f"Content: {msg['content']}\n")
 
-        completion = await self.client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=messages,
-            temperature=temperature,
-        )
-        response = completion.choices[0].message.content
+        # Completions may use most of what is left of the request deadline
+        timeout = budget(COMPLETION_DEADLINE_SHARE)
+        try:
+            response = await asyncio.wait_for(
+                self.router.complete(
+                    stage,
+                    messages,
+                    temperature=temperature,
+                    response_format=response_format,
+                ),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(
+                f"Deadline exceeded after {timeout:.0f}s in the '{stage}' stage"
+            ) from None
 
         # Log the LLM response
-        logging.info("LLM Response:")
-        logging.info(f"{response}\n")
-        logging.info("-" * 80 + "\n")
+        logger.info("LLM Response:")
+        logger.info(f"{response}\n")
+        logger.info("-" * 80 + "\n")
 
         return response
 
@@ -64,22 +173,30 @@ Just return the translated title without any additional text or formatting.""",
             },
         ]
 
-        response = await self._generate_completion(messages)
+        response = await self._generate_completion(messages, stage="title")
         return response.strip()
 
     async def generate_blog_post(
         self,
         text_content: str,
         target_language: str = "en",
-        image_info: List[ImageInfo] = [],
-    ):
-        """Generate a technical blog post from an academic paper in one shot."""
+        image_info: List[Figure] = [],
+    ) -> GeneratedBlog:
+        """Generate a technical blog post from an academic paper in one shot.
+
+        The LLM is asked for structured JSON output (title, sections, summary,
+        tags and figure placements), so callers can work on sections without
+        re-parsing the rendered markdown.
+        """
         try:
             # Determine language
             lang = "zh" if target_language.lower() in ["zh", "chinese", "中文"] else "en"
             
             # Format images for inclusion in the prompt
-            formatted_images = self._format_images(image_info)
+            with section("llm_prompt"):
+                formatted_images = self._format_images(
+                    image_info, FigureIndex.build(text_content)
+                )
             
             # Define system prompts based on language
             system_prompts = {
@@ -92,13 +209,13 @@ Just return the translated title without any additional text or formatting.""",
 - 任务描述：解析arXiv上关于LLM（大语言模型）和CS（计算机科学）的论文，生成一篇图文混排的学术博客。博客需贴近人类写作习惯，清晰传达论文核心内容，并在合适位置插入图片。
 - 不要使用"你"、"我们"等人称代词建立对话感。博客内容的立场是作为一个第三方论文阅读者来描述，如果有偏主观的见解，请使用"笔者认为xxx"
 - 需要关注核心的架构图，或者算法介绍图，并在文中使用一定篇幅进行讲解和引用，如"如图N所示，本算法首先。。。 然后。。。"
-- 博客应包含标题、内容和总结， 其中内容部分可以根据需求分多个章节。# 是第一章节， ## 代表二级目录
+- 博客应包含标题（title）、若干章节（sections）和总结（summary），章节数量根据内容需要确定。每个章节由 heading（章节标题）和 content（正文）组成，标题只写在 title 和 heading 字段中，content 中不要再写 # 或 ## 标题行
 
 2. 图文配合规则
-- 每张图片需独占一行，格式为 ![图N: 描述。。。](图片路径不用修改)，其中N为图片编号。
+- 图片不要写进 content，而是通过 figures 字段放置到指定章节的指定段落之后，caption 格式为 "图N: 描述。。。"，其中N为图片编号。
 - 图片描述需自然融入上下文，例如：
-    "如图所示figure:fig1，该方法的架构分为三个主要模块..."
-    "实验结果figure:fig3显示，该方法在准确率上显著优于基线模型..."
+    "如图1所示，该方法的架构分为三个主要模块..."
+    "图3的实验结果显示，该方法在准确率上显著优于基线模型..."
 - 每张出现的图片都需要有对应的文字去描述，最起码有一段内容。
 
 ## 格式规范
@@ -107,7 +224,7 @@ Just return the translated title without any additional text or formatting.""",
 - 每章节3-5段，每段不超过150字
 - 段落间用空行分隔
 - 重点语句用**加粗**强调 
-- 博客格式应为Markdown
+- 章节正文（content）和总结（summary）使用Markdown
 
 2. 禁用内容：
 - 专业术语缩写（首次出现需括号解释）
@@ -117,17 +234,18 @@ Just return the translated title without any additional text or formatting.""",
 
 Please generate a blog post following these requirements:
 1. The blog content should be as detailed as possible, covering the core innovations
-2. Preserve image descriptions from the original paper and maintain markdown image syntax like: ![](image_xx.png), placing images in appropriate locations
+2. Preserve image descriptions from the original paper and place every available figure in an appropriate location
 3. The blog should include a title, content, and summary
-4. The blog format should be Markdown
-5. The blog title should start with "# "
-6. The summary section should start with "## Summary"
-7. Maintain technical accuracy while ensuring readability, highlighting innovations and practical value"""
+4. The section content should be Markdown
+5. Maintain technical accuracy while ensuring readability, highlighting innovations and practical value"""
             }
             
             # Generate blog content in one shot
             messages = [
-                {"role": "system", "content": system_prompts[lang]},
+                {
+                    "role": "system",
+                    "content": system_prompts[lang] + STRUCTURED_OUTPUT_INSTRUCTIONS,
+                },
                 {
                     "role": "user",
                     "content": f"""Here is the academic paper to transform into a blog post:
@@ -140,36 +258,167 @@ Paper content:
                 },
             ]
 
-            blog_content = await self._generate_completion(messages)
-            
-            # Extract title from the generated content
-            lines = blog_content.split("\n")
-            title = next(
-                (line.replace("# ", "") for line in lines if line.startswith("# ")),
-                "Untitled",
+            # Short on time: write the post with the faster model route
+            stage = "blog"
+            if running_low():
+                stage = "blog_fast"
+                degrade("wrote the blog with the fast model route")
+
+            response = await self._generate_completion(
+                messages,
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": BLOG_RESPONSE_SCHEMA,
+                },
+                stage=stage,
             )
-            
-            return {
-                "title": title,
-                "content": blog_content,
-                "summary": "",  # No separate summary extraction needed as it's part of the blog content
-                "tags": []
-            }
+            return self._parse_blog(response)
 
         except Exception as e:
-            logging.error(f"Error in generate_blog_post: {str(e)}")
+            logger.error(f"Error in generate_blog_post: {str(e)}")
             raise
 
-    def _format_images(self, images: List[ImageInfo]) -> str:
-        formatted_images = []
-        for idx, img in enumerate(images, 1):
-            # Convert absolute path to relative URL path
-            relative_path = os.path.relpath(
-                img.url, "/home/dongpeijie/workspace/Paper2Blog"
+    async def regenerate_section(
+        self,
+        text_content: str,
+        blog: GeneratedBlog,
+        index: int,
+        images: List[Figure],
+        target_language: str = "en",
+        instructions: str = "",
+    ) -> BlogSection:
+        """Rewrite one section of an existing post in a single short call.
+
+        The prompt carries the post outline, the neighbouring sections, the
+        figures placed in the section and the paragraphs of the paper most
+        related to it, instead of the whole paper.
+        """
+        lang = "zh" if target_language.lower() in ["zh", "chinese", "中文"] else "en"
+        section = blog.sections[index]
+        outline = "\n".join(
+            f"{idx}. {s.heading}" + (" (this section)" if idx == index else "")
+            for idx, s in enumerate(blog.sections)
+        )
+        context = []
+        if index > 0:
+            previous = blog.sections[index - 1]
+            context.append(
+                f"Previous section ({previous.heading}):\n{previous.content}"
             )
-            # Format markdown with web-accessible URL
-            formatted_images.append(
-                f"Figure {idx}: {img.caption}\n"
-                f"Use exactly this markdown to insert the image: ![{img.caption}](http://localhost:8000/{relative_path})"
+        if index + 1 < len(blog.sections):
+            following = blog.sections[index + 1]
+            context.append(
+                f"Next section ({following.heading}):\n{following.content}"
             )
+        neighbours = "\n\n".join(context)
+        figures = "\n".join(
+            f"Figure {p.figure}: {p.caption or images[p.figure - 1].caption}"
+            for p in blog.figures
+            if p.section == index and 1 <= p.figure <= len(images)
+        )
+        excerpt = relevant_excerpt(
+            text_content,
+            f"{section.heading}\n{section.content}\n{instructions}",
+            SECTION_CONTEXT_CHARS,
+        )
+        language_note = "请用中文撰写。" if lang == "zh" else "Write in English."
+
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a professional tech blogger editing one section of a blog post "
+                f"written from an academic paper. {language_note} Keep it consistent with the "
+                "neighbouring sections, do not repeat them, and keep referring to the figures "
+                "placed in this section. Do not put image markdown in the content. Return a JSON "
+                'object {"heading": ..., "content": ...}; "content" is Markdown without the heading line.',
+            },
+            {
+                "role": "user",
+                "content": f"""Blog title: {blog.title}
+
+Outline:
+{outline}
+
+{neighbours}
+
+Figures placed in this section:
+{figures or "None"}
+
+Current section ({section.heading}):
+{section.content}
+
+Editor instructions:
+{instructions or "Improve clarity and accuracy."}
+
+Relevant paper content:
+{excerpt}""",
+            },
+        ]
+
+        response = await self._generate_completion(
+            messages,
+            response_format={
+                "type": "json_schema",
+                "json_schema": SECTION_RESPONSE_SCHEMA,
+            },
+            stage="section",
+        )
+        return self._parse_section(response, section.heading)
+
+    def _parse_section(self, response: str, heading: str) -> BlogSection:
+        text = response.strip()
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[text.find("\n") + 1 :] if "\n" in text else text
+        try:
+            data = serialization.loads(text)
+            return BlogSection(
+                heading=data.get("heading") or heading, content=data["content"]
+            )
+        except (ValueError, TypeError, KeyError, AttributeError):
+            # Plain markdown reply: the whole text is the new content
+            content = response.strip()
+            if content.startswith("## "):
+                first, _, content = content.partition("\n")
+                heading = first[3:].strip() or heading
+            return BlogSection(heading=heading, content=content.strip())
+
+    def _parse_blog(self, response: str) -> GeneratedBlog:
+        """Parse a structured response, tolerating code fences and plain markdown."""
+        text = response.strip()
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[text.find("\n") + 1 :] if "\n" in text else text
+        try:
+            return GeneratedBlog(**serialization.loads(text))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Structured output could not be parsed ({e}), falling back to markdown")
+            return GeneratedBlog.from_markdown(response)
+
+    def render_blog(
+        self,
+        blog: GeneratedBlog,
+        images: List[Figure],
+        target_language: str = "en",
+        url_for: Optional[Callable[[str], str]] = None,
+    ) -> str:
+        """Render a generated blog to markdown, mapping figure paths with ``url_for``."""
+        lang = "zh" if target_language.lower() in ["zh", "chinese", "中文"] else "en"
+        return blog.to_markdown(
+            images,
+            url_for=url_for,
+            summary_heading="总结" if lang == "zh" else "Summary",
+        )
+
+    def _format_images(
+        self, images: List[Figure], index: Optional[FigureIndex] = None
+    ) -> str:
+        formatted_images = []
+        for idx, img in enumerate(images, 1):
+            line = f"Figure {idx}: {img.caption}"
+            # Placement hint: where the paper itself discusses the figure
+            hint = index.hint_for(getattr(img, "name", "")) if index else ""
+            if hint:
+                line += f" ({hint})"
+            formatted_images.append(line)
         return "\n\n".join(formatted_images)
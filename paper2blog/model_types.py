@@ -1,5 +1,6 @@
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Sequence, Union
 from pydantic import BaseModel
+from paper2blog.records import FigureRecord
 
 
 class ImageInfo(BaseModel):
@@ -8,11 +9,133 @@ class ImageInfo(BaseModel):
     markdown: str
 
 
+# Renderers only need ``caption`` and ``url``: API models and internal records
+Figure = Union[ImageInfo, FigureRecord]
+
+
 class BlogPost(BaseModel):
     title: str
     content: str
 
 
+class BlogSection(BaseModel):
+    heading: str
+    content: str
+
+
+class FigurePlacement(BaseModel):
+    # 1-based figure number as listed in the prompt
+    figure: int
+    # 0-based index into GeneratedBlog.sections
+    section: int
+    # Insert after this paragraph of the section; -1 appends at the end
+    paragraph: int = -1
+    # Optional alt text overriding the figure caption
+    caption: str = ""
+
+
+class GeneratedBlog(BaseModel):
+    """Structured blog post as returned by the LLM in JSON mode."""
+
+    title: str
+    sections: List[BlogSection] = []
+    summary: str = ""
+    tags: List[str] = []
+    figures: List[FigurePlacement] = []
+
+    def render_section(
+        self,
+        index: int,
+        images: Sequence[Figure] = (),
+        url_for: Optional[Callable[[str], str]] = None,
+    ) -> str:
+        """Render one section as markdown with its placed figures."""
+        section = self.sections[index]
+        paragraphs = [p for p in section.content.strip().split("\n\n") if p.strip()]
+        inserts = {}
+        for placement in self.figures:
+            if placement.section != index:
+                continue
+            if not 1 <= placement.figure <= len(images):
+                continue
+            image = images[placement.figure - 1]
+            alt = placement.caption or image.caption
+            pos = placement.paragraph
+            if pos < 0 or pos >= len(paragraphs):
+                pos = len(paragraphs) - 1
+            url = url_for(image.url) if url_for else image.url
+            inserts.setdefault(pos, []).append(f"![{alt}]({url})")
+
+        # The opening section of a post may have no heading
+        blocks = [f"## {section.heading}"] if section.heading else []
+        if -1 in inserts:
+            # Section without paragraphs: figures go right under the heading
+            blocks.extend(inserts[-1])
+        for idx, paragraph in enumerate(paragraphs):
+            blocks.append(paragraph)
+            blocks.extend(inserts.get(idx, []))
+        return "\n\n".join(blocks)
+
+    def to_markdown(
+        self,
+        images: Sequence[Figure] = (),
+        url_for: Optional[Callable[[str], str]] = None,
+        summary_heading: str = "Summary",
+    ) -> str:
+        """Render the whole post as a single markdown document."""
+        blocks = [f"# {self.title}"]
+        blocks.extend(
+            self.render_section(idx, images, url_for)
+            for idx in range(len(self.sections))
+        )
+        if self.summary:
+            blocks.append(f"## {summary_heading}\n\n{self.summary.strip()}")
+        return "\n\n".join(blocks) + "\n"
+
+    def section_index(self, identifier: str) -> int:
+        """Index of the section named by ``identifier``: its 0-based position
+        or its heading (case-insensitive). Raises ``KeyError`` otherwise."""
+        identifier = identifier.strip()
+        if identifier.isdigit() and int(identifier) < len(self.sections):
+            return int(identifier)
+        for idx, section in enumerate(self.sections):
+            if section.heading.strip().lower() == identifier.lower():
+                return idx
+        raise KeyError(f"Unknown section '{identifier}'")
+
+    @classmethod
+    def from_markdown(cls, markdown: str) -> "GeneratedBlog":
+        """Best-effort fallback for backends that ignore the JSON response format."""
+        title = "Untitled"
+        sections: List[BlogSection] = []
+        summary = ""
+        heading, lines = None, []
+
+        def flush():
+            nonlocal summary
+            body = "\n".join(lines).strip()
+            if heading is None:
+                # Introduction before the first heading opens the post
+                if body:
+                    sections.append(BlogSection(heading="", content=body))
+                return
+            if heading.lower() in ("summary", "总结"):
+                summary = body
+            else:
+                sections.append(BlogSection(heading=heading, content=body))
+
+        for line in markdown.split("\n"):
+            if line.startswith("# ") and title == "Untitled":
+                title = line[2:].strip()
+            elif line.startswith("## "):
+                flush()
+                heading, lines = line[3:].strip(), []
+            else:
+                lines.append(line)
+        flush()
+        return cls(title=title, sections=sections, summary=summary)
+
+
 class ConversionResponse(BaseModel):
     title: Optional[str] = ""
     content: Optional[str] = ""
@@ -21,3 +144,34 @@ class ConversionResponse(BaseModel):
     images: List[ImageInfo] = []
     error: Optional[str] = None
     tags: List[str] = []
+    sections: List[BlogSection] = []
+    # Figure placements, so a single section can be re-rendered later
+    figures: List[FigurePlacement] = []
+    # Set once the post is stored; identifies it for section regeneration
+    conversion_id: Optional[str] = None
+    # Shortcuts taken to meet the request deadline (see paper2blog.deadline)
+    degradations: List[str] = []
+
+    def to_blog(self) -> GeneratedBlog:
+        return GeneratedBlog(
+            title=self.title or "",
+            sections=self.sections,
+            summary=self.summary or "",
+            tags=self.tags,
+            figures=self.figures,
+        )
+
+
+class MultiConversionResponse(BaseModel):
+    # Target language -> post generated for it from the same extraction
+    results: Dict[str, ConversionResponse] = {}
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    # queued, running, done or failed
+    status: str
+    # extract, caption or generate
+    stage: Optional[str] = None
+    error: Optional[str] = None
+    result: Optional[ConversionResponse] = None
@@ -0,0 +1,335 @@
+"""
+Stage-decomposed conversion pipeline.
+
+``PaperConverter.convert_from_pdf`` runs extraction, figure selection,
+captioning, generation and persisting one after another for a single paper.
+Under a burst of uploads that couples very different resources: marker /
+PyMuPDF parsing is CPU/GPU bound, while captioning and generation mostly wait
+on remote APIs. ``ConversionPipeline`` runs each stage with its own pool of
+worker tasks, connected by bounded queues::
+
+    extract -> select -> caption -> generate -> persist
+
+A full queue blocks the stage feeding it (and ``submit`` itself once the
+first queue is full), so a slow stage applies backpressure upstream instead of
+letting work pile up in memory, and every stage keeps its own resource busy.
+
+Jobs carry the priority class they were submitted under (interactive uploads,
+batch conversions, background refreshes). Stage queues are bounded per class
+and hand jobs to workers by weighted fair share (see ``scheduling``), so a
+bulk run cannot fill the queues in front of interactive uploads; a job is
+never interrupted, priorities apply each time it moves on to the next stage.
+
+Cancelling ``submit`` (e.g. because the client disconnected) cancels the
+stage currently working on the job, which propagates to its pending marker,
+VLM and LLM requests, and the job is dropped by every later stage. Extraction
+and captions of uploaded papers are cached as they finish, so resubmitting the
+paper resumes where the cancelled run stopped.
+
+Per-stage worker counts and the queue size are configured with
+``PAPER2BLOG_PIPELINE_<STAGE>_WORKERS`` and ``PAPER2BLOG_PIPELINE_QUEUE_SIZE``.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from paper2blog.converter import PaperConverter
+from paper2blog.deadline import current_deadline, deadline_scope, degradations
+from paper2blog.model_types import ConversionResponse
+from paper2blog.profiling import current_profile, profile_scope
+from paper2blog.scheduling import FairQueue, current_priority, priority_scope
+from paper2blog.records import FigureRecord
+
+logger = logging.getLogger(__name__)
+
+# Generated post per target language
+Results = Dict[str, ConversionResponse]
+
+STAGES = ("extract", "select", "caption", "generate", "persist")
+DEFAULT_WORKERS = {
+    "extract": 2,
+    "select": 1,
+    "caption": 4,
+    "generate": 4,
+    "persist": 2,
+}
+DEFAULT_QUEUE_SIZE = 8
+
+
+def stage_workers(stage: str) -> int:
+    return int(
+        os.getenv(
+            f"PAPER2BLOG_PIPELINE_{stage.upper()}_WORKERS", DEFAULT_WORKERS[stage]
+        )
+    )
+
+
+class ConversionJob:
+    """One paper travelling through the pipeline."""
+
+    __slots__ = (
+        "pdf_path",
+        "languages",
+        "engine",
+        "include_appendix_figures",
+        "paper_id",
+        "filename",
+        "text",
+        "figures",
+        "results",
+        "deadline",
+        "profile",
+        "priority",
+        "future",
+    )
+
+    def __init__(
+        self,
+        pdf_path: str,
+        languages: Sequence[str],
+        engine: Optional[str] = None,
+        include_appendix_figures: bool = False,
+        paper_id: Optional[str] = None,
+        filename: Optional[str] = None,
+    ):
+        self.pdf_path = pdf_path
+        # One post is generated per language from a single extraction
+        self.languages = list(languages)
+        self.engine = engine
+        self.include_appendix_figures = include_appendix_figures
+        # The result is persisted next to the paper when it has an id
+        self.paper_id = paper_id
+        self.filename = filename
+        self.text = ""
+        self.figures: List[FigureRecord] = []
+        self.results: Results = {}
+        # The submitting request's deadline, applied in every stage
+        self.deadline = current_deadline()
+        # ... and its profile, if it is being profiled
+        self.profile = current_profile()
+        # ... and its priority class
+        self.priority = current_priority()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+Handler = Callable[[ConversionJob], Awaitable[Optional[Results]]]
+
+
+class ConversionPipeline:
+    def __init__(
+        self,
+        converter: Optional[PaperConverter] = None,
+        workers: Optional[Dict[str, int]] = None,
+        queue_size: Optional[int] = None,
+    ):
+        self.converter = converter or PaperConverter()
+        self.workers = {stage: stage_workers(stage) for stage in STAGES}
+        self.workers.update(workers or {})
+        self.queue_size = queue_size or int(
+            os.getenv("PAPER2BLOG_PIPELINE_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)
+        )
+        self.queues: Dict[str, FairQueue[ConversionJob]] = {}
+        self._tasks: List[asyncio.Task] = []
+        # Jobs currently being processed by each stage
+        self.busy = {stage: 0 for stage in STAGES}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.queues = {stage: FairQueue(self.queue_size) for stage in STAGES}
+        handlers: Dict[str, Handler] = {
+            stage: getattr(self, f"_{stage}") for stage in STAGES
+        }
+        for idx, stage in enumerate(STAGES):
+            next_stage = STAGES[idx + 1] if idx + 1 < len(STAGES) else None
+            for n in range(max(1, self.workers[stage])):
+                self._tasks.append(
+                    asyncio.create_task(
+                        self._worker(stage, handlers[stage], next_stage),
+                        name=f"pipeline-{stage}-{n}",
+                    )
+                )
+        logger.info(f"Started conversion pipeline with workers {self.workers}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            stage: {
+                "queued": self.queues[stage].qsize() if self.queues else 0,
+                "queued_by_priority": self.queues[stage].sizes() if self.queues else {},
+                "busy": self.busy[stage],
+                "workers": self.workers[stage],
+            }
+            for stage in STAGES
+        }
+
+    async def submit(self, job: ConversionJob) -> Results:
+        """Queue ``job`` and wait for its result.
+
+        Waits for room in the extract queue of the job's priority class first,
+        so callers are slowed down when the pipeline is saturated.
+        """
+        self.start()
+        await self.queues[STAGES[0]].put(job, job.priority)
+        return await job.future
+
+    async def convert_from_pdf(
+        self,
+        pdf_path: str,
+        target_language: str = "en",
+        engine: Optional[str] = None,
+        include_appendix_figures: bool = False,
+        paper_id: Optional[str] = None,
+        filename: Optional[str] = None,
+    ) -> ConversionResponse:
+        """Same contract as ``PaperConverter.convert_from_pdf``, run through the
+        stage pools (and persisted when ``paper_id`` is given)."""
+        results = await self.convert_from_pdf_languages(
+            pdf_path,
+            [target_language],
+            engine=engine,
+            include_appendix_figures=include_appendix_figures,
+            paper_id=paper_id,
+            filename=filename,
+        )
+        return results[target_language]
+
+    async def convert_from_pdf_languages(
+        self,
+        pdf_path: str,
+        languages: Sequence[str],
+        engine: Optional[str] = None,
+        include_appendix_figures: bool = False,
+        paper_id: Optional[str] = None,
+        filename: Optional[str] = None,
+    ) -> Results:
+        """Extract and caption once, then generate a post per language."""
+        return await self.submit(
+            ConversionJob(
+                pdf_path,
+                languages,
+                engine=engine,
+                include_appendix_figures=include_appendix_figures,
+                paper_id=paper_id,
+                filename=filename,
+            )
+        )
+
+    async def _worker(
+        self,
+        stage: str,
+        handler: Handler,
+        next_stage: Optional[str],
+    ) -> None:
+        queue = self.queues[stage]
+        while True:
+            job = await queue.get()
+            self.busy[stage] += 1
+            try:
+                if job.future.done():
+                    # The caller is gone or the job already finished
+                    continue
+                results = await self._run_stage(stage, handler, job)
+                if job.future.done():
+                    continue
+                if results is None and next_stage is not None:
+                    await self.queues[next_stage].put(job, job.priority)
+                else:
+                    job.future.set_result(results)
+            except Exception as e:
+                logger.error(f"Pipeline stage {stage} failed: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self.busy[stage] -= 1
+
+    async def _run_stage(
+        self, stage: str, handler: Handler, job: ConversionJob
+    ) -> Optional[Results]:
+        """Run ``handler`` in its own task, cancelled when the job's caller
+        goes away; the worker itself keeps serving the queue."""
+        task = asyncio.ensure_future(self._call(handler, job))
+
+        def cancel_stage(future: asyncio.Future) -> None:
+            if future.cancelled():
+                task.cancel()
+
+        job.future.add_done_callback(cancel_stage)
+        try:
+            await asyncio.wait([task])
+        finally:
+            # Also when the worker itself is stopped
+            task.cancel()
+            job.future.remove_done_callback(cancel_stage)
+        if task.cancelled():
+            logger.info(f"Pipeline stage {stage} cancelled, the caller went away")
+            return None
+        return task.result()
+
+    @staticmethod
+    async def _call(handler: Handler, job: ConversionJob) -> Optional[Results]:
+        # Workers outlive requests, so the job's deadline, profile and priority
+        # (for provider slots) are set per stage
+        with deadline_scope(job.deadline or 0), profile_scope(job.profile):
+            with priority_scope(job.priority):
+                return await handler(job)
+
+    # Stage handlers. Returning results finishes the job with them; returning
+    # None passes the job on to the next stage.
+
+    async def _extract(self, job: ConversionJob) -> Optional[Results]:
+        try:
+            job.text, job.figures = await self.converter.extract(
+                job.pdf_path,
+                job.engine,
+                job.include_appendix_figures,
+                paper_id=job.paper_id,
+            )
+        except Exception as e:
+            return {
+                language: ConversionResponse(
+                    language=language,
+                    error=f"Error in PDF processing: {str(e)}",
+                    degradations=degradations(),
+                )
+                for language in job.languages
+            }
+        return None
+
+    async def _select(self, job: ConversionJob) -> Optional[Results]:
+        job.figures = await self.converter.select(job.figures)
+        return None
+
+    async def _caption(self, job: ConversionJob) -> Optional[Results]:
+        job.figures = await self.converter.caption(
+            job.text, job.figures, paper_id=job.paper_id
+        )
+        return None
+
+    async def _generate(self, job: ConversionJob) -> Optional[Results]:
+        job.results = await self.converter.generate_languages(
+            job.text, job.languages, job.figures
+        )
+        # Results of uploaded papers are persisted by the next stage
+        return job.results if job.paper_id is None else None
+
+    async def _persist(self, job: ConversionJob) -> Optional[Results]:
+        await asyncio.gather(
+            self.converter.save_extraction(job.paper_id, job.text, job.figures),
+            *(
+                self.converter.save_result(job.paper_id, job.filename, language, result)
+                for language, result in job.results.items()
+            ),
+        )
+        return job.results
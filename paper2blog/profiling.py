@@ -0,0 +1,295 @@
+"""
+Opt-in profiling of single requests.
+
+A profiled request records:
+
+* a sampling CPU profile of the event loop thread: a background thread reads
+  the loop's Python stack every ``PAPER2BLOG_PROFILE_INTERVAL`` seconds and
+  counts it in folded ("collapsed") form, one ``frame;frame;... count`` line
+  per stack, ready for ``flamegraph.pl`` or speedscope;
+* ``tracemalloc`` snapshots around the memory-heavy steps marked with
+  ``section()`` (PDF extraction, marker's base64 figures, VLM image encoding
+  and LLM prompt construction): time taken, traced memory growth and peak,
+  and the source lines that allocated the most.
+
+Profiles are kept in memory (the last ``PAPER2BLOG_PROFILE_KEEP``) and served
+by the ``/admin/profiles`` endpoints. Requests opt in with the
+``X-Paper2Blog-Profile`` header together with the admin token, or every
+request is profiled while the admin flag is on.
+
+When no request is being profiled, the sampler thread is not running,
+``tracemalloc`` is off and ``section()`` only reads a context variable.
+The event loop and allocator are process wide, so requests running at the
+same time as a profiled one show up in its profile too.
+"""
+
+import os
+import sys
+import time
+import uuid
+import hmac
+import logging
+import threading
+import tracemalloc
+import contextvars
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds between stack samples of the event loop
+PROFILE_INTERVAL = float(os.getenv("PAPER2BLOG_PROFILE_INTERVAL", "0.005"))
+
+# Finished profiles kept for the admin endpoints
+PROFILE_KEEP = int(os.getenv("PAPER2BLOG_PROFILE_KEEP", "20"))
+
+# Stack depth recorded per allocation while tracing
+TRACEMALLOC_FRAMES = int(os.getenv("PAPER2BLOG_PROFILE_TRACEMALLOC_FRAMES", "8"))
+
+# Allocation sites reported per section
+TOP_ALLOCATIONS = 10
+
+# Request header asking for a profile of that request (with the admin token)
+PROFILE_HEADER = "x-paper2blog-profile"
+ADMIN_TOKEN_HEADER = "x-admin-token"
+PROFILE_ID_HEADER = "x-profile-id"
+
+
+class Profile:
+    __slots__ = (
+        "id",
+        "label",
+        "started_at",
+        "duration",
+        "samples",
+        "sections",
+        "peak_memory",
+    )
+
+    def __init__(self, label: str = ""):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.started_at = time.time()
+        self.duration: Optional[float] = None
+        # Folded stack -> number of samples
+        self.samples: Counter = Counter()
+        self.sections: List[Dict[str, Any]] = []
+        self.peak_memory = 0
+
+    def folded(self) -> str:
+        """Samples in collapsed-stack format, one ``stack count`` per line."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_seconds": self.duration,
+            "samples": sum(self.samples.values()),
+            "peak_memory_bytes": self.peak_memory,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.summary(),
+            "sections": self.sections,
+            "top_stacks": [
+                {"stack": stack, "samples": count}
+                for stack, count in self.samples.most_common(20)
+            ],
+        }
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _fold(frame) -> str:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class _Sampler(threading.Thread):
+    """Samples one thread's stack into every active profile."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="paper2blog-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.profiles: List[Profile] = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = _fold(frame)
+            del frame
+            with self.lock:
+                for profile in self.profiles:
+                    profile.samples[stack] += 1
+
+
+class ProfileRegistry:
+    """Active and recently finished profiles of this process."""
+
+    def __init__(self, keep: int = PROFILE_KEEP):
+        self.keep = keep
+        # Admin flag: profile every request
+        self.enabled = os.getenv("PAPER2BLOG_PROFILE", "0") == "1"
+        self._finished: "OrderedDict[str, Profile]" = OrderedDict()
+        self._sampler: Optional[_Sampler] = None
+        self._active = 0
+        self._started_tracemalloc = False
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return self._finished.get(profile_id)
+
+    def recent(self) -> List[Profile]:
+        return list(reversed(self._finished.values()))
+
+    def _start(self, profile: Profile) -> None:
+        if self._sampler is None:
+            self._sampler = _Sampler(threading.get_ident(), PROFILE_INTERVAL)
+            self._sampler.start()
+        with self._sampler.lock:
+            self._sampler.profiles.append(profile)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._active += 1
+
+    def _finish(self, profile: Profile) -> None:
+        self._active -= 1
+        profile.peak_memory = tracemalloc.get_traced_memory()[1]
+        with self._sampler.lock:
+            self._sampler.profiles.remove(profile)
+        if not self._active:
+            self._sampler.stopped.set()
+            self._sampler = None
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+        self._finished[profile.id] = profile
+        while len(self._finished) > self.keep:
+            self._finished.popitem(last=False)
+
+    @contextmanager
+    def profiling(self, label: str = "") -> Iterator[Profile]:
+        """Profile the block; must be entered on the event loop thread."""
+        profile = Profile(label)
+        self._start(profile)
+        token = _current.set(profile)
+        started = time.monotonic()
+        try:
+            yield profile
+        finally:
+            profile.duration = time.monotonic() - started
+            _current.reset(token)
+            self._finish(profile)
+            logger.info(
+                f"Profile {profile.id} of {label or 'request'}: "
+                f"{profile.duration:.2f}s, {sum(profile.samples.values())} samples"
+            )
+
+
+profiles = ProfileRegistry()
+
+_current: "contextvars.ContextVar[Optional[Profile]]" = contextvars.ContextVar(
+    "paper2blog_profile", default=None
+)
+
+
+def current_profile() -> Optional[Profile]:
+    return _current.get()
+
+
+@contextmanager
+def profile_scope(profile: Optional[Profile]) -> Iterator[None]:
+    """Attribute sections in the block to ``profile`` (for tasks that outlive
+    the request that started it, e.g. pipeline workers)."""
+    token = _current.set(profile)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+_SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+
+@contextmanager
+def section(name: str) -> Iterator[None]:
+    """Record time and allocations of the block in the current profile."""
+    profile = _current.get()
+    if profile is None or not tracemalloc.is_tracing():
+        yield
+        return
+    before = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    traced_before = tracemalloc.get_traced_memory()[0]
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - started
+        traced_after, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        top = after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]
+        profile.sections.append(
+            {
+                "name": name,
+                "seconds": seconds,
+                "memory_delta_bytes": traced_after - traced_before,
+                "peak_memory_bytes": peak,
+                "top_allocations": [
+                    {
+                        "line": str(stat.traceback[0]),
+                        "size_delta_bytes": stat.size_diff,
+                        "count_delta": stat.count_diff,
+                    }
+                    for stat in top
+                ],
+            }
+        )
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that ask for it (or all requests
+    while ``profiles.enabled``) and returning the profile id in a header."""
+
+    def __init__(self, app, admin_token: Optional[str] = None):
+        self.app = app
+        self.admin_token = admin_token
+
+    def _requested(self, scope) -> bool:
+        if profiles.enabled:
+            return True
+        headers = dict(scope.get("headers") or [])
+        if not self.admin_token or PROFILE_HEADER.encode() not in headers:
+            return False
+        token = headers.get(ADMIN_TOKEN_HEADER.encode(), b"")
+        return hmac.compare_digest(token, self.admin_token.encode())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            return await self.app(scope, receive, send)
+
+        with profiles.profiling(f"{scope['method']} {scope['path']}") as profile:
+
+            async def send_with_id(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((PROFILE_ID_HEADER.encode(), profile.id.encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_id)
@@ -0,0 +1,371 @@
+"""
+Client-side rate limiting and adaptive concurrency for provider calls.
+
+Every provider (``openai``, ``local``, ``siliconflow``, ...) gets one
+``ProviderLimiter`` per process, shared by all in-flight conversions. A call
+first waits on a requests/minute and a tokens/minute bucket, then for a
+concurrency slot whose limit adapts AIMD-style: it grows slowly while calls
+succeed and is halved when the provider signals overload (429/503). Retryable
+failures are retried with full-jitter exponential backoff, honouring
+``Retry-After`` when the provider sends one. Callers waiting for a slot are
+served by weighted fair share between priority classes (see ``scheduling``).
+
+Limits are configured per provider with environment variables, e.g.::
+
+    PAPER2BLOG_OPENAI_RPM=500
+    PAPER2BLOG_OPENAI_TPM=200000
+    PAPER2BLOG_OPENAI_MAX_CONCURRENCY=16
+"""
+
+import os
+import re
+import math
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+from paper2blog.scheduling import FairShare, current_priority
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+OVERLOAD_STATUS = {429, 503}
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_minute``."""
+
+    def __init__(
+        self,
+        rate_per_minute: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._paused_until = 0.0
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for ``seconds`` (e.g. after a 429)."""
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens if available, else return the seconds to wait."""
+        amount = min(amount, self.capacity)
+        now = self._clock()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        while True:
+            wait = self.reserve(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the number of in-flight requests.
+
+    Callers waiting for a slot queue per priority class; freed slots go to the
+    classes by weighted fair share, FIFO within a class.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 32,
+        decrease_factor: float = 0.5,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._share = FairShare()
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {
+            priority: deque() for priority in self._share.weights
+        }
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def waiting_by_priority(self) -> Dict[str, int]:
+        return {priority: len(waiters) for priority, waiters in self._waiters.items()}
+
+    async def acquire(self) -> None:
+        priority = current_priority()
+        waiters = self._waiters[priority]
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            if not waiters:
+                self._share.activate(priority)
+            waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass on a wake-up we may have consumed
+                self._wake()
+                raise
+            finally:
+                if waiter in waiters:
+                    waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self, overloaded: bool = False) -> None:
+        self.in_flight -= 1
+        if overloaded:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+        else:
+            # Additive increase: roughly +1 per "limit" successful calls
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0:
+            priority = self._share.pick(p for p, w in self._waiters.items() if w)
+            if priority is None:
+                return
+            waiter = self._waiters[priority].popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class LimiterMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.requests += 1
+        self.queue_wait_total += seconds
+        self.queue_wait_max = max(self.queue_wait_max, seconds)
+
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after_of(error: BaseException) -> Optional[float]:
+    """Extract a Retry-After delay in seconds from a provider error, if any."""
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = status_code_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    # openai.APIConnectionError / APITimeoutError carry no status code
+    name = type(error).__name__
+    return "Connection" in name or "Timeout" in name
+
+
+def is_provider_error(error: BaseException) -> bool:
+    """An error response from the provider or a failure to reach it, as
+    opposed to a bug or a bad request on our side."""
+    return status_code_of(error) is not None or is_retryable(error)
+
+
+class ProviderLimiter:
+    """Rate limiter, adaptive concurrency and retry policy for one provider."""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        concurrency: Optional[AdaptiveConcurrency] = None,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = LimiterMetrics()
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(max_delay, base * 2^attempt)]
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def call(
+        self, func: Callable[[], Awaitable[T]], estimated_tokens: int = 0
+    ) -> T:
+        """Run ``func`` under the provider's limits, retrying transient failures."""
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            if self.requests:
+                await self.requests.acquire(1)
+            if self.tokens and estimated_tokens:
+                await self.tokens.acquire(estimated_tokens)
+            await self.concurrency.acquire()
+            self.metrics.record_wait(time.monotonic() - start)
+
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                self.concurrency.release()
+                raise
+            except Exception as e:
+                status = status_code_of(e)
+                self.concurrency.release(overloaded=status in OVERLOAD_STATUS)
+                if status == 429:
+                    self.metrics.rate_limited += 1
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self.metrics.failures += 1
+                    raise
+                retry_after = retry_after_of(e)
+                delay = retry_after if retry_after is not None else self.backoff(attempt)
+                delay = min(delay, self.max_delay)
+                if retry_after is not None and self.requests:
+                    # The provider told us when to come back: hold every caller
+                    self.requests.pause(delay)
+                self.metrics.retries += 1
+                attempt += 1
+                logger.warning(
+                    f"{self.name} call failed ({e}), retry {attempt}/{self.max_retries} "
+                    f"in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+            else:
+                self.concurrency.release()
+                return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        m = self.metrics
+        return {
+            "requests": m.requests,
+            "retries": m.retries,
+            "rate_limited": m.rate_limited,
+            "failures": m.failures,
+            "queue_wait_avg": m.queue_wait_total / m.requests if m.requests else 0.0,
+            "queue_wait_max": m.queue_wait_max,
+            "in_flight": self.concurrency.in_flight,
+            "waiting": self.concurrency.waiting,
+            "waiting_by_priority": self.concurrency.waiting_by_priority(),
+            "concurrency_limit": self.concurrency.limit,
+        }
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """Return the process-wide limiter for ``provider``, configured from env."""
+    if provider not in _limiters:
+        prefix = f"PAPER2BLOG_{provider.upper()}"
+        maximum = int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "32"))
+        _limiters[provider] = ProviderLimiter(
+            provider,
+            requests_per_minute=_env_float(f"{prefix}_RPM"),
+            tokens_per_minute=_env_float(f"{prefix}_TPM"),
+            concurrency=AdaptiveConcurrency(
+                initial=min(maximum, int(os.getenv(f"{prefix}_INITIAL_CONCURRENCY", "8"))),
+                maximum=maximum,
+            ),
+            max_retries=int(os.getenv(f"{prefix}_MAX_RETRIES", "4")),
+        )
+    return _limiters[provider]
+
+
+def limiter_metrics() -> Dict[str, Dict[str, Any]]:
+    """Metrics snapshot for every provider limiter created so far."""
+    return {name: limiter.snapshot() for name, limiter in _limiters.items()}
+
+
+# CJK ideographs, kana, hangul and full-width forms: about one token each in
+# common BPE vocabularies, against about four characters per token for
+# English prose and code
+_CJK = re.compile(
+    "[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]"
+)
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count of ``text`` without a model tokenizer."""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / CHARS_PER_TOKEN)
+
+
+def prompt_tokens(messages: Any) -> int:
+    """Approximate token count of the text in chat ``messages``."""
+    tokens = 0
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            tokens += count_tokens(content)
+        else:
+            # Multi-part content: count text parts, images are billed separately
+            tokens += sum(
+                count_tokens(p.get("text", "")) for p in content if isinstance(p, dict)
+            )
+    return tokens
+
+
+def estimate_tokens(messages: Any, max_tokens: Optional[int] = None) -> int:
+    """Rough token estimate of a call (prompt plus completion) for budgeting."""
+    return prompt_tokens(messages) + (max_tokens or 1000)
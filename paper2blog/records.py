@@ -0,0 +1,87 @@
+"""
+Lightweight internal records.
+
+The pydantic models in ``model_types`` are the API contract. Inside the
+pipeline a paper can carry many candidate figures through several stages, so
+figures travel as plain ``__slots__`` records instead: no validation on every
+copy, no per-instance ``__dict__``, and the markdown snippet is rendered on
+demand rather than stored next to a second copy of the caption. Records are
+converted to ``ImageInfo`` only when the ``ConversionResponse`` is built.
+"""
+
+import hashlib
+from typing import Any, Callable, Dict, Optional
+
+
+class FigureRecord:
+    """A figure stored in the ``PaperStore`` (or, for web pages, a remote URL)."""
+
+    __slots__ = ("id", "path", "width", "height", "caption", "name")
+
+    def __init__(
+        self,
+        id: str,
+        path: str,
+        width: int = 0,
+        height: int = 0,
+        caption: str = "",
+        name: str = "",
+    ):
+        # Content hash of the image bytes (hash of the URL for remote images)
+        self.id = id
+        self.path = path
+        self.width = width
+        self.height = height
+        self.caption = caption
+        # Name given by the extraction engine, e.g. "_page_1_Figure_0.png"
+        self.name = name
+
+    @classmethod
+    def from_url(cls, url: str, caption: str = "") -> "FigureRecord":
+        return cls(hashlib.sha256(url.encode()).hexdigest(), url, caption=caption)
+
+    @property
+    def url(self) -> str:
+        # Same attribute name as ImageInfo, so renderers accept either
+        return self.path
+
+    @property
+    def area(self) -> int:
+        return self.width * self.height
+
+    @property
+    def markdown(self) -> str:
+        return f"![{self.caption}]({self.path})"
+
+    def with_caption(self, caption: str) -> "FigureRecord":
+        return FigureRecord(
+            self.id, self.path, self.width, self.height, caption, self.name
+        )
+
+    def to_image_info(self, url_for: Optional[Callable[[str], str]] = None):
+        """API model of the figure; ``url_for`` maps the stored path to the URL
+        clients should use (e.g. ``PaperStore.public_url``)."""
+        from paper2blog.model_types import ImageInfo
+
+        url = url_for(self.path) if url_for else self.path
+        return ImageInfo(
+            caption=self.caption, url=url, markdown=f"![{self.caption}]({url})"
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "FigureRecord":
+        return cls(**{slot: data[slot] for slot in cls.__slots__ if slot in data})
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, FigureRecord):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return (
+            f"FigureRecord(id={self.id[:12]!r}, path={self.path!r}, "
+            f"caption={self.caption!r})"
+        )
@@ -0,0 +1,185 @@
+"""
+Priority classes for conversions sharing the pipeline and provider slots.
+
+Uploads from the web UI, bulk re-conversions from the command line and
+background refreshes compete for the same workers and LLM/VLM concurrency.
+Each conversion runs under a priority class (``priority_scope``), carried in
+a context variable like the request deadline. Wherever work waits for a
+shared resource (a pipeline stage queue, a provider concurrency slot) it
+waits per class, and the next one served is picked by stride scheduling: a
+class is charged ``1 / weight`` per item served and the backlogged class
+with the lowest charge goes next. With the default weights
+(``interactive=8,batch=2,background=1``) interactive work gets most of the
+capacity while bulk work keeps moving instead of starving.
+
+Running work is never preempted: priorities apply when a slot frees up and
+when a job moves on to its next pipeline stage.
+"""
+
+import os
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Generic, Iterable, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PRIORITIES = ("interactive", "batch", "background")
+DEFAULT_PRIORITY = "interactive"
+
+
+def _parse_weights(value: str) -> Dict[str, float]:
+    weights = {"interactive": 8.0, "batch": 2.0, "background": 1.0}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        if name.strip() not in weights or float(weight) <= 0:
+            raise ValueError(f"Invalid priority weight '{item}'")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+# Share of contended capacity per class, e.g. "interactive=8,batch=2"
+PRIORITY_WEIGHTS = _parse_weights(os.getenv("PAPER2BLOG_PRIORITY_WEIGHTS", ""))
+
+_current: "contextvars.ContextVar[str]" = contextvars.ContextVar(
+    "paper2blog_priority", default=DEFAULT_PRIORITY
+)
+
+
+def parse_priority(value: Optional[str]) -> str:
+    """Validated priority class name; raises ``ValueError``."""
+    priority = (value or DEFAULT_PRIORITY).strip().lower()
+    if priority not in PRIORITIES:
+        raise ValueError(
+            f"Unknown priority '{value}', expected one of {', '.join(PRIORITIES)}"
+        )
+    return priority
+
+
+def current_priority() -> str:
+    return _current.get()
+
+
+@contextmanager
+def priority_scope(priority: Optional[str]) -> Iterator[str]:
+    """Run the block under ``priority`` (None: the default, interactive)."""
+    priority = parse_priority(priority)
+    token = _current.set(priority)
+    try:
+        yield priority
+    finally:
+        _current.reset(token)
+
+
+class FairShare:
+    """Stride scheduling over priority classes."""
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(weights or PRIORITY_WEIGHTS)
+        self._charge = {priority: 0.0 for priority in self.weights}
+        # Charge of the last class served; a class that was idle restarts
+        # from here rather than with credit saved up while it had no work
+        self._now = 0.0
+
+    def activate(self, priority: str) -> None:
+        """Call when ``priority`` goes from no waiting work to some."""
+        self._charge[priority] = max(self._charge[priority], self._now)
+
+    def pick(self, backlogged: Iterable[str]) -> Optional[str]:
+        """Charge and return the class to serve next, None if none waits."""
+        priority = min(backlogged, key=self._charge.__getitem__, default=None)
+        if priority is not None:
+            self._now = self._charge[priority]
+            self._charge[priority] += 1.0 / self.weights[priority]
+        return priority
+
+
+class FairQueue(Generic[T]):
+    """``asyncio.Queue`` with one bounded FIFO per priority class; ``get``
+    serves the classes by weighted fair share.
+
+    Each class has its own bound, so a backlog of bulk jobs blocks further
+    bulk submissions but never an interactive one.
+    """
+
+    def __init__(self, maxsize: int = 0, weights: Optional[Dict[str, float]] = None):
+        self.maxsize = maxsize
+        self._share = FairShare(weights)
+        self._items: Dict[str, Deque[T]] = {p: deque() for p in self._share.weights}
+        self._getters: Deque[asyncio.Future] = deque()
+        self._putters: Dict[str, Deque[asyncio.Future]] = {
+            p: deque() for p in self._share.weights
+        }
+
+    def qsize(self) -> int:
+        return sum(len(items) for items in self._items.values())
+
+    def sizes(self) -> Dict[str, int]:
+        return {priority: len(items) for priority, items in self._items.items()}
+
+    def empty(self) -> bool:
+        return not self.qsize()
+
+    def full(self, priority: str) -> bool:
+        return 0 < self.maxsize <= len(self._items[priority])
+
+    @staticmethod
+    async def _wait(waiters: Deque[asyncio.Future]) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            if waiter in waiters:
+                waiters.remove(waiter)
+
+    @staticmethod
+    def _wake(waiters: Deque[asyncio.Future]) -> None:
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def put(self, item: T, priority: Optional[str] = None) -> None:
+        """Add ``item`` to its class, waiting while that class is full."""
+        priority = priority or current_priority()
+        while self.full(priority):
+            try:
+                await self._wait(self._putters[priority])
+            except asyncio.CancelledError:
+                # Pass on a wake-up we may have consumed
+                if not self.full(priority):
+                    self._wake(self._putters[priority])
+                raise
+        self.put_nowait(item, priority)
+
+    def put_nowait(self, item: T, priority: Optional[str] = None) -> None:
+        priority = priority or current_priority()
+        items = self._items[priority]
+        if not items:
+            self._share.activate(priority)
+        items.append(item)
+        self._wake(self._getters)
+
+    async def get(self) -> T:
+        while self.empty():
+            try:
+                await self._wait(self._getters)
+            except asyncio.CancelledError:
+                if not self.empty():
+                    self._wake(self._getters)
+                raise
+        return self.get_nowait()
+
+    def get_nowait(self) -> T:
+        priority = self._share.pick(p for p, items in self._items.items() if items)
+        if priority is None:
+            raise asyncio.QueueEmpty
+        item = self._items[priority].popleft()
+        self._wake(self._putters[priority])
+        return item
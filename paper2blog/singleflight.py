@@ -0,0 +1,78 @@
+"""
+Single-flight deduplication of identical in-flight work.
+
+When several requests for the same paper (same PDF bytes and language) arrive
+while a conversion is still running, they all attach to the one running task
+instead of starting their own pipelines. This only covers the window before
+the first result lands; completed results are not cached here.
+
+The shared task is reference counted: a caller that goes away (e.g. its client
+disconnected) does not cancel work the others are still waiting on, but when
+the last caller goes away the task is cancelled instead of finishing work
+nobody will read.
+"""
+
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def conversion_key(content: bytes, language: str, *options: Optional[str]) -> str:
+    """Key identifying a conversion by PDF content hash, target language and
+    any options that change the result (e.g. the extraction engine)."""
+    parts = [hashlib.sha256(content).hexdigest(), language.strip().lower()]
+    parts.extend(option or "" for option in options)
+    return ":".join(parts)
+
+
+class SingleFlight:
+    """Run at most one task per key; concurrent callers share its result."""
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        # Callers currently awaiting each task
+        self._waiters: Dict[asyncio.Future, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Await the in-flight task for ``key``, starting ``func()`` if there is none.
+
+        The shared task is shielded from a single caller's cancellation and
+        only cancelled once every caller waiting on it has been cancelled.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            logger.info(f"Joining in-flight conversion {key}")
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                logger.info(f"Last caller of {key} went away, cancelling it")
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved by the waiters; avoid "exception was never retrieved" noise
+            logger.debug(f"In-flight task {key} failed: {task.exception()}")
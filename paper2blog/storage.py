@@ -0,0 +1,419 @@
+"""
+Content-addressed storage for uploaded papers, generated posts and figures.
+
+Layout under the data directory (``PAPER2BLOG_DATA_DIR``, default ``./tmp``)::
+
+    papers/ab/<sha256 of pdf>/paper.pdf
+    papers/ab/<sha256 of pdf>/extraction.json
+    papers/ab/<sha256 of pdf>/stages/<stage>.json
+    papers/ab/<sha256 of pdf>/<language>/blog.md
+    papers/ab/<sha256 of pdf>/<language>/metadata.json
+    figures/cd/<sha256 of image>.<ext>
+
+Papers and figures are keyed by the hash of their bytes, so different uploads
+never collide and identical figures are stored once. Every write goes to a
+temporary file that is renamed into place, so concurrent conversions never see
+partially written files. ``PaperStore.gc`` bounds disk usage by age and size.
+"""
+
+import os
+import re
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from paper2blog import serialization
+from paper2blog.executors import run_io
+
+logger = logging.getLogger(__name__)
+
+# Public base URL of the API, used for links in generated posts
+PUBLIC_BASE_URL = os.getenv("PAPER2BLOG_PUBLIC_BASE_URL", "http://localhost:8000")
+
+# URL prefix under which the data directory is served by the API
+STATIC_URL_PREFIX = f"{PUBLIC_BASE_URL.rstrip('/')}/tmp"
+
+# Figures are linked through the /figures endpoint as this format ("webp" or
+# "original") and resized to this width (0 keeps the full resolution)
+FIGURE_URL_FORMAT = os.getenv("PAPER2BLOG_FIGURE_FORMAT", "webp").strip().lower()
+FIGURE_URL_WIDTH = int(os.getenv("PAPER2BLOG_FIGURE_WIDTH", "1280"))
+
+# Temporary files and unreferenced figures younger than this are left alone,
+# they may belong to a conversion that is still running
+GC_GRACE_SECONDS = 3600
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def atomic_write(path: Union[str, Path], data: Union[bytes, str]) -> None:
+    """Write ``data`` to ``path`` via a temporary file and an atomic rename."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    fd, tmp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _slug(value: str) -> str:
+    return re.sub(r"[^a-z0-9_-]+", "-", value.strip().lower()).strip("-") or "default"
+
+
+def conversion_id(paper_id: str, language: str) -> str:
+    """Public id of the post generated for ``language`` from a stored paper."""
+    return f"{paper_id}-{_slug(language)}"
+
+
+def parse_conversion_id(value: str) -> Tuple[str, str]:
+    """``(paper_id, language slug)`` of a conversion id; raises ``KeyError``."""
+    paper_id, _, language = value.partition("-")
+    if not re.fullmatch(r"[0-9a-f]{64}", paper_id) or _slug(language) != language:
+        raise KeyError(f"Invalid conversion id '{value}'")
+    return paper_id, language
+
+
+def _tree_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def _tree_mtime(path: Path) -> float:
+    return max(
+        [p.stat().st_mtime for p in path.rglob("*") if p.is_file()]
+        + [path.stat().st_mtime]
+    )
+
+
+class PaperStore:
+    def __init__(self, root: Optional[Union[str, Path]] = None):
+        self.root = Path(root or os.getenv("PAPER2BLOG_DATA_DIR", "tmp")).resolve()
+        self.papers_dir = self.root / "papers"
+        self.figures_dir = self.root / "figures"
+        self.variants_dir = self.root / "variants"
+
+    @staticmethod
+    def _shard(base: Path, digest: str) -> Path:
+        return base / digest[:2] / digest
+
+    def paper_dir(self, paper_id: str) -> Path:
+        return self._shard(self.papers_dir, paper_id)
+
+    def conversion_dir(self, paper_id: str, language: str) -> Path:
+        return self.paper_dir(paper_id) / _slug(language)
+
+    def save_paper(self, content: bytes) -> Tuple[str, Path]:
+        """Store the PDF bytes, returning ``(paper_id, pdf_path)``."""
+        paper_id = content_hash(content)
+        pdf_path = self.paper_dir(paper_id) / "paper.pdf"
+        if pdf_path.exists():
+            os.utime(pdf_path)
+        else:
+            atomic_write(pdf_path, content)
+        return paper_id, pdf_path
+
+    def save_figure(self, data: bytes, name: str = "") -> Path:
+        """Store figure bytes once per distinct image, returning its path."""
+        digest = content_hash(data)
+        suffix = Path(name).suffix.lower() or ".png"
+        path = self._shard(self.figures_dir, digest).with_suffix(suffix)
+        if path.exists():
+            os.utime(path)
+        else:
+            atomic_write(path, data)
+        return path
+
+    def find_figure(self, digest: str) -> Optional[Path]:
+        """Path of the stored figure with content hash ``digest``, if any."""
+        if not re.fullmatch(r"[0-9a-f]{64}", digest):
+            return None
+        shard = self._shard(self.figures_dir, digest).parent
+        return next(shard.glob(f"{digest}.*"), None)
+
+    def variant_path(self, digest: str, width: int, suffix: str) -> Path:
+        """Where the resized/re-encoded variant of a stored figure is cached."""
+        return self.variants_dir / digest[:2] / f"{digest}-w{width}{suffix}"
+
+    def save_conversion(
+        self, paper_id: str, language: str, markdown: str, metadata: Dict[str, Any]
+    ) -> Path:
+        conversion_dir = self.conversion_dir(paper_id, language)
+        atomic_write(conversion_dir / "blog.md", markdown)
+        atomic_write(
+            conversion_dir / "metadata.json",
+            serialization.dumps(metadata, indent=True),
+        )
+        return conversion_dir
+
+    def load_conversion(self, paper_id: str, language: str) -> Optional[Dict[str, Any]]:
+        """Metadata of a stored conversion, None if there is none."""
+        path = self.conversion_dir(paper_id, language) / "metadata.json"
+        try:
+            return serialization.loads(path.read_bytes())
+        except FileNotFoundError:
+            return None
+
+    def save_extraction(
+        self, paper_id: str, text: str, figures: List[Dict[str, Any]]
+    ) -> Path:
+        """Store the extracted markdown and captioned figures of a paper, so
+        single sections can be regenerated without extracting it again."""
+        path = self.paper_dir(paper_id) / "extraction.json"
+        atomic_write(path, serialization.dumps({"text": text, "figures": figures}))
+        return path
+
+    def load_extraction(self, paper_id: str) -> Optional[Dict[str, Any]]:
+        path = self.paper_dir(paper_id) / "extraction.json"
+        try:
+            return serialization.loads(path.read_bytes())
+        except FileNotFoundError:
+            return None
+
+    def save_stage(self, paper_id: str, name: str, data: Any) -> Path:
+        """Cache the output of a pipeline stage (e.g. extraction or captions)
+        for a paper, so an interrupted conversion can resume from it."""
+        path = self.paper_dir(paper_id) / "stages" / f"{_slug(name)}.json"
+        atomic_write(path, serialization.dumps(data))
+        return path
+
+    def load_stage(self, paper_id: str, name: str) -> Optional[Any]:
+        path = self.paper_dir(paper_id) / "stages" / f"{_slug(name)}.json"
+        try:
+            return serialization.loads(path.read_bytes())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def relative(self, path: Union[str, Path]) -> str:
+        return Path(path).resolve().relative_to(self.root).as_posix()
+
+    def public_url(self, path: str) -> str:
+        """Web-accessible URL of a file stored under the data directory."""
+        if path.startswith(("http://", "https://")):
+            return path
+        relative = self.relative(path)
+        if relative.startswith("figures/"):
+            return self.figure_url(Path(path))
+        return f"{STATIC_URL_PREFIX}/{relative}"
+
+    def figure_refs(self, urls: List[str]) -> List[str]:
+        """Data-directory relative paths of the stored figures behind public
+        ``/figures`` URLs (or local paths); other URLs are skipped."""
+        refs = []
+        for url in urls:
+            if url.startswith(("http://", "https://")):
+                stem = url.partition("?")[0].rsplit("/", 1)[-1].partition(".")[0]
+                path = self.find_figure(stem)
+            else:
+                path = Path(url)
+            if path is not None:
+                refs.append(self.relative(path))
+        return refs
+
+    def figure_url(
+        self,
+        path: Path,
+        width: int = FIGURE_URL_WIDTH,
+        fmt: str = FIGURE_URL_FORMAT,
+    ) -> str:
+        """Content-hashed ``/figures`` URL of a stored figure, so it can be
+        cached forever; ``width`` and ``fmt`` select a derived variant."""
+        suffix = path.suffix if fmt == "original" else f".{fmt}"
+        url = f"{PUBLIC_BASE_URL.rstrip('/')}/figures/{path.stem}{suffix}"
+        return f"{url}?w={width}" if width else url
+
+    # ------------------------------------------------------------------
+    # Garbage collection
+    # ------------------------------------------------------------------
+
+    def _iter_papers(self) -> Iterator[Path]:
+        if not self.papers_dir.exists():
+            return
+        for shard in self.papers_dir.iterdir():
+            if shard.is_dir():
+                yield from (p for p in shard.iterdir() if p.is_dir())
+
+    def _iter_figures(self) -> Iterator[Path]:
+        if not self.figures_dir.exists():
+            return
+        for shard in self.figures_dir.iterdir():
+            if shard.is_dir():
+                yield from (p for p in shard.iterdir() if p.is_file())
+
+    def _iter_variants(self) -> Iterator[Path]:
+        if not self.variants_dir.exists():
+            return
+        for shard in self.variants_dir.iterdir():
+            if shard.is_dir():
+                yield from (
+                    p for p in shard.iterdir() if p.is_file() and p.name[0] != "."
+                )
+
+    def _referenced_figures(self, paper_dir: Path) -> List[str]:
+        figures = []
+        for metadata_path in paper_dir.glob("*/metadata.json"):
+            try:
+                metadata = serialization.loads(metadata_path.read_bytes())
+                figures.extend(metadata.get("figures", []))
+            except (OSError, ValueError):
+                continue
+        return figures
+
+    def gc(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        now: Optional[float] = None,
+    ) -> Dict[str, int]:
+        """Delete expired papers, evict least recently used ones over quota and
+        drop figures no longer referenced by any paper, with their variants.
+
+        Args:
+            ttl_seconds: Remove papers not written or read for this long
+            max_bytes: Evict least recently used papers until under this size
+            now: Current time (for tests)
+
+        Returns:
+            Counts of removed papers, figures and figure variants, freed and
+            remaining bytes
+        """
+        now = now if now is not None else time.time()
+        stats = {
+            "papers": 0,
+            "figures": 0,
+            "variants": 0,
+            "freed_bytes": 0,
+            "usage_bytes": 0,
+        }
+
+        papers = []
+        refcounts: Dict[str, int] = {}
+        for paper_dir in self._iter_papers():
+            figures = self._referenced_figures(paper_dir)
+            for figure in figures:
+                refcounts[figure] = refcounts.get(figure, 0) + 1
+            papers.append(
+                (_tree_mtime(paper_dir), paper_dir, _tree_size(paper_dir), figures)
+            )
+        papers.sort(key=lambda p: p[0])
+
+        figure_sizes = {
+            self.relative(p): p.stat().st_size for p in self._iter_figures()
+        }
+        variants = {}
+        for path in self._iter_variants():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            variants[path] = (stat.st_mtime, stat.st_size)
+        usage = initial_usage = (
+            sum(p[2] for p in papers)
+            + sum(figure_sizes.values())
+            + sum(size for _, size in variants.values())
+        )
+
+        def remove_paper(paper_dir: Path, size: int, figures: List[str]) -> int:
+            shutil.rmtree(paper_dir, ignore_errors=True)
+            stats["papers"] += 1
+            for figure in figures:
+                refcounts[figure] -= 1
+            return size
+
+        remaining = []
+        for mtime, paper_dir, size, figures in papers:
+            if ttl_seconds is not None and now - mtime > ttl_seconds:
+                usage -= remove_paper(paper_dir, size, figures)
+            else:
+                remaining.append((mtime, paper_dir, size, figures))
+
+        # Unreferenced figures are reclaimed as soon as they are past the grace
+        # period; over quota, the oldest papers go first
+        def sweep_figures() -> int:
+            freed = 0
+            for rel, size in list(figure_sizes.items()):
+                if refcounts.get(rel, 0) > 0:
+                    continue
+                path = self.root / rel
+                try:
+                    if now - path.stat().st_mtime < GC_GRACE_SECONDS:
+                        continue
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                del figure_sizes[rel]
+                stats["figures"] += 1
+                freed += size
+            return freed
+
+        def remove_variant(path: Path) -> int:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            stats["variants"] += 1
+            return variants.pop(path)[1]
+
+        # Variants of figures that are gone go with them
+        def sweep_variants() -> int:
+            digests = {Path(rel).stem for rel in figure_sizes}
+            return sum(
+                remove_variant(path)
+                for path in list(variants)
+                if path.name.partition("-")[0] not in digests
+            )
+
+        def over_quota() -> bool:
+            return max_bytes is not None and usage > max_bytes
+
+        usage -= sweep_figures()
+        usage -= sweep_variants()
+        # Variants are rendered again on demand, so over quota the least
+        # recently rendered ones go before any paper is evicted
+        for path in sorted(variants, key=lambda p: variants[p][0]):
+            if not over_quota():
+                break
+            usage -= remove_variant(path)
+        while over_quota() and remaining:
+            _, paper_dir, size, figures = remaining.pop(0)
+            usage -= remove_paper(paper_dir, size, figures)
+            usage -= sweep_figures()
+            usage -= sweep_variants()
+
+        for tmp_file in self.root.rglob(".*.tmp"):
+            try:
+                if now - tmp_file.stat().st_mtime > GC_GRACE_SECONDS:
+                    tmp_file.unlink()
+            except FileNotFoundError:
+                pass
+
+        stats["freed_bytes"] = initial_usage - usage
+        stats["usage_bytes"] = usage
+        return stats
+
+    async def run_gc(
+        self,
+        interval_seconds: float = 600,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        """Run ``gc`` periodically in a worker thread until cancelled."""
+        while True:
+            try:
+                stats = await run_io(self.gc, ttl_seconds, max_bytes)
+                logger.info(f"Storage GC: {stats}")
+            except Exception as e:
+                logger.error(f"Storage GC failed: {e}")
+            await asyncio.sleep(interval_seconds)
@@ -1,15 +1,32 @@
 import os
 import io
-import base64
-import requests
-import numpy as np
-from PIL import Image
-from typing import Tuple, List
-import json
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple, List, Union
+from pathlib import Path
+from .deadline import budget, deadline_scope, degrade
+from .executors import run_io
+from .extractors import (
+    ExtractionEngine,
+    PyMuPDFEngine,
+    find_back_matter_page,
+    get_engine,
+)
+from .figure_index import FigureIndex
 from .model_types import ImageInfo
+from .profiling import section
+from .records import FigureRecord
+from .storage import PaperStore
 from .vlm_handler import VLMHandler
 import re
 
+logger = logging.getLogger(__name__)
+
+# Share of the remaining request deadline captioning may take, and the least
+# time worth starting VLM requests with
+CAPTION_DEADLINE_SHARE = 0.5
+MIN_CAPTION_SECONDS = float(os.getenv("PAPER2BLOG_MIN_CAPTION_SECONDS", "10"))
+
 
 def format_image_markdown(content: str) -> str:
     """
@@ -39,86 +56,221 @@ async def extract_content_from_pdf(
     extract_text: bool = True,
     extract_images: bool = True,
     max_images: int = 6,
+    store: Optional[PaperStore] = None,
+    engine: Union[str, ExtractionEngine, None] = None,
+    stop_at_references: Optional[bool] = None,
+    include_appendix_figures: bool = False,
+    deadline: Optional[float] = None,
 ) -> Tuple[str, List[ImageInfo]]:
     """
-    Extract text and images from PDF using marker API
+    Extract text and images from PDF using the selected extraction engine
 
     Args:
         pdf_path: Path to the PDF file
         extract_text: Whether to extract text content
         extract_images: Whether to extract images
         max_images: Maximum number of images to extract (default 4, as first 4 are usually most relevant)
+        store: Content-addressed store the figures are saved to
+        engine: Extraction engine name ("marker", "pymupdf", "auto", "fast") or instance
+        stop_at_references: Skip everything from the references/appendix onwards
+            (default from PAPER2BLOG_STOP_AT_REFERENCES, on unless set to "0")
+        include_appendix_figures: Still extract figures from the skipped pages
+        deadline: Time budget in seconds; stages degrade (PyMuPDF instead of
+            marker, the paper's own captions) rather than overrun it. Defaults
+            to the deadline of the calling request, if any
 
     Returns:
         Tuple containing:
         - Extracted text (markdown format)
         - List of ImageInfo objects
     """
+    if deadline is not None:
+        with deadline_scope(deadline):
+            return await extract_content_from_pdf(
+                pdf_path,
+                extract_text,
+                extract_images,
+                max_images,
+                store,
+                engine,
+                stop_at_references,
+                include_appendix_figures,
+            )
     try:
-        # Simple API call matching test_marker_api.py
-        post_data = {"filepath": pdf_path}
-        result = requests.post(
-            "http://localhost:8024/marker", data=json.dumps(post_data)
-        ).json()
-
-        vlm_handler = VLMHandler()
-
-        if not result.get("success"):
-            print("Marker API failed to process PDF")
-            return "", []
-
-        # Extract markdown content if requested
-        text_content = ""
-        if extract_text:
-            text_content = result.get("output", "")
-            # here we merge the caption description into markdown ![{here}]
-            text_content = format_image_markdown(text_content)
-
-        # Process images if requested
-        images = []
-        if extract_images and "images" in result:
-            # Get first max_images from the images dict
-            image_items = list(result["images"].items())[:max_images]
-
-            for idx, (image_name, image_data) in enumerate(image_items):
-                try:
-                    # Decode base64 string to bytes first
-                    image_bytes = base64.b64decode(image_data)
-                    # Generate caption from image name using decoded bytes
-                    caption = await vlm_handler.generate_caption(
-                        text_content, image_bytes
-                    )
-
-                    # Save image temporarily
-                    temp_path = os.path.join(
-                        "/home/dongpeijie/workspace/Paper2Blog/tmp/saved_pngs",
-                        image_name,
-                    )
-                    os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-
-                    # Write the already decoded bytes
-                    with open(temp_path, "wb") as f:
-                        f.write(image_bytes)
-
-                    # Create ImageInfo object
-                    image_info = ImageInfo(
-                        caption=caption,
-                        url=temp_path,
-                        markdown=f"![{caption}]({temp_path})",
-                    )
-                    images.append(image_info)
-
-                except Exception as e:
-                    print(f"Error processing image {image_name}: {e}")
-                    continue
-        return text_content, images
+        text_content, figures = await extract_uncaptioned_content(
+            pdf_path,
+            extract_text=extract_text,
+            extract_images=extract_images,
+            max_images=max_images,
+            store=store,
+            engine=engine,
+            stop_at_references=stop_at_references,
+            include_appendix_figures=include_appendix_figures,
+        )
+        figures = await caption_figures(text_content, figures)
+        return text_content, [figure.to_image_info() for figure in figures]
     except Exception as e:
-        print(f"Error extracting content from PDF: {e}")
+        logger.warning(f"Error extracting content from PDF: {e}")
         return "", []
 
 
+async def extract_uncaptioned_content(
+    pdf_path: str,
+    extract_text: bool = True,
+    extract_images: bool = True,
+    max_images: int = 6,
+    store: Optional[PaperStore] = None,
+    engine: Union[str, ExtractionEngine, None] = None,
+    stop_at_references: Optional[bool] = None,
+    include_appendix_figures: bool = False,
+) -> Tuple[str, List[FigureRecord]]:
+    """Extraction half of ``extract_content_from_pdf``: the markdown text and
+    the stored figures, without captions. Raises if the engine fails."""
+    extraction_engine = get_engine(engine)
+    if stop_at_references is None:
+        stop_at_references = os.getenv("PAPER2BLOG_STOP_AT_REFERENCES", "1") != "0"
+
+    # Only parse up to the page where references/appendix begin
+    page_limit = None
+    if stop_at_references:
+        back_matter_page = await run_io(find_back_matter_page, pdf_path)
+        if back_matter_page is not None:
+            page_limit = back_matter_page + 1
+
+    with section("extract"):
+        result = await extraction_engine.extract(
+            pdf_path,
+            extract_images=extract_images,
+            max_images=max_images,
+            page_limit=page_limit,
+        )
+
+    if (
+        page_limit
+        and extract_images
+        and include_appendix_figures
+        and len(result.images) < max_images
+    ):
+        appendix_figures = await PyMuPDFEngine().extract_figures(pdf_path, page_limit)
+        result.images.extend(appendix_figures[: max_images - len(result.images)])
+
+    store = store or PaperStore()
+
+    # Extract markdown content if requested
+    text_content = ""
+    if extract_text:
+        text_content = result.markdown
+        # here we merge the caption description into markdown ![{here}]
+        text_content = format_image_markdown(text_content)
+
+    figures = []
+    if extract_images:
+        for image_name, image_bytes in result.images:
+            figures.append(await run_io(store_figure, store, image_bytes, image_name))
+    return text_content, figures
+
+
+def image_size(data: bytes) -> Tuple[int, int]:
+    """Pixel dimensions from the image header, (0, 0) if it cannot be read."""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return 0, 0
+
+
+def store_figure(store: PaperStore, data: bytes, name: str = "") -> FigureRecord:
+    """Save figure bytes, deduplicated by image hash, and describe them."""
+    path = store.save_figure(data, name)
+    width, height = image_size(data)
+    return FigureRecord(path.stem, str(path), width, height, name=name)
+
+
+def select_figures(
+    figures: List[FigureRecord], max_images: int = 6
+) -> List[FigureRecord]:
+    """Pick the figures worth captioning: drop repeats of the same image and,
+    when there are more than ``max_images``, keep the largest ones by pixel
+    area (logos and icons are small), preserving document order."""
+    unique = list({figure.id: figure for figure in figures}.values())
+    if len(unique) <= max_images:
+        return unique
+    largest = sorted(unique, key=lambda figure: figure.area, reverse=True)
+    keep = {figure.id for figure in largest[:max_images]}
+    return [figure for figure in unique if figure.id in keep]
+
+
+async def caption_figures(
+    text_content: str,
+    figures: List[FigureRecord],
+    vlm_handler: Optional[VLMHandler] = None,
+    captions: Optional[Dict[str, str]] = None,
+) -> List[FigureRecord]:
+    """Caption stored figures with the VLM (several figures per request),
+    each against its own caption and referencing paragraphs when the paper
+    has them. Figures the VLM fails on keep the paper's own caption if they
+    have one and are dropped otherwise.
+
+    ``captions`` (figure id -> caption) is filled as each batch finishes,
+    also when the call is cancelled part way.
+
+    Captioning may take part of the request deadline. When that is too short,
+    or runs out, figures without a VLM caption keep the paper's own caption.
+    """
+    vlm_handler = vlm_handler or VLMHandler()
+    captions = {} if captions is None else captions
+    images = await asyncio.gather(
+        *(run_io(Path(figure.path).read_bytes) for figure in figures)
+    )
+    index = FigureIndex.build(text_content)
+    contexts = [index.context_for(figure.name) or None for figure in figures]
+
+    def on_caption(idx: int, caption: str) -> None:
+        captions[figures[idx].id] = caption
+
+    timeout = budget(CAPTION_DEADLINE_SHARE)
+    out_of_time = timeout is not None and timeout < MIN_CAPTION_SECONDS
+    if not out_of_time:
+        try:
+            results = await asyncio.wait_for(
+                vlm_handler.generate_captions(
+                    text_content, images, contexts, on_caption
+                ),
+                timeout,
+            )
+            for figure, caption in zip(figures, results):
+                if caption is not None:
+                    captions[figure.id] = caption
+        except asyncio.TimeoutError:
+            out_of_time = True
+
+    captioned = []
+    original = dropped = 0
+    for figure in figures:
+        caption = captions.get(figure.id)
+        entry = index.get(figure.name)
+        if caption is None and entry and entry.caption:
+            # Not cached in ``captions``: a later run may still use the VLM
+            caption = entry.caption
+            original += 1
+        if caption is None:
+            logger.warning(f"Dropping figure {figure.path}: no caption")
+            dropped += 1
+            continue
+        captioned.append(figure.with_caption(caption))
+    if original:
+        degrade(f"used the paper's own captions for {original} figures")
+    if out_of_time and dropped:
+        degrade(f"dropped {dropped} figures the VLM had no time to caption")
+    return captioned
+
+
 def download_image(url: str) -> bytes:
     """Download image from URL."""
+    import requests
+
     response = requests.get(url)
     response.raise_for_status()
     return response.content
@@ -126,7 +278,22 @@ def download_image(url: str) -> bytes:
 
 def save_image(image_data: bytes, filename: str) -> str:
     """Save image data to file and return the path."""
+    from PIL import Image
+
     image = Image.open(io.BytesIO(image_data))
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     image.save(filename)
     return filename
+
+
+def parse_html(html: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """Parse a webpage into its text and ``(src, alt)`` pairs of its images."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    images = [
+        (img.get("src"), img.get("alt", ""))
+        for img in soup.find_all("img")
+        if img.get("src")
+    ]
+    return soup.get_text(), images
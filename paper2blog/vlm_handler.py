@@ -1,64 +1,214 @@
-import aiohttp
+import os
+import asyncio
 import base64
-from PIL import Image
-import io
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from paper2blog import serialization
+from paper2blog.backends import ModelRouter
+from paper2blog.profiling import section
+
+logger = logging.getLogger(__name__)
+
+CAPTION_INSTRUCTIONS = "Please use Chinese and English both to describe the image with a short sentence like 'This is a figure of ...; 这幅图描述了...' and there should be not '\n' in the sentence"
+
+# Batched captioning: at most this many figures / base64 bytes per request
+DEFAULT_BATCH_SIZE = 4
+DEFAULT_BATCH_BYTES = 6 * 1024 * 1024
+
+
+def _context_text(text_data: str, chunk_size: int = 2000) -> str:
+    # Use the first chunk for context, as it's likely the most relevant
+    return text_data[:chunk_size] + "..." if len(text_data) > chunk_size else text_data
+
+
+def _image_part(image_base64: str) -> Dict[str, Any]:
+    return {
+        "type": "image_url",
+        "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"},
+    }
+
+
+def split_batches(
+    encoded: Sequence[str], max_images: int, max_bytes: int
+) -> List[List[int]]:
+    """Group figure indices into batches bounded by count and base64 size."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    size = 0
+    for idx, data in enumerate(encoded):
+        if current and (len(current) >= max_images or size + len(data) > max_bytes):
+            batches.append(current)
+            current, size = [], 0
+        current.append(idx)
+        size += len(data)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_captions(response: str, count: int) -> List[str]:
+    """Captions from a ``{"captions": [...]}`` reply, in figure order.
+
+    Raises ``ValueError`` unless there is exactly one non-empty caption per
+    figure.
+    """
+    text = response.strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("No JSON object in caption response")
+    data = serialization.loads(text[start : end + 1])
+    items = data.get("captions") if isinstance(data, dict) else None
+    if not isinstance(items, list) or len(items) != count:
+        raise ValueError(f"Expected {count} captions, got {items!r}")
+
+    captions: List[Optional[str]] = [None] * count
+    for position, item in enumerate(items):
+        if isinstance(item, dict):
+            try:
+                idx = int(item.get("figure", position + 1)) - 1
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid figure number in {item!r}") from None
+            caption = item.get("caption")
+        else:
+            idx, caption = position, item
+        if not 0 <= idx < count or not isinstance(caption, str):
+            raise ValueError(f"Invalid caption entry {item!r}")
+        captions[idx] = " ".join(caption.split())
+    if not all(captions):
+        raise ValueError("Missing caption in batch response")
+    return captions
 
 
 class VLMHandler:
-    def __init__(self):
-        self.api_url = "https://api.siliconflow.cn/v1/chat/completions"
-        self.api_key = "sk-mxnvgvluhpyxjpuvjjfevflefhxykpgxvtrqubmvmsytrgbp"  # Consider moving this to environment variables
+    def __init__(
+        self,
+        router: Optional[ModelRouter] = None,
+        batch_size: Optional[int] = None,
+        batch_bytes: Optional[int] = None,
+    ):
+        # Captions use the "caption" stage (SiliconFlow deepseek-vl2 by default,
+        # credentials from VLM_API_KEY / VLM_API_BASE)
+        self.router = router or ModelRouter.from_env()
+        # Set PAPER2BLOG_CAPTION_BATCH_SIZE=1 to caption one figure per request
+        self.batch_size = batch_size or int(
+            os.getenv("PAPER2BLOG_CAPTION_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+        )
+        self.batch_bytes = batch_bytes or int(
+            os.getenv("PAPER2BLOG_CAPTION_BATCH_BYTES", DEFAULT_BATCH_BYTES)
+        )
 
     async def generate_caption(self, text_data: str, image_data: bytes) -> str:
         # Convert image bytes to base64
         image_base64 = base64.b64encode(image_data).decode("utf-8")
 
-        # Chunk the text data into smaller segments (approximately 2000 characters per chunk)
-        chunk_size = 2000
-        text_chunks = [
-            text_data[i : i + chunk_size] for i in range(0, len(text_data), chunk_size)
+        # Prepare the chat messages with shortened context
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"Please describe this image concisely in the context of this excerpt: {_context_text(text_data)}. {CAPTION_INSTRUCTIONS}",
+                    },
+                    _image_part(image_base64),
+                ],
+            }
         ]
 
-        # Use the first chunk for context, as it's likely the most relevant
-        context_text = text_chunks[0] + "..." if len(text_chunks) > 1 else text_data
+        try:
+            return await self.router.complete("caption", messages)
+        except Exception as e:
+            raise Exception(f"API request failed: {e}") from e
+
+    async def generate_captions(
+        self,
+        text_data: str,
+        images: Sequence[bytes],
+        contexts: Optional[Sequence[Optional[str]]] = None,
+        on_caption: Optional[Callable[[int, str], None]] = None,
+    ) -> List[Optional[str]]:
+        """Caption several figures, packing them into multi-image requests.
+
+        ``contexts`` holds figure-local context (the original caption and the
+        paragraphs referring to the figure, see ``figure_index``); figures
+        without one are described against the paper excerpt, which is sent
+        once per batch instead of once per figure. A batch whose reply cannot
+        be parsed falls back to one request per figure; a batch request that
+        fails is not retried. Returns one caption per image, None for figures
+        that failed.
 
-        # Prepare the API payload with shortened context
-        payload = {
-            "model": "deepseek-ai/deepseek-vl2",
-            "messages": [
+        ``on_caption(index, caption)`` is called as soon as each batch is
+        done, so callers keep finished captions if the rest is cancelled.
+        """
+        with section("caption_base64_encode"):
+            encoded = [base64.b64encode(data).decode("utf-8") for data in images]
+        contexts = list(contexts or [None] * len(images))
+        batches = split_batches(encoded, self.batch_size, self.batch_bytes)
+        captions: List[Optional[str]] = [None] * len(images)
+
+        async def run(batch: List[int]) -> None:
+            results = await self._caption_batch(
+                text_data, images, encoded, contexts, batch
+            )
+            for idx, caption in zip(batch, results):
+                captions[idx] = caption
+                if on_caption is not None and caption is not None:
+                    on_caption(idx, caption)
+
+        await asyncio.gather(*(run(batch) for batch in batches))
+        return captions
+
+    async def _caption_batch(
+        self,
+        text_data: str,
+        images: Sequence[bytes],
+        encoded: Sequence[str],
+        contexts: Sequence[Optional[str]],
+        batch: List[int],
+    ) -> List[Optional[str]]:
+        if len(batch) > 1:
+            if all(contexts[idx] for idx in batch):
+                context = "the context given with each figure"
+            else:
+                context = f"this excerpt: {_context_text(text_data)}"
+            content: List[Dict[str, Any]] = [
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"Please describe this image concisely in the context of this excerpt: {context_text}. Please use Chinese and English both to describe the image with a short sentence like 'This is a figure of ...; 这幅图描述了...' and there should be not '\n' in the sentence",
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            },
-                        },
-                    ],
+                    "type": "text",
+                    "text": f"Please describe each of the following {len(batch)} figures concisely in the context of {context}. {CAPTION_INSTRUCTIONS} "
+                    'Reply with JSON only: {"captions": [{"figure": 1, "caption": "..."}, ...]} with one entry per figure, numbered in the order given.',
                 }
-            ],
-        }
-
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-
-        # Make async API request
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                self.api_url, json=payload, headers=headers
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result["choices"][0]["message"]["content"]
-                else:
-                    error_text = await response.text()
-                    raise Exception(
-                        f"API request failed with status {response.status}: {error_text}"
-                    )
+            ]
+            for number, idx in enumerate(batch, 1):
+                label = f"Figure {number}:"
+                if contexts[idx]:
+                    label = f"Figure {number} (context: {contexts[idx]}):"
+                content.append({"type": "text", "text": label})
+                content.append(_image_part(encoded[idx]))
+            # A failed request (rate limit after retries, transport, missing
+            # credentials) is not retried as one request per figure, which
+            # would only multiply the load: the batch stays uncaptioned
+            try:
+                response = await self.router.complete(
+                    "caption", [{"role": "user", "content": content}]
+                )
+            except Exception as e:
+                logger.error(f"Captioning {len(batch)} figures failed: {e}")
+                return [None] * len(batch)
+            try:
+                return parse_batch_captions(response, len(batch))
+            except ValueError as e:
+                logger.warning(
+                    f"Could not parse captions of {len(batch)} figures ({e}), "
+                    "falling back to one request per figure"
+                )
+
+        async def single(idx: int) -> Optional[str]:
+            try:
+                return await self.generate_caption(
+                    contexts[idx] or text_data, images[idx]
+                )
+            except Exception as e:
+                logger.error(f"Captioning figure {idx} failed: {e}")
+                return None
+
+        return list(await asyncio.gather(*(single(idx) for idx in batch)))
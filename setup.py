@@ -5,7 +5,7 @@ setup(
     version="0.1.0",
     packages=find_packages(),
     install_requires=[
-        "fastapi>=0.68.0",
+        "fastapi>=0.100.0",  # First release supporting pydantic 2
         "uvicorn>=0.15.0",
         "python-dotenv>=0.19.0",
         "requests>=2.26.0",
@@ -13,9 +13,11 @@ setup(
         "Pillow>=8.3.0",
         "numpy>=1.21.0",
         "openai>=0.27.0",
-        "pydantic>=1.8.0",
+        "pydantic>=2.0",  # model_dump() in stored metadata, jobs and responses
         "python-multipart>=0.0.5",
         "tabulate>=0.8.9",  # For DataFrame to markdown conversion
+        "orjson>=3.6.0",  # Fast JSON for responses and stored metadata
+        "PyMuPDF>=1.19.0",  # Page counts on upload, in-process extraction
     ],
     extras_require={
         "dev": [
@@ -26,6 +28,11 @@ setup(
             "flake8>=3.9.2",
         ],
     },
+    entry_points={
+        "console_scripts": [
+            "paper2blog=paper2blog.cli:main",
+        ],
+    },
     python_requires=">=3.8",
     author="Peyton",
     author_email="peyton@example.com",
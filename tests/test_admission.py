@@ -0,0 +1,249 @@
+import io
+import asyncio
+from unittest.mock import AsyncMock
+import fitz
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+import main
+from paper2blog.model_types import ConversionResponse
+from paper2blog.admission import (
+    AdmissionController,
+    ConversionCost,
+    Overloaded,
+    estimate_cost,
+)
+from paper2blog.ratelimit import get_limiter
+from paper2blog.storage import PaperStore
+
+
+def _cost(pages=10, tokens=1000):
+    return ConversionCost(pages, 1, tokens)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_estimate_grows_with_pages_and_languages():
+    small = estimate_cost(2)
+    large = estimate_cost(40, languages=2)
+    assert (small.pages, small.figures) == (2, 2)
+    assert (large.pages, large.figures) == (40, 6)
+    assert large.tokens > small.tokens
+    assert estimate_cost(None).pages > 0
+
+
+@pytest.mark.asyncio
+async def test_conversions_queue_in_order_and_start_on_release():
+    controller = AdmissionController(max_inflight=1, max_queue=4)
+    first = _cost()
+    await controller.acquire(first)
+
+    order = []
+
+    async def queued(name):
+        await controller.acquire(_cost())
+        order.append(name)
+
+    waiters = [asyncio.ensure_future(queued(name)) for name in ("a", "b")]
+    await asyncio.sleep(0)
+    assert controller.snapshot()["queued"] == 2
+
+    controller.release(first, seconds=5)
+    await _settle()
+    assert order == ["a"] and controller.inflight == 1
+    controller.release(_cost())
+    await asyncio.gather(*waiters)
+    assert order == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_token_budget_limits_concurrency():
+    controller = AdmissionController(max_inflight=10, max_tokens=1500)
+    await controller.acquire(_cost(tokens=1000))
+    waiter = asyncio.ensure_future(controller.acquire(_cost(tokens=1000)))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    controller.release(_cost(tokens=1000))
+    await waiter
+    assert controller.tokens == 1000
+
+
+def test_zero_disables_a_limit(monkeypatch):
+    monkeypatch.setenv("PAPER2BLOG_ADMISSION_MAX_QUEUE", "0")
+    controller = AdmissionController(max_inflight=0, max_pages=0)
+    assert controller.max_inflight is None and controller.max_pages is None
+    assert controller.max_queue is None
+    assert controller.max_tokens == 300000
+
+
+@pytest.mark.asyncio
+async def test_oversized_conversion_runs_alone():
+    controller = AdmissionController(max_pages=5)
+    await controller.acquire(_cost(pages=50))
+    assert controller.pages == 50
+
+
+@pytest.mark.asyncio
+async def test_full_queue_is_rejected_with_429():
+    controller = AdmissionController(max_inflight=1, max_queue=1)
+    await controller.acquire(_cost())
+    waiter = asyncio.ensure_future(controller.acquire(_cost()))
+    await asyncio.sleep(0)
+
+    work = asyncio.sleep(0)
+    with pytest.raises(Overloaded) as raised:
+        await controller.run(_cost(), work)
+    assert raised.value.status_code == 429 and raised.value.retry_after >= 1
+    assert work.cr_frame is None  # closed, not left un-awaited
+    assert controller.snapshot()["rejected_total"]["queue_full"] == 1
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_is_rejected_with_503():
+    controller = AdmissionController(max_inflight=1, queue_timeout=0.01)
+    await controller.acquire(_cost())
+    with pytest.raises(Overloaded) as raised:
+        await controller.acquire(_cost())
+    assert raised.value.status_code == 503
+    assert controller.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    controller = AdmissionController(max_inflight=1)
+    first = _cost()
+    await controller.acquire(first)
+    waiter = asyncio.ensure_future(controller.acquire(_cost()))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+
+    assert controller.queued == 0
+    controller.release(first)
+    assert controller.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_run_releases_the_slot_when_work_fails():
+    controller = AdmissionController(max_inflight=1)
+
+    async def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await controller.run(_cost(), fail())
+    assert controller.inflight == 0 and controller.tokens == 0
+
+
+def test_overloaded_convert_returns_retry_after(monkeypatch):
+    monkeypatch.setattr(
+        main.admission,
+        "acquire",
+        AsyncMock(side_effect=Overloaded("Too many conversions queued", 429, 7)),
+    )
+    client = TestClient(main.app)
+
+    response = client.post("/convert", data={"url": "https://example.com/paper"})
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+    get_limiter("metrics-test")
+    metrics = client.get("/metrics").json()
+    assert metrics["admission"]["queued"] == 0
+    assert metrics["providers"]["metrics-test"]["retries"] == 0
+
+
+class FakePipeline:
+    def __init__(self):
+        self.calls = []
+
+    async def convert_from_pdf_languages(self, pdf_path, languages, **kwargs):
+        self.calls.append(pdf_path)
+        return {
+            language: ConversionResponse(title="post", language=language)
+            for language in languages
+        }
+
+
+def _pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for _ in range(pages):
+        doc.new_page()
+    return doc.tobytes()
+
+
+def test_uploaded_pdf_is_admitted_by_page_count(tmp_path, monkeypatch):
+    controller = AdmissionController(max_inflight=1)
+    acquire = controller.acquire
+    costs = []
+
+    async def record(cost):
+        costs.append(cost)
+        await acquire(cost)
+
+    monkeypatch.setattr(controller, "acquire", record)
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(main, "store", PaperStore(tmp_path))
+    monkeypatch.setattr(main.app.state, "pipeline", FakePipeline(), raising=False)
+    client = TestClient(main.app)
+
+    response = client.post(
+        "/convert", files={"file": ("paper.pdf", _pdf(3), "application/pdf")}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["title"] == "post"
+    assert costs[0].pages == 3
+    assert controller.inflight == 0
+
+    invalid = client.post(
+        "/convert", files={"file": ("paper.pdf", b"not a pdf", "application/pdf")}
+    )
+    assert invalid.status_code == 400
+
+
+
+@pytest.mark.asyncio
+async def test_duplicate_uploads_share_one_admission_slot(tmp_path, monkeypatch):
+    controller = AdmissionController(max_inflight=1, max_queue=1)
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(main, "store", PaperStore(tmp_path))
+    pipeline = FakePipeline()
+    release = asyncio.Event()
+    convert = pipeline.convert_from_pdf_languages
+
+    async def slow(*args, **kwargs):
+        await release.wait()
+        return await convert(*args, **kwargs)
+
+    pipeline.convert_from_pdf_languages = slow
+    monkeypatch.setattr(main.app.state, "pipeline", pipeline, raising=False)
+    pdf = _pdf(2)
+
+    async def upload():
+        file = UploadFile(io.BytesIO(pdf), filename="paper.pdf")
+        cost = await main.estimate_request_cost(file, ["english"])
+        return await main._convert_paper(
+            file, None, "english", None, None, False, cost
+        )
+
+    tasks = [asyncio.ensure_future(upload()) for _ in range(3)]
+    for _ in range(100):
+        if controller.inflight:
+            break
+        await asyncio.sleep(0.01)
+    await _settle()
+    # One conversion holds the only slot; the duplicates joined it instead of
+    # queueing behind it (or being shed once the queue is full)
+    assert controller.inflight == 1 and controller.queued == 0
+    release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert [r.title for r in results] == ["post"] * 3
+    assert len(pipeline.calls) == 1
+    assert controller.admitted == 1 and controller.inflight == 0
@@ -0,0 +1,53 @@
+import pytest
+from unittest.mock import AsyncMock
+from paper2blog.agent import BlogGenerationAgent
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    agent = BlogGenerationAgent()
+    agent.router.complete = AsyncMock()
+    return agent
+
+
+@pytest.mark.asyncio
+async def test_smooth_transitions_only_rewrites_heads(agent):
+    create = agent.router.complete
+    create.side_effect = ["New head B", "New head C"]
+    sections = ["A1\n\nA2", "B1\n\nB2", "C1"]
+
+    result = await agent.smooth_transitions(sections, tail_chars=2)
+
+    assert result == ["A1\n\nA2", "New head B\n\nB2", "New head C"]
+    assert create.await_count == 2
+    prompts = [call.args[1][0]["content"] for call in create.await_args_list]
+    # Only the tail of the previous section and the head of the next are sent
+    assert "A1" not in prompts[0] and "A2" in prompts[0] and "B2" not in prompts[0]
+
+
+@pytest.mark.asyncio
+async def test_smooth_transitions_keeps_section_on_empty_reply(agent):
+    agent.router.complete.return_value = ""
+
+    result = await agent.smooth_transitions(["A", "B"])
+
+    assert result == ["A", "B"]
+
+
+@pytest.mark.asyncio
+async def test_single_section_needs_no_calls(agent):
+    result = await agent.smooth_transitions(["Only"])
+
+    assert result == ["Only"]
+    agent.router.complete.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_smooth_budget_counts_cjk_tokens(agent):
+    agent.router.complete.return_value = "新开头"
+    head = "稀疏注意力" * 100
+
+    await agent.smooth_transitions(["A", head])
+
+    assert agent.router.complete.await_args.kwargs["max_tokens"] == 1000
@@ -0,0 +1,150 @@
+import json
+import pytest
+from paper2blog import backends
+from paper2blog.backends import (
+    BackendUnavailable,
+    LLMBackend,
+    ModelRouter,
+    OpenAIBackend,
+    StubBackend,
+    default_routes,
+    fit_max_tokens,
+    get_backend,
+    parse_routes,
+)
+from paper2blog.llm_handler import BLOG_RESPONSE_SCHEMA
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+class FailingBackend(LLMBackend):
+    name = "failing"
+
+    def __init__(self, error=RateLimited("429 Too Many Requests")):
+        self.error = error
+        self.calls = 0
+
+    async def complete(self, messages, model, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+def test_parse_routes_keeps_model_tags():
+    assert parse_routes("local:qwen2.5:7b, openai:gpt-4o-mini") == [
+        ("local", "qwen2.5:7b"),
+        ("openai", "gpt-4o-mini"),
+    ]
+    with pytest.raises(ValueError):
+        parse_routes("openai")
+
+
+def test_routes_from_env(monkeypatch):
+    monkeypatch.setenv("PAPER2BLOG_ROUTE_CLASSIFY", "local:small")
+    routes = default_routes()
+    assert routes["classify"] == [("local", "small")]
+    assert ModelRouter(routes).routes_for("outline") == routes["default"]
+
+
+def test_registry_shares_instances():
+    assert get_backend("stub") is get_backend("stub")
+    with pytest.raises(ValueError):
+        get_backend("does-not-exist")
+
+
+@pytest.mark.asyncio
+async def test_router_falls_back_to_next_route():
+    failing = FailingBackend()
+    router = ModelRouter({"default": [(failing, "big"), ("stub", "small")]})
+
+    result = await router.complete("blog", [{"role": "user", "content": "hello"}])
+
+    assert failing.calls == 1
+    assert result.startswith("[stub:small:") and result.endswith("hello")
+
+
+@pytest.mark.asyncio
+async def test_router_raises_when_all_routes_fail():
+    router = ModelRouter({"default": [(FailingBackend(), "a")]})
+    with pytest.raises(RateLimited):
+        await router.complete("blog", [{"role": "user", "content": "x"}])
+
+
+@pytest.mark.asyncio
+async def test_router_does_not_fall_back_on_bugs():
+    stub = FailingBackend(TypeError("bad message"))
+    router = ModelRouter({"default": [(stub, "a"), ("stub", "b")]})
+    with pytest.raises(TypeError):
+        await router.complete("blog", [{"role": "user", "content": "x"}])
+
+
+def test_openai_backend_requires_a_key():
+    with pytest.raises(BackendUnavailable):
+        OpenAIBackend(api_key=None, name="openai")
+    local = OpenAIBackend(base_url="http://localhost:8080/v1", key_optional=True)
+    assert local.client.api_key == "EMPTY"
+
+
+@pytest.mark.asyncio
+async def test_router_skips_backends_that_cannot_be_built(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    backends.register_backend("openai", backends.BACKEND_FACTORIES["openai"])
+    router = ModelRouter(
+        {"default": [("missing", "a"), ("openai", "gpt-4o-mini"), ("stub", "b")]}
+    )
+
+    result = await router.complete("blog", [{"role": "user", "content": "hi"}])
+
+    assert result.startswith("[stub:b:")
+
+
+def test_backend_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        LLMBackend()
+
+
+@pytest.mark.asyncio
+async def test_stub_satisfies_json_schema():
+    response = await StubBackend().complete(
+        [{"role": "user", "content": "x"}],
+        model="m",
+        response_format={"type": "json_schema", "json_schema": BLOG_RESPONSE_SCHEMA},
+    )
+    data = json.loads(response)
+    assert data["title"] == "stub"
+    assert data["sections"] == [] and data["figures"] == []
+
+
+def test_max_tokens_is_clamped_to_the_context_window(monkeypatch):
+    monkeypatch.setitem(backends.MODEL_CONTEXT_TOKENS, "small", 1000)
+    messages = [{"role": "user", "content": "a" * 3200}]
+
+    assert fit_max_tokens(messages, 4000, "small") == 200
+    assert fit_max_tokens(messages, 100, "small") == 100
+    assert fit_max_tokens(messages, None, "small") is None
+    long_prompt = [{"role": "user", "content": "a" * 8000}]
+    assert fit_max_tokens(long_prompt, 4000, "small") == backends.MIN_COMPLETION_TOKENS
+
+
+def test_max_tokens_of_unlisted_models_is_left_alone():
+    paper = [{"role": "user", "content": "a" * 200_000}]
+    assert "gpt-4o-mini" not in backends.MODEL_CONTEXT_TOKENS
+    assert fit_max_tokens(paper, 2000, "gpt-4o-mini") == 2000
+
+
+@pytest.mark.asyncio
+async def test_router_passes_clamped_max_tokens(monkeypatch):
+    monkeypatch.setitem(backends.MODEL_CONTEXT_TOKENS, "small", 1000)
+    backend = StubBackend()
+    seen = []
+
+    async def complete(messages, model, max_tokens=None, **kwargs):
+        seen.append(max_tokens)
+        return "ok"
+
+    monkeypatch.setattr(backend, "complete", complete)
+    router = ModelRouter({"default": [(backend, "small")]})
+    await router.complete("blog", [{"role": "user", "content": "x"}], max_tokens=4000)
+
+    assert seen == [999]
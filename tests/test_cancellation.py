@@ -0,0 +1,124 @@
+import io
+import asyncio
+import pytest
+from PIL import Image
+from unittest.mock import AsyncMock, patch
+from paper2blog.cancellation import ClientDisconnected, run_until_disconnected
+from paper2blog.converter import PaperConverter
+from paper2blog.executors import configure_executors
+from paper2blog.storage import PaperStore
+from paper2blog.utils import store_figure
+
+
+@pytest.fixture(autouse=True)
+def setup_environment():
+    configure_executors(cpu=0)
+    yield
+    configure_executors(None, None)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PaperStore(tmp_path / "data")
+
+
+def _client(disconnect_after: int):
+    checks = 0
+
+    async def is_disconnected():
+        nonlocal checks
+        checks += 1
+        return checks > disconnect_after
+
+    return is_disconnected
+
+
+@pytest.mark.asyncio
+async def test_work_finishes_while_connected():
+    async def work():
+        await asyncio.sleep(0.01)
+        return "post"
+
+    assert await run_until_disconnected(work(), _client(100), 0.001) == "post"
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_work():
+    unwound = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.Event().wait()
+        finally:
+            unwound.set()
+
+    with pytest.raises(ClientDisconnected):
+        await run_until_disconnected(work(), _client(2), 0.001)
+    # The work had finished unwinding before the call returned
+    assert unwound.is_set()
+
+
+@pytest.mark.asyncio
+async def test_broken_watcher_does_not_cancel_work():
+    async def work():
+        await asyncio.sleep(0.01)
+        return "post"
+
+    async def is_disconnected():
+        raise RuntimeError("no connection state")
+
+    assert await run_until_disconnected(work(), is_disconnected, 0.001) == "post"
+
+
+def _figures(store, count):
+    figures = []
+    for n in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (10 + n, 10), color="red").save(buffer, format="PNG")
+        figures.append(store_figure(store, buffer.getvalue(), f"f{n}.png"))
+    return figures
+
+
+@pytest.mark.asyncio
+async def test_cancelled_captioning_keeps_finished_captions(store):
+    converter = PaperConverter(store)
+    figures = _figures(store, 2)
+    first_done = asyncio.Event()
+
+    async def slow_captions(text, images, contexts=None, on_caption=None):
+        # The first batch finishes, the second never does
+        on_caption(0, "First")
+        first_done.set()
+        await asyncio.Event().wait()
+
+    with patch("paper2blog.utils.VLMHandler") as vlm:
+        vlm.return_value.generate_captions = slow_captions
+        task = asyncio.create_task(converter.caption("text", figures, paper_id="p"))
+        await first_done.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert store.load_stage("p", "captions") == {figures[0].id: "First"}
+
+    with patch("paper2blog.utils.VLMHandler") as vlm:
+        vlm.return_value.generate_captions = AsyncMock(return_value=["Second"])
+        captioned = await converter.caption("text", figures, paper_id="p")
+        # Only the figure without a cached caption is sent again
+        assert len(vlm.return_value.generate_captions.await_args.args[1]) == 1
+    assert [f.caption for f in captioned] == ["First", "Second"]
+
+
+@pytest.mark.asyncio
+async def test_extraction_is_cached_per_paper(store):
+    converter = PaperConverter(store)
+    figures = _figures(store, 1)
+    extract = AsyncMock(return_value=("# Paper", figures))
+
+    with patch("paper2blog.converter.extract_uncaptioned_content", extract):
+        first = await converter.extract("paper.pdf", "pymupdf", paper_id="p")
+        second = await converter.extract("paper.pdf", "pymupdf", paper_id="p")
+        await converter.extract("paper.pdf", "marker", paper_id="p")
+
+    assert extract.await_count == 2
+    assert first == second == ("# Paper", figures)
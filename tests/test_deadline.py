@@ -0,0 +1,199 @@
+import io
+import asyncio
+import pytest
+from PIL import Image
+from unittest.mock import AsyncMock
+from paper2blog import deadline as deadline_module
+from paper2blog import utils
+from paper2blog.deadline import (
+    DeadlineExceeded,
+    budget,
+    current_deadline,
+    deadline_scope,
+    degradations,
+    degrade,
+)
+from paper2blog.executors import configure_executors
+from paper2blog.extractors import AutoEngine, ExtractionResult
+from paper2blog.llm_handler import LLMHandler
+from paper2blog.model_types import ConversionResponse
+from paper2blog.pipeline import ConversionPipeline
+from paper2blog.storage import PaperStore
+from paper2blog.vlm_handler import VLMHandler
+
+MARKDOWN = "# Method\n\n![Figure 1: The router.](./_page_1_Figure_0.png)\n"
+
+
+@pytest.fixture(autouse=True)
+def setup_environment():
+    configure_executors(cpu=0)
+    yield
+    configure_executors(None, None)
+
+
+def _figure(store, name, width=10):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, 10), color="red").save(buffer, format="PNG")
+    return utils.store_figure(store, buffer.getvalue(), name)
+
+
+def test_budget_and_degradations_follow_the_scope():
+    assert budget(0.5, cap=30) == 30 and current_deadline() is None
+    degrade("ignored without a deadline")
+
+    with deadline_scope(100) as deadline:
+        assert 49 < budget(0.5) <= 50
+        assert budget(0.5, cap=10) == 10
+        degrade("used PyMuPDF")
+        degrade("used PyMuPDF")
+        with deadline_scope(0):
+            assert current_deadline() is None
+        assert current_deadline() is deadline
+        assert degradations() == ["used PyMuPDF"]
+    assert current_deadline() is None
+
+
+@pytest.mark.asyncio
+async def test_low_budget_skips_marker():
+    primary, fallback = AsyncMock(), AsyncMock()
+    primary.name, fallback.name = "marker", "pymupdf"
+    fallback.extract.return_value = ExtractionResult("text", [], "pymupdf")
+    engine = AutoEngine(primary=primary, fallback=fallback)
+
+    with deadline_scope(deadline_module.LOW_BUDGET_SECONDS - 1):
+        result = await engine.extract("paper.pdf")
+        assert degradations() == ["skipped marker extraction, used pymupdf"]
+    assert result.engine == "pymupdf"
+    primary.extract.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_no_time_for_captions_keeps_original_captions(tmp_path):
+    store = PaperStore(tmp_path)
+    figures = [_figure(store, "_page_1_Figure_0.png")]
+    vlm = AsyncMock()
+
+    with deadline_scope(5):
+        captioned = await utils.caption_figures(MARKDOWN, figures, vlm)
+        assert degradations() == ["used the paper's own captions for 1 figures"]
+    assert [f.caption for f in captioned] == ["Figure 1: The router."]
+    vlm.generate_captions.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_caption_timeout_keeps_finished_captions(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "MIN_CAPTION_SECONDS", 0)
+    store = PaperStore(tmp_path)
+    figures = [_figure(store, "a.png"), _figure(store, "_page_1_Figure_0.png", 20)]
+
+    async def slow(text, images, contexts=None, on_caption=None):
+        on_caption(0, "VLM caption")
+        await asyncio.Event().wait()
+
+    vlm = AsyncMock()
+    vlm.generate_captions = slow
+    captions = {}
+    with deadline_scope(0.2):
+        captioned = await utils.caption_figures(MARKDOWN, figures, vlm, captions)
+    assert [f.caption for f in captioned] == ["VLM caption", "Figure 1: The router."]
+    # Only the VLM caption is cached
+    assert captions == {figures[0].id: "VLM caption"}
+
+
+@pytest.mark.asyncio
+async def test_vlm_failure_keeps_original_captions(tmp_path):
+    class RateLimited(Exception):
+        status_code = 429
+
+    store = PaperStore(tmp_path)
+    figures = [
+        _figure(store, "_page_1_Figure_0.png"),
+        _figure(store, "b.png", 20),
+        _figure(store, "c.png", 30),
+    ]
+    router = AsyncMock()
+    router.complete.side_effect = RateLimited("slow down")
+
+    with deadline_scope(600):
+        captioned = await utils.caption_figures(
+            MARKDOWN, figures, VLMHandler(router=router, batch_size=4)
+        )
+        assert degradations() == ["used the paper's own captions for 1 figures"]
+    # The paper's text and the captionable figure survive the failed batch
+    assert [f.caption for f in captioned] == ["Figure 1: The router."]
+    router.complete.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_uncaptioned_figures_are_dropped_with_a_warning(tmp_path, caplog):
+    store = PaperStore(tmp_path)
+    figures = [_figure(store, "a.png")]
+    vlm = AsyncMock()
+    vlm.generate_captions.return_value = [None]
+
+    with caplog.at_level("WARNING", logger="paper2blog.utils"):
+        assert await utils.caption_figures(MARKDOWN, figures, vlm) == []
+    assert "no caption" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_completion_timeout_and_fast_route():
+    async def hang(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    handler = LLMHandler(router=AsyncMock())
+    handler.router.complete = hang
+    with deadline_scope(0.05):
+        with pytest.raises(DeadlineExceeded):
+            await handler.translate_title("paper", "english")
+
+    handler.router = AsyncMock()
+    handler.router.complete.return_value = '{"title": "T"}'
+    with deadline_scope(deadline_module.LOW_BUDGET_SECONDS - 1):
+        blog = await handler.generate_blog_post("paper", "english")
+        assert degradations() == ["wrote the blog with the fast model route"]
+    assert blog.title == "T"
+    assert handler.router.complete.await_args.args[0] == "blog_fast"
+
+
+class DeadlineConverter:
+    """Reports the deadline and degradations seen by the stages."""
+
+    def __init__(self):
+        self.seen = []
+
+    async def extract(self, pdf_path, engine=None, include_appendix=False, **kw):
+        self.seen.append(current_deadline())
+        degrade("used PyMuPDF")
+        return "text", []
+
+    async def select(self, figures):
+        return figures
+
+    async def caption(self, text_content, figures, paper_id=None):
+        return figures
+
+    async def generate_languages(self, text_content, languages, images):
+        self.seen.append(current_deadline())
+        return {
+            language: ConversionResponse(
+                language=language, degradations=degradations()
+            )
+            for language in languages
+        }
+
+
+@pytest.mark.asyncio
+async def test_pipeline_stages_run_under_the_callers_deadline():
+    converter = DeadlineConverter()
+    pipeline = ConversionPipeline(converter)
+    try:
+        with deadline_scope(100) as deadline:
+            result = await pipeline.convert_from_pdf("a.pdf", "english")
+        assert converter.seen == [deadline, deadline]
+        assert result.degradations == ["used PyMuPDF"]
+
+        await pipeline.convert_from_pdf("b.pdf", "english")
+        assert converter.seen[2:] == [None, None]
+    finally:
+        await pipeline.stop()
@@ -0,0 +1,41 @@
+import os
+import threading
+import pytest
+from paper2blog import executors
+from paper2blog.executors import configure_executors, run_cpu, run_io
+from paper2blog.utils import parse_html
+
+
+@pytest.fixture(autouse=True)
+def reset_executors():
+    yield
+    configure_executors(None, None)
+
+
+@pytest.mark.asyncio
+async def test_run_io_uses_worker_thread():
+    configure_executors(io=2, cpu=0)
+    name = await run_io(lambda: threading.current_thread().name)
+    assert name.startswith("paper2blog-io")
+    assert executors.get_io_executor()._max_workers == 2
+
+
+@pytest.mark.asyncio
+async def test_run_cpu_uses_worker_process():
+    configure_executors(cpu=1)
+    assert await run_cpu(os.getpid) != os.getpid()
+
+
+@pytest.mark.asyncio
+async def test_run_cpu_falls_back_to_threads():
+    configure_executors(cpu=0)
+    assert await run_cpu(os.getpid) == os.getpid()
+
+
+@pytest.mark.asyncio
+async def test_parse_html_in_process_pool():
+    configure_executors(cpu=1)
+    html = '<p>Hello</p><img src="a.png" alt="Fig A"><img alt="no src">'
+    text, images = await run_cpu(parse_html, html)
+    assert "Hello" in text
+    assert images == [("a.png", "Fig A")]
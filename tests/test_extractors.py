@@ -0,0 +1,203 @@
+import io
+import pytest
+import fitz
+from PIL import Image
+from paper2blog import extractors
+from paper2blog.executors import configure_executors
+from paper2blog.extractors import (
+    AutoEngine,
+    MarkerEngine,
+    PyMuPDFEngine,
+    extract_pdf_with_pymupdf,
+    find_back_matter_page,
+    get_engine,
+    is_born_digital,
+    page_count_from_bytes,
+    split_pages,
+)
+
+
+def _png(size, color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def paper_pdf(tmp_path):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((50, 60), "A Fast Method", fontsize=24)
+    page.insert_text((50, 100), "1 Introduction", fontsize=14)
+    y = 130
+    for _ in range(8):
+        page.insert_text((50, y), "Body text about the method and its results.", fontsize=10)
+        y += 14
+    page.insert_image(fitz.Rect(100, 260, 400, 460), stream=_png((300, 200)))
+    page.insert_text((50, 480), "Figure 1: Overview of the method.", fontsize=10)
+    # Small icons are filtered out
+    page.insert_image(fitz.Rect(10, 10, 30, 30), stream=_png((20, 20), "blue"))
+    path = tmp_path / "paper.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def in_process_cpu_pool():
+    configure_executors(cpu=0)
+    yield
+    configure_executors(None, None)
+
+
+def test_pymupdf_headings_figures_and_captions(paper_pdf):
+    blocks, images = extract_pdf_with_pymupdf(paper_pdf)
+
+    assert blocks[0] == "# A Fast Method"
+    assert blocks[1] == "## 1 Introduction"
+    assert len(images) == 1
+    name, data = images[0]
+    assert name.startswith("_page_0_Figure_0") and data
+    assert f"![Figure 1: Overview of the method.]({name})" in blocks
+
+
+def test_is_born_digital(paper_pdf, tmp_path):
+    assert is_born_digital(paper_pdf, min_chars=100)
+    doc = fitz.open()
+    doc.new_page().insert_image(fitz.Rect(0, 0, 300, 300), stream=_png((300, 300)))
+    scanned = str(tmp_path / "scan.pdf")
+    doc.save(scanned)
+    assert not is_born_digital(scanned)
+
+
+@pytest.mark.asyncio
+async def test_pymupdf_engine_respects_max_images(paper_pdf):
+    result = await PyMuPDFEngine().extract(paper_pdf, max_images=0)
+    assert result.engine == "pymupdf"
+    assert result.images == []
+    assert "A Fast Method" in result.markdown
+
+
+@pytest.mark.asyncio
+async def test_auto_engine_falls_back_when_marker_is_down(paper_pdf):
+    engine = AutoEngine(primary=MarkerEngine(url="http://127.0.0.1:9/marker", timeout=1))
+    result = await engine.extract(paper_pdf)
+    assert result.engine == "pymupdf"
+    assert len(result.images) == 1
+
+
+def test_get_engine(monkeypatch):
+    assert get_engine("pymupdf").name == "pymupdf"
+    monkeypatch.setenv("PAPER2BLOG_EXTRACTION_ENGINE", "marker")
+    assert get_engine().name == "marker"
+    with pytest.raises(ValueError):
+        get_engine("ocr")
+
+
+def test_page_count_from_bytes(paper_pdf, monkeypatch):
+    with open(paper_pdf, "rb") as f:
+        assert page_count_from_bytes(f.read()) == 1
+    assert page_count_from_bytes(b"not a pdf") is None
+    assert page_count_from_bytes(b"") is None
+
+    def missing():
+        raise ImportError("No module named 'pymupdf'")
+
+    # A missing install is not mistaken for an invalid upload
+    monkeypatch.setattr(extractors, "_fitz", missing)
+    with pytest.raises(ImportError):
+        page_count_from_bytes(b"%PDF-1.4")
+
+
+def test_split_pages():
+    assert split_pages(60, 4) == [(0, 15), (15, 30), (30, 45), (45, 60)]
+    assert split_pages(10, 4) == [(0, 5), (5, 10)]
+    assert split_pages(2, 8) == [(0, 2)]
+
+
+@pytest.mark.asyncio
+async def test_parallel_extraction_matches_serial(tmp_path):
+    doc = fitz.open()
+    for idx in range(12):
+        page = doc.new_page()
+        page.insert_text((50, 60), f"Section {idx}", fontsize=16)
+        page.insert_text((50, 100), "Body text " * 8, fontsize=10)
+        # The same logo on every page must only be extracted once
+        page.insert_image(fitz.Rect(100, 200, 300, 400), stream=_png((200, 200)))
+        page.insert_image(
+            fitz.Rect(100, 420, 300, 620), stream=_png((200, 200 + idx), "green")
+        )
+    path = str(tmp_path / "long.pdf")
+    doc.save(path)
+
+    configure_executors(cpu=2)
+    parallel = await PyMuPDFEngine(workers=3).extract(path)
+    serial_blocks, serial_images = extract_pdf_with_pymupdf(path)
+
+    assert parallel.markdown == "\n\n".join(serial_blocks)
+    assert [name for name, _ in parallel.images] == [name for name, _ in serial_images]
+    assert len(parallel.images) == 13
+
+
+@pytest.fixture
+def paper_with_appendix(tmp_path):
+    doc = fitz.open()
+    sections = [
+        ("1 Introduction", None),
+        ("2 Method", "red"),
+        ("References", None),
+        ("A Appendix", "green"),
+    ]
+    for heading, figure_color in sections:
+        page = doc.new_page()
+        page.insert_text((50, 60), heading, fontsize=14)
+        y = 90
+        for _ in range(6):
+            page.insert_text((50, y), f"Body text of the {heading} page.", fontsize=10)
+            y += 14
+        if figure_color:
+            page.insert_image(
+                fitz.Rect(100, 200, 400, 400), stream=_png((300, 200), figure_color)
+            )
+    path = tmp_path / "appendix.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def test_find_back_matter_page(paper_with_appendix, paper_pdf):
+    assert find_back_matter_page(paper_with_appendix) == 2
+    assert find_back_matter_page(paper_pdf) is None
+
+
+def test_back_matter_mentions_in_the_body_are_ignored(tmp_path):
+    doc = fitz.open()
+    for page_no in range(4):
+        page = doc.new_page()
+        page.insert_text((50, 60), f"{page_no + 1} Section", fontsize=14)
+        y = 90
+        for _ in range(6):
+            page.insert_text((50, y), "Body text of the paper.", fontsize=10)
+            y += 14
+        # Body-sized run-in mention and a table cell, both past the middle
+        page.insert_text((50, y), "References to prior work: Section 2.", fontsize=10)
+        page.insert_text((50, y + 14), "Appendix", fontsize=10)
+    # A heading-sized "References" before the middle is not the back matter
+    doc[0].insert_text((50, 300), "References", fontsize=14)
+    path = tmp_path / "mentions.pdf"
+    doc.save(str(path))
+    doc.close()
+
+    assert find_back_matter_page(str(path)) is None
+
+
+@pytest.mark.asyncio
+async def test_page_limit_skips_back_matter(paper_with_appendix):
+    engine = PyMuPDFEngine()
+    result = await engine.extract(paper_with_appendix, page_limit=3)
+    assert "2 Method" in result.markdown
+    assert "Appendix" not in result.markdown
+    assert [name for name, _ in result.images] == ["_page_1_Figure_0.png"]
+
+    figures = await engine.extract_figures(paper_with_appendix, 3)
+    assert [name for name, _ in figures] == ["_page_3_Figure_0.png"]
@@ -0,0 +1,100 @@
+import json
+import pytest
+from unittest.mock import AsyncMock
+from paper2blog.figure_index import FigureIndex
+from paper2blog.llm_handler import LLMHandler
+from paper2blog.records import FigureRecord
+from paper2blog.vlm_handler import VLMHandler
+
+MARKDOWN = """# Abstract
+
+We study sparse attention.
+
+# 1 Introduction
+
+As Figure 2 shows, dense attention is slow.
+
+# 3 Method
+
+![Figure 1: Overview of the model [12].](./_page_2_Figure_0.png)
+
+The encoder (Fig. 1) feeds a router, see also Figure 2.
+
+![](_page_3_Figure_1.png)
+
+Figure 2: Latency against sequence length.
+
+![](_page_4_Figure_2.png)
+
+Figure 3 is never captioned here.
+"""
+
+
+def test_index_maps_images_to_captions_and_references():
+    index = FigureIndex.build(MARKDOWN)
+
+    overview = index.get("figures/ab/_page_2_Figure_0.png")
+    assert overview.label == "Figure 1"
+    assert overview.caption == "Figure 1: Overview of the model [12]."
+    assert overview.section == "3 Method"
+    assert [p for _, p in overview.references] == [
+        "The encoder (Fig. 1) feeds a router, see also Figure 2."
+    ]
+
+    # Caption in the following paragraph; referenced before it appears
+    latency = index.get("_page_3_Figure_1.png")
+    assert latency.number == 2
+    assert latency.caption == "Figure 2: Latency against sequence length."
+    assert [s for s, _ in latency.references] == ["1 Introduction", "3 Method"]
+    assert latency.placement_hint() == (
+        'Figure 2 in the paper; discussed in "1 Introduction", "3 Method"'
+    )
+
+    uncaptioned = index.get("_page_4_Figure_2.png")
+    assert uncaptioned.label == "" and uncaptioned.references == []
+    assert index.context_for("missing.png") == ""
+    assert len(index) == 3
+
+
+def test_context_is_bounded():
+    index = FigureIndex.build(MARKDOWN)
+    context = index.context_for("_page_3_Figure_1.png", max_chars=50)
+    assert context.startswith("Figure 2: Latency") and len(context) == 53
+
+
+@pytest.mark.asyncio
+async def test_captions_use_figure_local_context():
+    router = AsyncMock()
+    router.complete = AsyncMock(return_value=json.dumps({"captions": ["A", "B"]}))
+    handler = VLMHandler(router=router, batch_size=4, batch_bytes=10**6)
+    contexts = ["Figure 1: Overview", "Figure 2: Latency"]
+
+    assert await handler.generate_captions("x" * 5000, [b"a", b"b"], contexts) == [
+        "A",
+        "B",
+    ]
+
+    content = router.complete.await_args.args[1][0]["content"]
+    texts = [p["text"] for p in content if p["type"] == "text"]
+    # The paper excerpt is not sent when every figure has its own context
+    assert not any("xxx" in text for text in texts)
+    assert "Figure 1 (context: Figure 1: Overview):" in texts
+    assert "Figure 2 (context: Figure 2: Latency):" in texts
+
+
+def test_prompt_carries_placement_hints():
+    handler = LLMHandler(router=AsyncMock())
+    images = [
+        FigureRecord(
+            "a", "figures/a.png", caption="Latency plot", name="_page_3_Figure_1.png"
+        ),
+        FigureRecord("b", "figures/b.png", caption="Logo", name="other.png"),
+    ]
+
+    formatted = handler._format_images(images, FigureIndex.build(MARKDOWN))
+
+    assert formatted.split("\n\n") == [
+        "Figure 1: Latency plot "
+        '(Figure 2 in the paper; discussed in "1 Introduction", "3 Method")',
+        "Figure 2: Logo",
+    ]
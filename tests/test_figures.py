@@ -0,0 +1,127 @@
+import io
+import os
+import time
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+import main
+from paper2blog import figures
+from paper2blog.figures import FigureVariants, snap_width
+from paper2blog.storage import PaperStore
+
+
+def _png(width: int, height: int) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(out, "PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PaperStore(tmp_path)
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    monkeypatch.setattr(main, "figure_variants", FigureVariants(store))
+    return TestClient(main.app)
+
+
+def test_widths_round_up_to_variant_sizes():
+    assert snap_width(0) == 0
+    assert snap_width(100) == 320
+    assert snap_width(640) == 640
+    assert snap_width(641) == 960
+    assert snap_width(10000) == 1920
+
+
+@pytest.mark.asyncio
+async def test_webp_variant_is_resized_and_cached(store, monkeypatch):
+    figure = store.save_figure(_png(2000, 1000), "fig.png")
+    variants = FigureVariants(store)
+
+    path = await variants.get(figure.stem, ".webp", 500)
+
+    assert path == store.variant_path(figure.stem, 640, ".webp")
+    with Image.open(path) as image:
+        assert image.format == "WEBP" and image.size == (640, 320)
+
+    def fail(*args):
+        raise AssertionError("variant rendered twice")
+
+    monkeypatch.setattr(figures, "render_variant", fail)
+    assert await variants.get(figure.stem, ".webp", 600) == path
+
+
+@pytest.mark.asyncio
+async def test_small_figures_are_not_scaled_up(store):
+    figure = store.save_figure(_png(200, 100), "fig.png")
+    path = await FigureVariants(store).get(figure.stem, ".webp", 1280)
+    with Image.open(path) as image:
+        assert image.size == (200, 100)
+
+
+@pytest.mark.asyncio
+async def test_original_and_unknown_figures(store):
+    figure = store.save_figure(_png(20, 10), "fig.png")
+    variants = FigureVariants(store)
+
+    assert await variants.get(figure.stem, ".png") == figure
+    assert await variants.get(figure.stem, ".tiff", 320) is None
+    assert await variants.get("0" * 64, ".webp", 320) is None
+    assert await variants.get("../../etc/passwd", ".webp") is None
+
+
+def test_endpoint_sets_immutable_cache_headers(store, client):
+    figure = store.save_figure(_png(800, 400), "fig.png")
+
+    response = client.get(f"/figures/{figure.stem}.webp?w=320")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+
+    cached = client.get(
+        f"/figures/{figure.stem}.webp?w=320", headers={"If-None-Match": etag}
+    )
+    assert cached.status_code == 304 and not cached.content
+    assert client.get(f"/figures/{'0' * 64}.webp").status_code == 404
+    assert client.get(f"/figures/{figure.stem}.webp?w=-1").status_code == 400
+
+
+def test_gc_drops_variants_of_removed_figures(store):
+    kept = store.save_figure(b"kept", "kept.png")
+    kept_variant = store.variant_path(kept.stem, 320, ".webp")
+    orphan = store.variant_path("f" * 64, 320, ".webp")
+    for path in (kept_variant, orphan):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"variant")
+
+    stats = store.gc(now=time.time())
+
+    assert stats["variants"] == 1
+    assert kept_variant.exists() and not orphan.exists()
+
+
+def test_gc_counts_variants_and_sheds_them_before_papers(store):
+    paper_id, _ = store.save_paper(b"p" * 1000)
+    figure = store.save_figure(b"f" * 1000, "fig.png")
+    store.save_conversion(
+        paper_id, "en", "# blog", {"figures": [store.relative(figure)]}
+    )
+    old = store.variant_path(figure.stem, 320, ".webp")
+    new = store.variant_path(figure.stem, 640, ".webp")
+    for path, age in ((old, 7200), (new, 0)):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"v" * 1000)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    usage = store.gc()["usage_bytes"]
+    stats = store.gc(max_bytes=usage - 500)
+
+    assert stats["variants"] == 1 and stats["papers"] == 0
+    assert stats["freed_bytes"] == 1000
+    assert not old.exists() and new.exists()
+    assert store.paper_dir(paper_id).exists()
@@ -0,0 +1,67 @@
+import os
+import re
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported when the code path needing them runs
+HEAVY_MODULES = (
+    "numpy",
+    "PIL",
+    "requests",
+    "bs4",
+    "openai",
+    "fitz",
+    "pymupdf",
+    "redis",
+    "fastapi",
+    "dotenv",
+)
+
+# Cumulative import time budget for ``paper2blog.converter`` (pydantic models
+# and asyncio dominate); raise deliberately when adding import-time work
+IMPORT_BUDGET_US = int(os.getenv("PAPER2BLOG_IMPORT_BUDGET_US", 1_500_000))
+
+
+def _run(code, cwd):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+@pytest.mark.parametrize(
+    "module", ["paper2blog", "paper2blog.converter", "paper2blog.pipeline"]
+)
+def test_import_does_not_load_heavy_modules(module, tmp_path):
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = _run(code, tmp_path)
+    assert result.stdout.strip() == ""
+    # No log files or data directories created as a side effect
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_package_import_is_lazy(tmp_path):
+    result = _run(
+        "import sys, paper2blog; print('pydantic' in sys.modules); "
+        "paper2blog.PaperConverter; print('paper2blog.converter' in sys.modules)",
+        tmp_path,
+    )
+    assert result.stdout.split() == ["False", "True"]
+
+
+def test_converter_import_budget(tmp_path):
+    result = _run("import paper2blog.converter", tmp_path)
+    times = re.findall(r"\|\s*(\d+) \| paper2blog\.converter$", result.stderr, re.M)
+    assert times, result.stderr[-500:]
+    assert int(times[-1]) < IMPORT_BUDGET_US
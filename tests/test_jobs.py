@@ -0,0 +1,139 @@
+import io
+import time
+import pytest
+import fitz
+from PIL import Image
+from unittest.mock import AsyncMock, patch
+from paper2blog.converter import PaperConverter
+from paper2blog.executors import configure_executors
+from paper2blog.jobs import JobStore, JobWorker, job_status
+from paper2blog.model_types import BlogSection, GeneratedBlog
+from paper2blog.storage import PaperStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture(autouse=True)
+def setup_environment(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    configure_executors(cpu=0)
+    yield
+    configure_executors(None, None)
+
+
+@pytest.fixture
+def jobs():
+    return JobStore(fakeredis.FakeAsyncRedis(decode_responses=True))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PaperStore(tmp_path / "data")
+
+
+@pytest.fixture
+def paper(store):
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 200), color="red").save(buffer, format="PNG")
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((50, 60), "1 Introduction", fontsize=14)
+    page.insert_text((50, 90), "Body text about the method.", fontsize=10)
+    page.insert_image(fitz.Rect(100, 200, 400, 400), stream=buffer.getvalue())
+    paper_id, pdf_path = store.save_paper(doc.tobytes())
+    doc.close()
+    return paper_id, pdf_path
+
+
+def _params(store, paper):
+    paper_id, pdf_path = paper
+    return {
+        "paper_id": paper_id,
+        "pdf_path": store.relative(pdf_path),
+        "filename": "paper.pdf",
+        "language": "english",
+        "engine": "pymupdf",
+    }
+
+
+@pytest.mark.asyncio
+async def test_submit_deduplicates_identical_jobs(jobs):
+    first, created = await jobs.submit({"paper_id": "a"}, dedup_key="k")
+    second, joined = await jobs.submit({"paper_id": "a"}, dedup_key="k")
+    assert created and not joined
+    assert first == second
+    assert (await jobs.queue_lengths())["extract"] == 1
+
+    # A failed job is replaced by a new one
+    await jobs.fail(first, "boom")
+    third, created = await jobs.submit({"paper_id": "a"}, dedup_key="k")
+    assert created and third != first
+
+
+@pytest.mark.asyncio
+async def test_workers_run_stages_by_capability(jobs, store, paper):
+    converter = PaperConverter(store)
+    converter.llm_handler.generate_blog_post = AsyncMock(
+        return_value=GeneratedBlog(
+            title="Blog", sections=[BlogSection(heading="Intro", content="Text.")]
+        )
+    )
+    marker_worker = JobWorker(jobs, ["marker"], store=store)
+    model_worker = JobWorker(jobs, ["vlm", "llm"], store=store, converter=converter)
+
+    job_id, _ = await jobs.submit(_params(store, paper))
+    # Nothing queued for the model worker until extraction has run
+    assert not await model_worker.run_once(timeout=0.1)
+    assert await marker_worker.run_once(timeout=1)
+
+    job = await jobs.get(job_id)
+    assert job["stage"] == "caption" and job["status"] == "queued"
+    assert "Introduction" in job["text"]
+    assert len(job["images"]) == 1
+    assert not job["images"][0]["path"].startswith("/")
+    assert (job["images"][0]["width"], job["images"][0]["height"]) == (300, 200)
+    assert not await marker_worker.run_once(timeout=0.1)
+
+    with patch("paper2blog.utils.VLMHandler") as vlm:
+        vlm.return_value.generate_captions = AsyncMock(return_value=["A red box"])
+        assert await model_worker.run_once(timeout=1)
+    assert await model_worker.run_once(timeout=1)
+
+    status = job_status(await jobs.get(job_id))
+    assert status.status == "done"
+    assert status.result.title == "Blog"
+    assert status.result.images[0].caption == "A red box"
+    assert (store.conversion_dir(paper[0], "english") / "blog.md").exists()
+    assert status.result.conversion_id == f"{paper[0]}-english"
+    assert store.load_extraction(paper[0])["figures"][0]["caption"] == "A red box"
+    assert "text" not in await jobs.get(job_id)
+
+
+@pytest.mark.asyncio
+async def test_stage_errors_fail_the_job(jobs, store):
+    worker = JobWorker(jobs, ["marker"], store=store)
+    job_id, _ = await jobs.submit(
+        {"paper_id": "x", "pdf_path": "missing.pdf", "language": "english"}
+    )
+    assert await worker.run_once(timeout=1)
+    job = await jobs.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"].startswith("Error in extract stage")
+
+
+@pytest.mark.asyncio
+async def test_requeue_stale_jobs(jobs):
+    job_id, _ = await jobs.submit({"paper_id": "a"})
+    stage, job = await jobs.claim(["marker"], timeout=1)
+    assert stage == "extract" and job["status"] == "running"
+
+    assert await jobs.requeue_stale(max_age=60) == []
+    await jobs.redis.zadd(jobs._running_key, {job_id: time.time() - 120})
+    assert await jobs.requeue_stale(max_age=60) == [job_id]
+    assert (await jobs.get(job_id))["status"] == "queued"
+    assert (await jobs.queue_lengths())["extract"] == 1
+
+
+def test_unknown_capability(jobs):
+    with pytest.raises(ValueError):
+        JobWorker(jobs, ["gpu"])
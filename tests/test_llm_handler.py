@@ -0,0 +1,84 @@
+import json
+import pytest
+from unittest.mock import AsyncMock
+from paper2blog.llm_handler import LLMHandler
+from paper2blog.model_types import GeneratedBlog, ImageInfo
+
+
+@pytest.fixture(autouse=True)
+def setup_environment(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+
+
+@pytest.fixture
+def images():
+    return [
+        ImageInfo(caption="Architecture", url="https://example.com/a.png", markdown=""),
+        ImageInfo(caption="Results", url="https://example.com/b.png", markdown=""),
+    ]
+
+
+@pytest.fixture
+def structured_response():
+    return json.dumps(
+        {
+            "title": "Fast Attention",
+            "sections": [
+                {"heading": "Background", "content": "First.\n\nSecond."},
+                {"heading": "Method", "content": "Only paragraph."},
+            ],
+            "summary": "It is fast.",
+            "tags": ["attention", "efficiency"],
+            "figures": [
+                {"figure": 1, "section": 0, "paragraph": 0, "caption": ""},
+                {"figure": 2, "section": 1, "paragraph": -1, "caption": "Fig 2"},
+            ],
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_generate_blog_post_structured(images, structured_response):
+    handler = LLMHandler()
+    handler._generate_completion = AsyncMock(return_value=structured_response)
+
+    blog = await handler.generate_blog_post("paper text", "en", images)
+
+    assert isinstance(blog, GeneratedBlog)
+    assert blog.title == "Fast Attention"
+    assert [s.heading for s in blog.sections] == ["Background", "Method"]
+    assert blog.tags == ["attention", "efficiency"]
+    kwargs = handler._generate_completion.call_args.kwargs
+    assert kwargs["response_format"]["type"] == "json_schema"
+
+
+def test_render_places_figures(images, structured_response):
+    handler = LLMHandler()
+    blog = handler._parse_blog(structured_response)
+
+    markdown = handler.render_blog(blog, images, "en")
+
+    assert markdown.startswith("# Fast Attention\n")
+    assert "First.\n\n![Architecture](https://example.com/a.png)\n\nSecond." in markdown
+    assert "Only paragraph.\n\n![Fig 2](https://example.com/b.png)" in markdown
+    assert markdown.rstrip().endswith("## Summary\n\nIt is fast.")
+
+
+def test_parse_falls_back_to_markdown():
+    handler = LLMHandler()
+    blog = handler._parse_blog("# Title\n\n## Intro\n\nHello\n\n## Summary\n\nDone")
+
+    assert blog.title == "Title"
+    assert blog.sections[0].heading == "Intro"
+    assert blog.sections[0].content == "Hello"
+    assert blog.summary == "Done"
+
+
+def test_markdown_fallback_keeps_text_before_first_heading():
+    handler = LLMHandler()
+    blog = handler._parse_blog("# Title\n\nOpening words.\n\n## Method\n\nA router.")
+
+    assert [s.heading for s in blog.sections] == ["", "Method"]
+    assert blog.sections[0].content == "Opening words."
+    markdown = handler.render_blog(blog, [], "en")
+    assert markdown.startswith("# Title\n\nOpening words.\n\n## Method\n\nA router.")
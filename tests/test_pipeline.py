@@ -0,0 +1,239 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from paper2blog.converter import parse_languages
+from paper2blog.model_types import ConversionResponse
+from paper2blog.records import FigureRecord
+from paper2blog.pipeline import ConversionPipeline
+from paper2blog.scheduling import priority_scope
+from paper2blog.utils import select_figures
+
+
+class FakeConverter:
+    """Stage methods of PaperConverter with controllable extraction."""
+
+    def __init__(self):
+        self.extract_gate = asyncio.Event()
+        self.extract_gate.set()
+        self.calls = []
+
+    async def extract(
+        self, pdf_path, engine=None, include_appendix_figures=False, paper_id=None
+    ):
+        self.calls.append(("extract", pdf_path))
+        await self.extract_gate.wait()
+        if pdf_path == "broken.pdf":
+            raise ValueError("not a PDF")
+        figure = FigureRecord(pdf_path, f"{pdf_path}.png")
+        return f"text of {pdf_path}", [figure, figure]
+
+    async def select(self, figures):
+        self.calls.append(("select", len(figures)))
+        return figures[:1]
+
+    async def caption(self, text_content, figures, paper_id=None):
+        self.calls.append(("caption", text_content))
+        return [figure.with_caption("cap") for figure in figures]
+
+    async def generate_from_content(self, text_content, target_language, images):
+        self.calls.append(("generate", text_content))
+        return ConversionResponse(
+            title=text_content,
+            language=target_language,
+            images=[image.to_image_info() for image in images],
+        )
+
+    async def generate_languages(self, text_content, languages, images):
+        results = [
+            await self.generate_from_content(text_content, language, images)
+            for language in languages
+        ]
+        return dict(zip(languages, results))
+
+    async def save_result(self, paper_id, original_filename, language, result):
+        self.calls.append(("persist", paper_id))
+
+    async def save_extraction(self, paper_id, text_content, images):
+        pass
+
+
+@pytest_asyncio.fixture
+async def pipeline():
+    pipeline = ConversionPipeline(FakeConverter(), queue_size=1)
+    yield pipeline
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_stages_run_in_order(pipeline):
+    result = await pipeline.convert_from_pdf("a.pdf", "english", paper_id="p1")
+
+    assert result.title == "text of a.pdf"
+    assert [img.caption for img in result.images] == ["cap"]
+    assert [name for name, _ in pipeline.converter.calls] == [
+        "extract",
+        "select",
+        "caption",
+        "generate",
+        "persist",
+    ]
+    assert ("select", 2) in pipeline.converter.calls
+    assert ("persist", "p1") in pipeline.converter.calls
+
+
+@pytest.mark.asyncio
+async def test_persist_skipped_without_paper_id(pipeline):
+    await pipeline.convert_from_pdf("a.pdf", "english")
+    assert "persist" not in [name for name, _ in pipeline.converter.calls]
+
+
+@pytest.mark.asyncio
+async def test_extraction_error_short_circuits(pipeline):
+    result = await pipeline.convert_from_pdf("broken.pdf", "english", paper_id="p1")
+    assert result.error == "Error in PDF processing: not a PDF"
+    assert [name for name, _ in pipeline.converter.calls] == ["extract"]
+
+
+@pytest.mark.asyncio
+async def test_backpressure_bounds_queued_work():
+    converter = FakeConverter()
+    converter.extract_gate.clear()
+    pipeline = ConversionPipeline(converter, workers={"extract": 1}, queue_size=1)
+    try:
+        tasks = [
+            asyncio.create_task(pipeline.convert_from_pdf(f"{n}.pdf", "english"))
+            for n in range(4)
+        ]
+        await asyncio.sleep(0.05)
+
+        # One job is being extracted, one waits in the queue and the other
+        # callers are blocked in submit
+        stats = pipeline.stats()["extract"]
+        assert stats == {
+            "queued": 1,
+            "queued_by_priority": {"interactive": 1, "batch": 0, "background": 0},
+            "busy": 1,
+            "workers": 1,
+        }
+        assert not any(task.done() for task in tasks)
+
+        converter.extract_gate.set()
+        results = await asyncio.gather(*tasks)
+        assert sorted(r.title for r in results) == [
+            f"text of {n}.pdf" for n in range(4)
+        ]
+    finally:
+        await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_pipeline_serves_interactive_jobs_first():
+    converter = FakeConverter()
+    converter.extract_gate.clear()
+    pipeline = ConversionPipeline(converter, workers={"extract": 1}, queue_size=4)
+    try:
+        with priority_scope("batch"):
+            bulk = [
+                asyncio.create_task(pipeline.convert_from_pdf(f"bulk{n}.pdf"))
+                for n in range(3)
+            ]
+            await asyncio.sleep(0.01)
+        upload = asyncio.create_task(pipeline.convert_from_pdf("upload.pdf"))
+        await asyncio.sleep(0.01)
+        assert pipeline.stats()["extract"]["queued_by_priority"]["interactive"] == 1
+
+        converter.extract_gate.set()
+        await asyncio.gather(upload, *bulk)
+        extracted = [path for name, path in converter.calls if name == "extract"]
+        # bulk0 was already running; the upload goes next
+        assert extracted[:2] == ["bulk0.pdf", "upload.pdf"]
+    finally:
+        await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_is_skipped():
+    converter = FakeConverter()
+    converter.extract_gate.clear()
+    pipeline = ConversionPipeline(converter, workers={"extract": 1})
+    try:
+        first = asyncio.create_task(pipeline.convert_from_pdf("a.pdf", "english"))
+        second = asyncio.create_task(pipeline.convert_from_pdf("b.pdf", "english"))
+        await asyncio.sleep(0.05)
+        second.cancel()
+        converter.extract_gate.set()
+        await first
+        await asyncio.sleep(0.05)
+        assert ("extract", "b.pdf") not in converter.calls
+    finally:
+        await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_cancelling_caller_cancels_running_stage():
+    converter = FakeConverter()
+    converter.extract_gate.clear()
+    pipeline = ConversionPipeline(converter, workers={"extract": 1})
+    try:
+        task = asyncio.create_task(pipeline.convert_from_pdf("a.pdf", "english"))
+        await asyncio.sleep(0.05)
+        assert pipeline.stats()["extract"]["busy"] == 1
+        task.cancel()
+        await asyncio.sleep(0.05)
+
+        # The extraction was aborted, nothing ran after it and the worker
+        # is free for the next paper
+        assert pipeline.stats()["extract"]["busy"] == 0
+        assert [name for name, _ in converter.calls] == ["extract"]
+        converter.extract_gate.set()
+        result = await pipeline.convert_from_pdf("b.pdf", "english")
+        assert result.title == "text of b.pdf"
+    finally:
+        await pipeline.stop()
+
+
+def test_select_figures_keeps_largest_in_document_order():
+    sizes = [("a", 10, 10), ("b", 300, 200), ("c", 50, 50), ("d", 200, 100)]
+    figures = [FigureRecord(n, f"{n}.png", w, h) for n, w, h in sizes]
+
+    selected = select_figures(figures + [figures[1]], max_images=2)
+    assert [f.id for f in selected] == ["b", "d"]
+    assert len(select_figures(figures, max_images=6)) == 4
+
+
+def test_figure_record_round_trip():
+    record = FigureRecord("abc", "/data/figures/ab/abc.png", 30, 20, name="fig.png")
+    captioned = record.with_caption("A plot")
+    assert record.caption == "" and captioned.caption == "A plot"
+    assert captioned.markdown == "![A plot](/data/figures/ab/abc.png)"
+    assert FigureRecord.from_dict(captioned.to_dict()) == captioned
+    info = captioned.to_image_info()
+    assert (info.caption, info.url, info.markdown) == (
+        "A plot",
+        captioned.path,
+        captioned.markdown,
+    )
+    assert not hasattr(record, "__dict__")
+
+
+@pytest.mark.asyncio
+async def test_languages_share_one_extraction(pipeline):
+    results = await pipeline.convert_from_pdf_languages(
+        "a.pdf", ["english", "chinese"], paper_id="p1"
+    )
+
+    assert {lang: r.language for lang, r in results.items()} == {
+        "english": "english",
+        "chinese": "chinese",
+    }
+    names = [name for name, _ in pipeline.converter.calls]
+    assert names.count("extract") == names.count("caption") == 1
+    assert names.count("generate") == names.count("persist") == 2
+
+
+def test_parse_languages():
+    assert parse_languages(["english, chinese", "chinese", " ", "japanese"]) == [
+        "english",
+        "chinese",
+        "japanese",
+    ]
@@ -0,0 +1,98 @@
+import time
+import tracemalloc
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import main
+from paper2blog.profiling import (
+    ProfileRegistry,
+    ProfilingMiddleware,
+    current_profile,
+    profiles,
+    section,
+)
+
+
+def _busy(seconds: float) -> None:
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def test_sections_do_nothing_without_a_profile():
+    with section("extract"):
+        pass
+    assert current_profile() is None and not tracemalloc.is_tracing()
+
+
+def test_profile_records_stack_samples_and_sections():
+    registry = ProfileRegistry(keep=1)
+
+    with registry.profiling("convert") as profile:
+        _busy(0.1)
+        with section("llm_prompt"):
+            blob = [bytes(1000) for _ in range(1000)]
+
+    assert not tracemalloc.is_tracing()
+    assert registry.recent() == [profile]
+    assert profile.duration >= 0.1
+    assert any("_busy (test_profiling.py" in stack for stack in profile.samples)
+    line = profile.folded().splitlines()[0]
+    assert line.rsplit(" ", 1)[1].isdigit()
+
+    (recorded,) = profile.sections
+    assert recorded["name"] == "llm_prompt"
+    assert recorded["memory_delta_bytes"] >= 1000 * len(blob)
+    assert "test_profiling.py" in recorded["top_allocations"][0]["line"]
+
+    with registry.profiling("second"):
+        pass
+    assert registry.get(profile.id) is None
+
+
+def _client(admin_token):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, admin_token=admin_token)
+
+    @app.get("/work")
+    async def work():
+        with section("extract"):
+            return {"profiled": current_profile() is not None}
+
+    return TestClient(app)
+
+
+def test_requests_opt_in_with_header_and_admin_token():
+    client = _client("secret")
+
+    plain = client.get("/work", headers={"X-Paper2Blog-Profile": "1"})
+    assert plain.json() == {"profiled": False}
+    assert "x-profile-id" not in plain.headers
+
+    profiled = client.get(
+        "/work", headers={"X-Paper2Blog-Profile": "1", "X-Admin-Token": "secret"}
+    )
+    assert profiled.json() == {"profiled": True}
+    profile = profiles.get(profiled.headers["x-profile-id"])
+    assert [s["name"] for s in profile.sections] == ["extract"]
+
+
+def test_admin_endpoints_need_the_token(monkeypatch):
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.get("/admin/profiles").status_code == 404
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    assert client.get("/admin/profiles").status_code == 403
+
+    with profiles.profiling("test") as profile:
+        _busy(0.02)
+    headers = {"X-Admin-Token": "secret"}
+    listing = client.get("/admin/profiles", headers=headers).json()
+    assert listing["profiles"][0]["id"] == profile.id
+
+    report = client.get(f"/admin/profiles/{profile.id}", headers=headers)
+    assert report.json()["samples"] == sum(profile.samples.values())
+    folded = client.get(f"/admin/profiles/{profile.id}/folded", headers=headers)
+    assert folded.headers["content-type"].startswith("text/plain")
+    assert folded.text == profile.folded()
+    assert client.get("/admin/profiles/missing", headers=headers).status_code == 404
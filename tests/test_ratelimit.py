@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from paper2blog.ratelimit import (
+    AdaptiveConcurrency,
+    ProviderLimiter,
+    TokenBucket,
+    count_tokens,
+    estimate_tokens,
+    is_retryable,
+    retry_after_of,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock)  # one token per second
+
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    clock.now = 2.0
+    assert bucket.reserve(2) == 0.0
+
+
+def test_token_bucket_pause():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock)
+    bucket.pause(5)
+    assert bucket.reserve(1) == pytest.approx(5.0)
+
+
+def test_aimd_adjusts_limit():
+    limiter = AdaptiveConcurrency(initial=8, minimum=1, maximum=10)
+    limiter.in_flight = 1
+    limiter.release(overloaded=True)
+    assert limiter.limit == 4
+    limiter.in_flight = 1
+    limiter.release()
+    assert limiter.limit == pytest.approx(4.25)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_blocks_until_release():
+    limiter = AdaptiveConcurrency(initial=1, maximum=1)
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done() and limiter.waiting == 1
+    limiter.release()
+    await asyncio.wait_for(waiter, 1)
+    assert limiter.in_flight == 1
+
+
+def test_retry_after_parsing():
+    assert retry_after_of(ProviderError(429, {"retry-after": "3"})) == 3.0
+    assert retry_after_of(ProviderError(429, {"retry-after-ms": "250"})) == 0.25
+    assert retry_after_of(ProviderError(429)) is None
+    assert is_retryable(ProviderError(429))
+    assert not is_retryable(ProviderError(400))
+
+
+@pytest.mark.asyncio
+async def test_limiter_retries_rate_limited_calls():
+    limiter = ProviderLimiter("test", base_delay=0.0)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ProviderError(429, {"retry-after": "0"})
+        return "ok"
+
+    assert await limiter.call(flaky) == "ok"
+    snapshot = limiter.snapshot()
+    assert snapshot["retries"] == 2 and snapshot["rate_limited"] == 2
+    assert snapshot["in_flight"] == 0
+    assert limiter.concurrency.limit < 8
+
+
+@pytest.mark.asyncio
+async def test_limiter_does_not_retry_client_errors():
+    limiter = ProviderLimiter("test", base_delay=0.0)
+
+    async def bad_request():
+        raise ProviderError(400)
+
+    with pytest.raises(ProviderError):
+        await limiter.call(bad_request)
+    assert limiter.snapshot()["failures"] == 1
+
+
+def test_token_counts_by_script():
+    assert count_tokens("") == 0
+    assert count_tokens("a" * 40) == 10
+    # CJK text is about one token per character, not four characters
+    assert count_tokens("稀疏注意力机制") == 7
+    assert count_tokens("GPU 加速") == 1 + 2
+    messages = [{"role": "user", "content": [{"type": "text", "text": "a" * 8}]}]
+    assert estimate_tokens(messages, 100) == 102
@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from paper2blog.ratelimit import AdaptiveConcurrency
+from paper2blog.scheduling import (
+    FairQueue,
+    FairShare,
+    current_priority,
+    parse_priority,
+    priority_scope,
+)
+
+
+def test_fair_share_follows_weights():
+    share = FairShare({"interactive": 3, "batch": 1})
+    served = [share.pick(["interactive", "batch"]) for _ in range(8)]
+    assert served.count("interactive") == 6 and served.count("batch") == 2
+    assert share.pick([]) is None
+
+
+def test_idle_class_does_not_bank_credit():
+    share = FairShare({"interactive": 1, "batch": 1})
+    for _ in range(10):
+        share.pick(["batch"])
+    share.activate("interactive")
+    served = [share.pick(["interactive", "batch"]) for _ in range(4)]
+    # Without the reset it would take the next ten picks
+    assert served.count("batch") >= 1
+
+
+def test_priority_scope_and_parsing():
+    assert current_priority() == "interactive"
+    with priority_scope("Batch") as priority:
+        assert priority == current_priority() == "batch"
+    assert current_priority() == "interactive"
+    with pytest.raises(ValueError):
+        parse_priority("urgent")
+
+
+@pytest.mark.asyncio
+async def test_fair_queue_bounds_each_class_separately():
+    queue = FairQueue(maxsize=1, weights={"interactive": 4, "batch": 1})
+    await queue.put("bulk-1", "batch")
+    blocked = asyncio.ensure_future(queue.put("bulk-2", "batch"))
+    await asyncio.sleep(0)
+    assert not blocked.done()
+
+    # A full batch queue does not hold up interactive work
+    await asyncio.wait_for(queue.put("upload", "interactive"), 1)
+    assert queue.sizes() == {"interactive": 1, "batch": 1}
+
+    assert await queue.get() == "upload"
+    assert await queue.get() == "bulk-1"
+    await blocked
+    assert await queue.get() == "bulk-2"
+
+
+@pytest.mark.asyncio
+async def test_fair_queue_interleaves_by_weight():
+    queue = FairQueue(weights={"interactive": 2, "batch": 1})
+    for n in range(4):
+        queue.put_nowait(f"b{n}", "batch")
+        queue.put_nowait(f"i{n}", "interactive")
+    order = [await queue.get() for _ in range(6)]
+    assert order == ["i0", "b0", "i1", "i2", "b1", "i3"]
+
+
+@pytest.mark.asyncio
+async def test_freed_slots_favour_interactive_callers():
+    concurrency = AdaptiveConcurrency(initial=1, maximum=1)
+    await concurrency.acquire()
+    order = []
+
+    async def call(name, priority):
+        with priority_scope(priority):
+            await concurrency.acquire()
+        order.append(name)
+        concurrency.release()
+
+    waiters = [asyncio.ensure_future(call(f"batch-{n}", "batch")) for n in range(3)]
+    await asyncio.sleep(0)
+    waiters.append(asyncio.ensure_future(call("upload", "interactive")))
+    await asyncio.sleep(0)
+    assert concurrency.waiting_by_priority()["batch"] == 3
+
+    concurrency.release()
+    await asyncio.gather(*waiters)
+    assert order.index("upload") <= 1
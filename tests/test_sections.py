@@ -0,0 +1,147 @@
+import io
+import json
+import pytest
+import pytest_asyncio
+from PIL import Image
+from unittest.mock import AsyncMock
+from paper2blog.converter import PaperConverter
+from paper2blog.executors import configure_executors
+from paper2blog.llm_handler import LLMHandler, relevant_excerpt
+from paper2blog.model_types import BlogSection, FigurePlacement, GeneratedBlog
+from paper2blog.storage import PaperStore, parse_conversion_id
+from paper2blog.utils import store_figure
+
+PAPER = "\n\n".join(
+    [
+        "# Sparse Attention",
+        "We route each query to a few keys with a learned router.",
+        "Related work covers kernels and low-rank approximations.",
+        "Latency drops by half on long sequences.",
+    ]
+)
+
+
+@pytest.fixture(autouse=True)
+def setup_environment():
+    configure_executors(cpu=0)
+    yield
+    configure_executors(None, None)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PaperStore(tmp_path / "data")
+
+
+@pytest_asyncio.fixture
+async def converted(store):
+    buffer = io.BytesIO()
+    Image.new("RGB", (30, 20), color="red").save(buffer, format="PNG")
+    figure = store_figure(store, buffer.getvalue(), "_page_1_Figure_0.png")
+    images = [figure.with_caption("The router")]
+    paper_id, _ = store.save_paper(b"%PDF-1.4 paper")
+
+    converter = PaperConverter(store)
+    converter.llm_handler = LLMHandler(router=AsyncMock())
+    blog = GeneratedBlog(
+        title="Fast Attention",
+        sections=[
+            BlogSection(heading="Background", content="Attention is slow."),
+            BlogSection(heading="Method", content="A router.\n\nIt is learned."),
+            BlogSection(heading="Results", content="Twice as fast."),
+        ],
+        summary="It works.",
+        figures=[FigurePlacement(figure=1, section=1, paragraph=0)],
+    )
+    result = converter._build_response(blog, "english", images)
+    await converter.save_extraction(paper_id, PAPER, images)
+    await converter.save_result(paper_id, "paper.pdf", "english", result)
+    return converter, result
+
+
+@pytest.mark.asyncio
+async def test_regenerate_section_patches_stored_post(store, converted):
+    converter, result = converted
+    router = converter.llm_handler.router
+    router.complete.return_value = json.dumps(
+        {"heading": "Method", "content": "A learned router.\n\nIt picks keys."}
+    )
+
+    patched = await converter.regenerate_section(
+        result.conversion_id, "method", "Be brief"
+    )
+
+    # One short call carrying the neighbours, the figure and the instructions
+    router.complete.assert_awaited_once()
+    stage, messages = router.complete.await_args.args
+    prompt = messages[1]["content"]
+    assert stage == "section"
+    assert "Attention is slow." in prompt and "Twice as fast." in prompt
+    assert "Figure 1: The router" in prompt and "Be brief" in prompt
+    assert "learned router" in prompt
+
+    assert [s.content for s in patched.sections] == [
+        "Attention is slow.",
+        "A learned router.\n\nIt picks keys.",
+        "Twice as fast.",
+    ]
+    assert "A learned router.\n\n![The router](" in patched.content
+    assert patched.conversion_id == result.conversion_id
+    paper_id, language = parse_conversion_id(result.conversion_id)
+    assert (store.conversion_dir(paper_id, language) / "blog.md").read_text(
+        encoding="utf-8"
+    ) == patched.content
+    metadata = store.load_conversion(paper_id, language)
+    assert metadata["post"]["sections"][1]["content"].startswith("A learned")
+
+
+def test_images_link_public_figure_urls(store, converted):
+    _, result = converted
+    image = result.images[0]
+    assert image.url.startswith("http://localhost:8000/figures/")
+    assert image.url.split("?")[0].endswith(".webp")
+    assert image.markdown == f"![The router]({image.url})"
+    assert str(store.root) not in image.url
+
+    # The stored post still references the figure file, for GC
+    paper_id, language = parse_conversion_id(result.conversion_id)
+    [figure] = store.load_conversion(paper_id, language)["figures"]
+    assert figure.startswith("figures/") and figure.endswith(".png")
+
+
+@pytest.mark.asyncio
+async def test_regenerate_accepts_index_and_plain_markdown(converted):
+    converter, result = converted
+    converter.llm_handler.router.complete.return_value = "## Findings\n\nFaster."
+
+    patched = await converter.regenerate_section(result.conversion_id, "2")
+
+    assert patched.sections[2] == BlogSection(heading="Findings", content="Faster.")
+
+
+@pytest.mark.asyncio
+async def test_unknown_conversion_or_section(converted):
+    converter, result = converted
+    with pytest.raises(KeyError):
+        await converter.regenerate_section(result.conversion_id, "Appendix")
+    with pytest.raises(KeyError):
+        await converter.regenerate_section("0" * 64 + "-english", "0")
+    with pytest.raises(KeyError):
+        await converter.regenerate_section("../etc-english", "0")
+    converter.llm_handler.router.complete.assert_not_awaited()
+
+
+def test_relevant_excerpt_keeps_matching_paragraphs_in_order():
+    assert relevant_excerpt(PAPER, "anything", 10_000) == PAPER
+    excerpt = relevant_excerpt(PAPER, "learned router latency", 120)
+    assert excerpt == (
+        "We route each query to a few keys with a learned router.\n\n"
+        "Latency drops by half on long sequences."
+    )
+    assert relevant_excerpt(PAPER, "zzz", 20) == PAPER[:20]
+
+
+def test_relevant_excerpt_truncates_an_oversized_best_match():
+    text = "Short intro.\n\n" + "The learned router " * 20 + "\n\nUnrelated."
+    excerpt = relevant_excerpt(text, "learned router", 40)
+    assert excerpt == ("The learned router " * 3)[:40]
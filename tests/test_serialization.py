@@ -0,0 +1,48 @@
+import json
+import pytest
+from paper2blog import serialization
+from paper2blog.model_types import ConversionResponse, ImageInfo
+from paper2blog.records import FigureRecord
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def backend(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(serialization, "orjson", None)
+    elif not serialization.HAS_ORJSON:
+        pytest.skip("orjson not installed")
+    return request.param
+
+
+def test_round_trip_models_and_records(backend):
+    response = ConversionResponse(
+        title="标题",
+        content="# Post\n\nText",
+        language="chinese",
+        images=[ImageInfo(caption="图", url="a.png", markdown="![图](a.png)")],
+    )
+    payload = {"response": response, "figure": FigureRecord("abc", "a.png", 3, 2)}
+
+    data = serialization.dumps(payload)
+    assert isinstance(data, bytes)
+    # Non-ASCII text is written as UTF-8, not \\u escapes
+    assert "标题".encode("utf-8") in data
+
+    decoded = serialization.loads(data)
+    assert ConversionResponse(**decoded["response"]) == response
+    assert FigureRecord.from_dict(decoded["figure"]) == payload["figure"]
+    assert serialization.loads(data.decode("utf-8")) == decoded
+
+
+def test_indent_matches_stdlib_layout(backend):
+    metadata = {"paper_id": "abc", "figures": ["figures/ab/abc.png"]}
+    assert serialization.dumps(metadata, indent=True).decode() == json.dumps(
+        metadata, indent=2
+    )
+
+
+def test_invalid_input_raises_value_error(backend):
+    with pytest.raises(ValueError):
+        serialization.loads(b"{not json")
+    with pytest.raises(TypeError):
+        serialization.dumps({"x": object()})
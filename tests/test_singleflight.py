@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from paper2blog.singleflight import SingleFlight, conversion_key
+
+
+def test_conversion_key():
+    assert conversion_key(b"pdf", "English") == conversion_key(b"pdf", "english ")
+    assert conversion_key(b"pdf", "en") != conversion_key(b"pdf", "zh")
+    assert conversion_key(b"a", "en") != conversion_key(b"b", "en")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_run():
+    flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def convert():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "result"
+
+    waiters = [asyncio.ensure_future(flight.do("k", convert)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert "k" in flight
+    release.set()
+
+    assert await asyncio.gather(*waiters) == ["result"] * 5
+    assert calls == 1
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_and_key_is_released():
+    flight = SingleFlight()
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await flight.do("k", fail)
+    await asyncio.sleep(0)
+    assert "k" not in flight
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_work():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def convert():
+        await release.wait()
+        return 42
+
+    first = asyncio.ensure_future(flight.do("k", convert))
+    second = asyncio.ensure_future(flight.do("k", convert))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+
+    assert await second == 42
+
+
+@pytest.mark.asyncio
+async def test_last_caller_leaving_cancels_shared_work():
+    flight = SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def convert():
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiters = [asyncio.ensure_future(flight.do("k", convert)) for _ in range(2)]
+    await started.wait()
+    waiters[0].cancel()
+    await asyncio.sleep(0)
+    assert not cancelled.is_set()
+
+    waiters[1].cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.sleep(0)
+    assert "k" not in flight
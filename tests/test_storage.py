@@ -0,0 +1,90 @@
+import json
+import os
+import time
+import pytest
+from paper2blog.storage import PaperStore, atomic_write
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PaperStore(tmp_path)
+
+
+def test_papers_are_content_addressed(store):
+    first_id, first_path = store.save_paper(b"%PDF one")
+    second_id, second_path = store.save_paper(b"%PDF two")
+
+    assert first_id != second_id
+    assert first_path.read_bytes() == b"%PDF one"
+    assert second_path.read_bytes() == b"%PDF two"
+    assert first_path.parent.parent.name == first_id[:2]
+    assert store.save_paper(b"%PDF one") == (first_id, first_path)
+
+
+def test_figures_are_deduplicated(store):
+    first = store.save_figure(b"png bytes", "_page_1_Figure_1.png")
+    second = store.save_figure(b"png bytes", "_page_3_Figure_2.png")
+
+    assert first == second
+    assert len(list(store.figures_dir.rglob("*.png"))) == 1
+    assert store.public_url(str(first)) == (
+        f"http://localhost:8000/figures/{first.stem}.webp?w=1280"
+    )
+    assert store.find_figure(first.stem) == first
+
+
+def test_atomic_write_leaves_no_temp_files(tmp_path):
+    target = tmp_path / "nested" / "file.md"
+    atomic_write(target, "hello")
+    atomic_write(target, "world")
+
+    assert target.read_text() == "world"
+    assert os.listdir(target.parent) == ["file.md"]
+
+
+def _add_conversion(store, content, figure_bytes):
+    paper_id, _ = store.save_paper(content)
+    figure = store.save_figure(figure_bytes, "fig.png")
+    store.save_conversion(
+        paper_id, "en", "# blog", {"figures": [store.relative(figure)]}
+    )
+    return paper_id, figure
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    for p in [path] + list(path.rglob("*")):
+        os.utime(p, (old, old))
+
+
+def test_gc_removes_expired_papers_and_orphaned_figures(store):
+    old_id, old_figure = _add_conversion(store, b"old", b"old figure")
+    new_id, new_figure = _add_conversion(store, b"new", b"new figure")
+    _age(store.paper_dir(old_id), 10 * 24 * 3600)
+    _age(old_figure, 10 * 24 * 3600)
+
+    stats = store.gc(ttl_seconds=7 * 24 * 3600)
+
+    assert stats["papers"] == 1 and stats["figures"] == 1
+    assert not store.paper_dir(old_id).exists() and not old_figure.exists()
+    assert store.paper_dir(new_id).exists() and new_figure.exists()
+
+
+def test_gc_evicts_least_recently_used_over_quota(store):
+    old_id, old_figure = _add_conversion(store, b"a" * 1000, b"x" * 1000)
+    new_id, _ = _add_conversion(store, b"b" * 1000, b"y" * 1000)
+    _age(store.paper_dir(old_id), 2 * 3600)
+    _age(old_figure, 2 * 3600)
+
+    stats = store.gc(max_bytes=3000)
+
+    assert not store.paper_dir(old_id).exists()
+    assert store.paper_dir(new_id).exists()
+    assert stats["usage_bytes"] <= 3000
+
+
+def test_gc_keeps_fresh_unreferenced_figures(store):
+    # Figures of a conversion still in progress have no metadata yet
+    figure = store.save_figure(b"in progress", "fig.png")
+    store.gc(ttl_seconds=0)
+    assert figure.exists()
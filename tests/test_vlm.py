@@ -1,5 +1,6 @@
 import pytest
 import base64
+from paper2blog.backends import ModelRouter, OpenAIBackend
 from paper2blog.vlm_handler import VLMHandler
 from PIL import Image
 import io
@@ -46,7 +47,9 @@ async def test_generate_caption_empty_text(vlm_handler, sample_image_data):
 @pytest.mark.asyncio
 async def test_api_error_handling(vlm_handler):
     # Test with invalid API key
-    vlm_handler.api_key = "invalid_key"
+    vlm_handler.router = ModelRouter(
+        {"caption": [(OpenAIBackend(api_key="invalid_key", base_url="https://api.siliconflow.cn/v1"), "deepseek-ai/deepseek-vl2")]}
+    )
     
     with pytest.raises(Exception) as exc_info:
         await vlm_handler.generate_caption("test", b"test")
@@ -0,0 +1,87 @@
+import json
+import pytest
+from unittest.mock import AsyncMock
+from paper2blog.vlm_handler import VLMHandler, parse_batch_captions, split_batches
+
+
+def _handler(replies, batch_size=4, batch_bytes=10**6):
+    router = AsyncMock()
+    router.complete = AsyncMock(side_effect=replies)
+    return VLMHandler(router=router, batch_size=batch_size, batch_bytes=batch_bytes)
+
+
+def _images(messages):
+    return [p for p in messages[0]["content"] if p["type"] == "image_url"]
+
+
+def test_split_batches_by_count_and_size():
+    assert split_batches(["a"] * 5, 2, 100) == [[0, 1], [2, 3], [4]]
+    assert split_batches(["x" * 60, "x" * 60, "x" * 10], 4, 100) == [[0], [1, 2]]
+    # An oversized figure still gets a batch of its own
+    assert split_batches(["x" * 500, "y"], 4, 100) == [[0], [1]]
+
+
+def test_parse_batch_captions():
+    reply = (
+        '```json\n{"captions": [{"figure": 2, "caption": "B"}, '
+        '{"figure": 1, "caption": "A\\nx"}]}\n```'
+    )
+    assert parse_batch_captions(reply, 2) == ["A x", "B"]
+    assert parse_batch_captions('{"captions": ["A", "B"]}', 2) == ["A", "B"]
+    for bad in [
+        '{"captions": ["A"]}',
+        "no json",
+        '{"captions": ["A", ""]}',
+        "[1, 2]",
+        '{"captions": [{"figure": null, "caption": "A"}, "B"]}',
+    ]:
+        with pytest.raises(ValueError):
+            parse_batch_captions(bad, 2)
+
+
+@pytest.mark.asyncio
+async def test_batch_sends_excerpt_once():
+    reply = json.dumps({"captions": [f"Figure {i}" for i in range(1, 4)]})
+    handler = _handler([reply])
+
+    captions = await handler.generate_captions("excerpt", [b"a", b"b", b"c"])
+
+    assert captions == ["Figure 1", "Figure 2", "Figure 3"]
+    handler.router.complete.assert_awaited_once()
+    stage, messages = handler.router.complete.await_args.args
+    assert stage == "caption"
+    assert len(_images(messages)) == 3
+    assert sum("excerpt" in p.get("text", "") for p in messages[0]["content"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_unparseable_batch_falls_back_to_single_requests():
+    handler = _handler(["Sorry, here you go: A and B", "A", RuntimeError("down")])
+
+    captions = await handler.generate_captions("excerpt", [b"a", b"b"])
+
+    assert captions == ["A", None]
+    assert handler.router.complete.await_count == 3
+    single_calls = handler.router.complete.await_args_list[1:]
+    assert all(len(_images(call.args[1])) == 1 for call in single_calls)
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_batch_is_left_uncaptioned():
+    class RateLimited(Exception):
+        status_code = 429
+
+    handler = _handler([RateLimited("slow down"), "A", "B", "C"])
+
+    captions = await handler.generate_captions("excerpt", [b"a", b"b", b"c"])
+
+    assert captions == [None, None, None]
+    # Not retried as one request per figure
+    handler.router.complete.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_batch_size_one_uses_single_requests():
+    handler = _handler(["A", "B"], batch_size=1)
+    assert await handler.generate_captions("excerpt", [b"a", b"b"]) == ["A", "B"]
+    assert handler.router.complete.await_count == 2